@@ -0,0 +1,326 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   botBench.py -- time the main paths through a bot, offline.
+
+   A bot is pointed (with the 'apiUrl' setting) at the local server in
+   fakeTwitter.py, and each of these is measured in a fresh bot directory:
+
+   - run: a complete forced `Run()` -- load settings, connect, tweet, handle
+     mentions, save state.
+   - mentions: `HandleMentions()` with a backlog of N mentions.
+   - async: the same, with an AsyncNanobot whose HandleOneMention() is a
+     coroutine.
+   - spool / journal: `HandleStreamEvents()` with N saved stream events.
+   - ingest: a streamer taking N events from the (fake) user stream and
+     saving them for the cron process.
+   - log: N calls to `Log()`, then a flush.
+   - settings: loading and writing a settings file with N keys.
+
+   The fake server's rate limits are set high enough that they're never hit,
+   and the bot's shared write budget is turned off, unless `--real-limits` 
+   is given. Without it, a benchmark that doesn't make all of the API calls
+   that it should have fails, since it isn't measuring what we think it is.
+   `--latency` adds a delay to every API call, which is the easiest way to 
+   see how much a change depends on the network.
+
+   Results are printed, and if `--output` is given they're also appended to
+   that file as one json object per line (like startupBench.py does), so
+   that later runs can be compared against earlier ones.
+
+   python bench/botBench.py --runs 5 --sizes 10,1000,50000
+'''
+
+from datetime import datetime
+from time import time
+
+import json
+import os.path
+import shutil
+import sys
+import tempfile
+
+kRepoPath = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, kRepoPath)
+
+from fakeTwitter import FakeTwitter
+from fakeTwitter import MakeEvent
+from fakeTwitter import kRateLimits
+from nanobot.asyncBot import AsyncNanobot
+from nanobot.jsonSettings import JsonSettings
+from nanobot.nanobot import Nanobot
+from nanobot.nanobot import kStreamFileExtension
+from nanobot.streamer import NanobotStreamer
+
+# number of mentions in the timeline for the 'run' benchmark.
+kRunMentions = 20
+
+
+class BenchBot(Nanobot):
+   def GenerateTweet(self):
+      return {"status": u"benchmark tweet at {0}".format(time())}
+
+   def Handle_follow(self, data):
+      self.Log("Follow", [data["source"]["screen_name"]])
+
+
+class AsyncBenchBot(AsyncNanobot):
+   def HandleOneMention(self, mention):
+      yield self.api.create_favorite(id=mention['id_str'])
+
+
+class BenchError(Exception):
+   pass
+
+
+class BenchStreamer(NanobotStreamer):
+   ''' hangs up after it's seen `target` events. '''
+   def on_success(self, data):
+      NanobotStreamer.on_success(self, data)
+      self.received += 1
+      if self.received >= self.target:
+         self.disconnect()
+
+
+class Bench(object):
+   def __init__(self, fake, runs, realLimits=False):
+      self.fake = fake
+      self.runs = runs
+      self.realLimits = realLimits
+      self.results = {}
+      self.bot = None
+      self.botDir = None
+
+   def MakeBot(self, extraSettings=None, botClass=BenchBot, **args):
+      ''' a new BenchBot (or `botClass`) in a new, empty directory. '''
+      self.Cleanup()
+      self.botDir = tempfile.mkdtemp()
+      settings = {
+         "appKey": "x", "appSecret": "x", "accessToken": "x",
+         "accessTokenSecret": "x", "apiUrl": self.fake.ApiUrl(),
+         "logFilePath": "bench.log",
+      }
+      if not self.realLimits:
+         settings["writeBudget"] = 0
+      settings.update(extraSettings or {})
+      with open(os.path.join(self.botDir, "benchbot.json"), "wt") as f:
+         f.write(json.dumps(settings))
+      argDict = {"botPath": self.botDir, "botName": "benchbot"}
+      argDict.update(args)
+      self.bot = botClass(argDict)
+      return self.bot
+
+   def Measure(self, name, setup, body, count=1):
+      '''
+         Call `setup()` and then time `body(setup's return value)`, `runs`
+         times. `count` is the number of things that each call to body
+         handles, used to report a rate.
+      '''
+      times = []
+      for i in range(self.runs):
+         self.fake.Reset()
+         state = setup()
+         start = time()
+         body(state)
+         times.append(time() - start)
+      times.sort()
+      median = times[len(times) // 2]
+      self.results[name] = {"median": median, "best": times[0], "count": count}
+      rate = ""
+      if count > 1:
+         rate = "{0:10.0f}/sec".format(count / median) if median else ""
+      print "{0:<20}median {1:9.1f}ms   best {2:9.1f}ms {3}".format(name,
+         median * 1000, times[0] * 1000, rate)
+
+   def Cleanup(self):
+      ''' remove the last bot's directory (once its log is written out) '''
+      if self.bot and self.bot.logger:
+         self.bot.logger.Close()
+      if isinstance(self.bot, AsyncNanobot):
+         self.bot.CloseLoop()
+      self.bot = None
+      if self.botDir:
+         shutil.rmtree(self.botDir)
+         self.botDir = None
+
+   ##
+   ## The benchmarks
+   ##
+
+   def BenchRun(self, sizes):
+      def Setup():
+         self.fake.mentions = kRunMentions
+         return self.MakeBot(force=True)
+      self.Measure("run", Setup, lambda bot: bot.Run())
+      self.Check(len(self.fake.statuses) == 1 and
+         len(self.fake.favorites) == kRunMentions, "run")
+
+   def BenchMentions(self, sizes):
+      for size in sizes:
+         def Setup():
+            self.fake.mentions = size
+            bot = self.MakeBot()
+            bot.LoadSettings()
+            bot.Connect()
+            return bot
+         self.Measure("mentions {0}".format(size), Setup,
+            lambda bot: bot.HandleMentions(), size)
+         self.Check(len(self.fake.favorites) == size, "mentions")
+
+   def BenchAsync(self, sizes):
+      for size in sizes:
+         def Setup():
+            self.fake.mentions = size
+            bot = self.MakeBot(botClass=AsyncBenchBot)
+            bot.LoadSettings()
+            bot.Connect()
+            return bot
+         self.Measure("async mentions {0}".format(size), Setup,
+            lambda bot: bot.HandleMentions(), size)
+         self.Check(len(self.fake.favorites) == size, "async")
+
+   def BenchSpool(self, sizes):
+      for size in sizes:
+         def Setup():
+            bot = self.MakeBot()
+            bot.LoadSettings()
+            for i in range(size):
+               path = os.path.join(self.botDir, "{0:08d}{1}".format(i,
+                  kStreamFileExtension))
+               with open(path, "wt") as f:
+                  f.write(json.dumps(MakeEvent(i)))
+            return bot
+         self.Measure("spool {0}".format(size), Setup,
+            lambda bot: bot.HandleStreamEvents(), size)
+
+   def BenchJournal(self, sizes):
+      for size in sizes:
+         def Setup():
+            bot = self.MakeBot({"streamBackend": "journal"})
+            bot.LoadSettings()
+            journal = bot.GetJournal()
+            for i in range(size):
+               journal.Append(MakeEvent(i))
+            journal.Close()
+            return bot
+         self.Measure("journal {0}".format(size), Setup,
+            lambda bot: bot.HandleStreamEvents(), size)
+
+   def BenchIngest(self, sizes):
+      for size in sizes:
+         def Setup():
+            self.fake.streamEvents = size
+            self.MakeBot()
+            streamer = BenchStreamer("x", "x", "x", "x")
+            streamer.SetOutputPath(self.botDir)
+            streamer.received = 0
+            streamer.target = size
+            return streamer
+         self.Measure("ingest {0}".format(size), Setup,
+            lambda streamer: streamer._request(self.fake.StreamUrl(), params={}), size)
+
+   def BenchLog(self, sizes):
+      for size in sizes:
+         def Setup():
+            bot = self.MakeBot()
+            bot.LoadSettings()
+            return bot
+         def Body(bot):
+            for i in range(size):
+               bot.Log("Bench", [str(i), "some data"])
+            bot.logger.Flush()
+         self.Measure("log {0}".format(size), Setup, Body, size)
+
+   def BenchSettings(self, sizes):
+      for size in sizes:
+         settings = dict(("key{0}".format(i), i) for i in range(size))
+         def Setup():
+            self.MakeBot(settings)
+            return os.path.join(self.botDir, "benchbot.json")
+         def Load(path):
+            JsonSettings(path)
+         def Write(path):
+            s = JsonSettings(path)
+            s.key0 = -1
+            s.Write()
+         self.Measure("settings load {0}".format(size), Setup, Load)
+         self.Measure("settings write {0}".format(size), Setup, Write)
+
+   def Check(self, ok, name):
+      ''' did the benchmark `name` make all of the API calls it should have? '''
+      if ok:
+         return
+      if self.realLimits:
+         print "   ({0} ran into the rate limits)".format(name)
+      else:
+         raise BenchError("{0} didn't do all of the expected API calls".format(
+            name))
+
+
+kBenchmarks = ["run", "mentions", "async", "spool", "journal", "ingest", "log",
+   "settings"]
+
+
+def Main():
+   import argparse
+   parser = argparse.ArgumentParser()
+   parser.add_argument("--runs", type=int, default=5,
+      help="number of times to run each measurement")
+   parser.add_argument("--sizes", default="10,1000,50000",
+      help="comma-separated list of sizes for the benchmarks that take one")
+   parser.add_argument("--latency", type=float, default=0,
+      help="seconds that the fake API waits before answering each request")
+   parser.add_argument("--real-limits", action="store_true",
+      help="use twitter's rate limits instead of unlimited ones")
+   parser.add_argument("--output", help="append results to this file")
+   parser.add_argument("benchmarks", nargs="*",
+      help="benchmarks to run: {0} (default: all)".format(", ".join(kBenchmarks)))
+   args = parser.parse_args()
+   for name in args.benchmarks:
+      if name not in kBenchmarks:
+         parser.error("unknown benchmark '{0}'".format(name))
+   sizes = [int(s) for s in args.sizes.split(",")]
+
+   rateLimits = None
+   if not args.real_limits:
+      rateLimits = dict((path, (10 ** 9, window)) for path, (limit, window)
+         in kRateLimits.items())
+   fake = FakeTwitter(latency=args.latency, rateLimits=rateLimits).Start()
+   bench = Bench(fake, args.runs, args.real_limits)
+   try:
+      for name in args.benchmarks or kBenchmarks:
+         getattr(bench, "Bench" + name.capitalize())(sizes)
+   finally:
+      bench.Cleanup()
+      fake.Stop()
+
+   if args.output:
+      results = {"timestamp": str(datetime.now()), "runs": args.runs,
+         "latency": args.latency, "realLimits": args.real_limits}
+      results.update(bench.results)
+      with open(args.output, "at") as f:
+         f.write(json.dumps(results) + "\n")
+
+
+if __name__ == "__main__":
+   Main()
@@ -0,0 +1,282 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   fakeTwitter.py -- a local stand-in for the parts of the twitter API that
+   nanobot uses, so that bots can be run (and timed) without a network
+   connection, credentials, or rate limits that we don't control.
+
+   The server understands:
+
+   - POST 1.1/statuses/update.json
+   - POST 1.1/favorites/create.json
+   - GET  1.1/statuses/mentions_timeline.json (since_id, max_id, count)
+   - GET  1.1/user.json -- a user stream that sends `streamEvents` events,
+     one json object per line, and then hangs up (or goes quiet for
+     `streamStall` seconds first). Connections can be made to fail by
+     putting HTTP status codes in `streamFailures`.
+
+   Every response can be delayed by `latency` seconds, and each REST endpoint
+   has a rate limit budget that's reported in `x-rate-limit-*` headers; once
+   it's used up, calls get a 429 until the window resets.
+
+   To point a bot at it, put the server's `ApiUrl()` in the bot's settings as
+   'apiUrl'. It can also be run by itself:
+
+   python bench/fakeTwitter.py --port 8080 --mentions 1000
+'''
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Lock
+from threading import Thread
+from time import gmtime
+from time import sleep
+from time import strftime
+from time import time
+from urlparse import parse_qs
+from urlparse import urlparse
+
+import json
+
+# path : (rate limit, window in seconds)
+kRateLimits = {
+   "/1.1/statuses/update.json"            : (300, 3 * 60 * 60),
+   "/1.1/favorites/create.json"           : (1000, 24 * 60 * 60),
+   "/1.1/statuses/mentions_timeline.json" : (75, 15 * 60),
+}
+
+
+def MakeMention(theId):
+   return {
+      "id": theId,
+      "id_str": str(theId),
+      "text": u"@nanobot this is mention number {0}".format(theId),
+      "user": {"id_str": str(1000000 + theId % 500),
+         "screen_name": "fan{0}".format(theId % 500)},
+   }
+
+
+def MakeEvent(index):
+   return {
+      "event": "follow",
+      "created_at": strftime("%a %b %d %H:%M:%S +0000 %Y", gmtime()),
+      "source": {"id_str": str(2000000 + index), "screen_name":
+         "follower{0}".format(index)},
+      "target": {"id_str": "1", "screen_name": "nanobot"},
+   }
+
+
+class FakeTwitterHandler(BaseHTTPRequestHandler):
+   # keep-alive, like the real thing.
+   protocol_version = "HTTP/1.1"
+   # buffer each response and send it in one go; writing the headers a line
+   # at a time runs into Nagle's algorithm and adds ~40ms to every call.
+   wbufsize = -1
+
+   def log_message(self, format, *args):
+      pass
+
+   def do_GET(self):
+      self.Handle()
+
+   def do_POST(self):
+      self.Handle()
+
+   def Handle(self):
+      fake = self.server.fake
+      url = urlparse(self.path)
+      args = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+      length = int(self.headers.getheader("content-length") or 0)
+      if length:
+         args.update((k, v[0]) for k, v in
+            parse_qs(self.rfile.read(length)).items())
+
+      if fake.latency:
+         sleep(fake.latency)
+      if url.path == "/1.1/user.json":
+         self.SendStream(fake)
+         return
+
+      status, body, headers = fake.Respond(self.command, url.path, args)
+      payload = json.dumps(body)
+      self.send_response(status)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(payload)))
+      for key, value in headers.items():
+         self.send_header(key, value)
+      self.end_headers()
+      self.wfile.write(payload)
+
+   def SendStream(self, fake):
+      with fake.lock:
+         fake.streamConnections += 1
+         status = fake.streamFailures.pop(0) if fake.streamFailures else 200
+      if status != 200:
+         payload = "Exceeded connection limit for user"
+         self.send_response(status)
+         self.send_header("Content-Length", str(len(payload)))
+         self.end_headers()
+         self.wfile.write(payload)
+         return
+      self.send_response(200)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Connection", "close")
+      self.end_headers()
+      for i in range(fake.streamEvents):
+         self.wfile.write(json.dumps(MakeEvent(i)) + "\r\n")
+      self.wfile.flush()
+      if fake.streamStall:
+         sleep(fake.streamStall)
+      self.close_connection = 1
+
+
+class ThreadedServer(ThreadingMixIn, HTTPServer):
+   daemon_threads = True
+   # (the default listen backlog is 5; a bot with dozens of calls in flight
+   # opens connections faster than that, and the ones that don't fit are 
+   # retried a second later)
+   request_queue_size = 128
+
+
+class FakeTwitter(object):
+   def __init__(self, mentions=0, streamEvents=0, latency=0, rateLimits=None,
+         port=0, streamStall=0):
+      '''
+         mentions: the number of mentions in our mentions timeline (ids are
+            1..mentions)
+         streamEvents: the number of events that the user stream sends
+         latency: seconds to wait before answering each request
+         rateLimits: overrides for entries in `kRateLimits`
+         port: port to listen on (0 == pick a free one)
+         streamStall: seconds that the user stream goes quiet for before
+            hanging up
+      '''
+      self.mentions = mentions
+      self.streamEvents = streamEvents
+      self.streamStall = streamStall
+      # HTTP status codes to fail the next stream connections with
+      self.streamFailures = []
+      self.latency = latency
+      self.rateLimits = dict(kRateLimits)
+      self.rateLimits.update(rateLimits or {})
+      self.port = port
+      self.lock = Lock()
+      self.Reset()
+      self.server = None
+
+   def Reset(self):
+      ''' forget all of the calls that have been made so far. '''
+      self.windows = {}
+      self.counts = {}
+      self.statuses = []
+      self.favorites = []
+      self.streamConnections = 0
+
+   def Start(self):
+      self.server = ThreadedServer(("127.0.0.1", self.port), FakeTwitterHandler)
+      self.server.fake = self
+      self.port = self.server.server_address[1]
+      thread = Thread(target=self.server.serve_forever)
+      thread.daemon = True
+      thread.start()
+      return self
+
+   def Stop(self):
+      if self.server:
+         self.server.shutdown()
+         self.server.server_close()
+         self.server = None
+
+   def ApiUrl(self):
+      ''' the value to use as a bot's 'apiUrl' setting. '''
+      return "http://127.0.0.1:{0}/%s".format(self.port)
+
+   def StreamUrl(self):
+      return "http://127.0.0.1:{0}/1.1/user.json".format(self.port)
+
+   def UseBudget(self, path):
+      '''
+         Count a call against the endpoint's budget. Returns (allowed,
+         headers).
+      '''
+      limit, window = self.rateLimits[path]
+      now = time()
+      reset, used = self.windows.get(path, (now + window, 0))
+      if now >= reset:
+         reset, used = now + window, 0
+      allowed = used < limit
+      if allowed:
+         used += 1
+      self.windows[path] = (reset, used)
+      return allowed, {
+         "x-rate-limit-limit": str(limit),
+         "x-rate-limit-remaining": str(limit - used),
+         "x-rate-limit-reset": str(int(reset)),
+      }
+
+   def Respond(self, method, path, args):
+      ''' return (status, body, headers) for a REST API call. '''
+      with self.lock:
+         self.counts[path] = self.counts.get(path, 0) + 1
+         if path not in self.rateLimits:
+            return 404, {"errors": [{"code": 34,
+               "message": "Sorry, that page does not exist"}]}, {}
+         allowed, headers = self.UseBudget(path)
+         if not allowed:
+            return 429, {"errors": [{"code": 88,
+               "message": "Rate limit exceeded"}]}, headers
+
+         if path == "/1.1/statuses/update.json":
+            self.statuses.append(args.get("status", ""))
+            return 200, {"id_str": str(len(self.statuses)),
+               "text": args.get("status", "")}, headers
+         if path == "/1.1/favorites/create.json":
+            self.favorites.append(args.get("id"))
+            return 200, MakeMention(int(args.get("id", 0))), headers
+
+      # mentions_timeline: newest first, since_id < id <= max_id
+      count = min(int(args.get("count", 20)), 200)
+      newest = min(self.mentions, int(args.get("max_id", self.mentions)))
+      oldest = max(int(args.get("since_id", 0)), newest - count)
+      return 200, [MakeMention(i) for i in range(newest, oldest, -1)], headers
+
+
+if __name__ == "__main__":
+   import argparse
+   parser = argparse.ArgumentParser()
+   parser.add_argument("--port", type=int, default=8080)
+   parser.add_argument("--mentions", type=int, default=100)
+   parser.add_argument("--events", type=int, default=10,
+      help="number of events that the user stream sends")
+   parser.add_argument("--latency", type=float, default=0,
+      help="seconds to wait before answering each request")
+   args = parser.parse_args()
+   fake = FakeTwitter(args.mentions, args.events, args.latency, port=args.port)
+   fake.Start()
+   print "Listening; use {0} as the 'apiUrl' setting".format(fake.ApiUrl())
+   try:
+      while True:
+         sleep(60)
+   except KeyboardInterrupt:
+      fake.Stop()
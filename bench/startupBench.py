@@ -0,0 +1,122 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   startupBench.py -- measure what a cron-launched bot costs when it has
+   nothing to do.
+
+   Each measurement starts a fresh interpreter (just like cron does) and
+   reports the median and best wall clock time over a number of runs:
+
+   - the bare interpreter
+   - `import nanobot.nanobot`
+   - an idle bot run: settings are loaded, nothing is due, and we exit.
+
+   Results are printed, and if `--output` is given they're also appended to
+   that file as one json object per line, so that later runs can be compared
+   against earlier ones.
+'''
+
+from datetime import datetime
+from time import time
+
+import json
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+
+kRepoPath = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+kIdleBot = '''
+from nanobot.nanobot import Nanobot
+from nanobot.nanobot import GetBotArguments
+
+if __name__ == "__main__":
+   Nanobot.CreateAndRun(GetBotArguments())
+'''
+
+
+def TimeCommand(args, runs, env):
+   ''' return a sorted list of the wall clock times for `runs` runs of args. '''
+   times = []
+   for i in range(runs):
+      start = time()
+      subprocess.check_call(args, env=env)
+      times.append(time() - start)
+   return sorted(times)
+
+
+def CreateIdleBot(path):
+   ''' write a bot and a settings file that says there's nothing to do. '''
+   with open(os.path.join(path, "idlebot.py"), "wt") as f:
+      f.write(kIdleBot)
+   now = int(time())
+   settings = {
+      "appKey": "x", "appSecret": "x", "accessToken": "x",
+      "accessTokenSecret": "x", "tweetProbability": 0, "lastUpdate": now,
+      "maximumSpacing": 24 * 60 * 60, "mentionInterval": 60 * 60,
+      "lastMentionCheck": now,
+   }
+   with open(os.path.join(path, "idlebot.json"), "wt") as f:
+      f.write(json.dumps(settings))
+   return os.path.join(path, "idlebot.py")
+
+
+def Main():
+   import argparse
+   parser = argparse.ArgumentParser()
+   parser.add_argument("--runs", type=int, default=20,
+      help="number of times to run each measurement")
+   parser.add_argument("--output", help="append results to this file")
+   args = parser.parse_args()
+
+   env = os.environ.copy()
+   env["PYTHONPATH"] = os.pathsep.join(filter(None,
+      [kRepoPath, env.get("PYTHONPATH")]))
+
+   botDir = tempfile.mkdtemp()
+   try:
+      botScript = CreateIdleBot(botDir)
+      benchmarks = [
+         ("interpreter", [sys.executable, "-c", "pass"]),
+         ("import nanobot", [sys.executable, "-c", "import nanobot.nanobot"]),
+         ("idle run", [sys.executable, botScript]),
+      ]
+      results = {"timestamp": str(datetime.now()), "runs": args.runs}
+      for name, command in benchmarks:
+         times = TimeCommand(command, args.runs, env)
+         median = times[len(times) // 2]
+         results[name] = {"median": median, "best": times[0]}
+         print "{0:<16}median {1:7.1f}ms   best {2:7.1f}ms".format(name,
+            median * 1000, times[0] * 1000)
+   finally:
+      shutil.rmtree(botDir)
+
+   if args.output:
+      with open(args.output, "at") as f:
+         f.write(json.dumps(results) + "\n")
+
+
+if __name__ == "__main__":
+   Main()
@@ -46,6 +46,10 @@ class Tockbot(Nanobot):
 
       return 0 == datetime.now().minute
 
+   def CanCheckUpdateEarly(self):
+      ''' we only look at the clock, so it's safe to ask before connecting. '''
+      return True
+
    def CreateUpdateTweet(self):
       ''' Chime the clock! '''
       now = datetime.now()
@@ -80,13 +84,16 @@ class Tockbot(Nanobot):
          if self.debug:
             print "REPLY: {}".format(replyMsg)
          else:
-            self.tweets.append({'status': replyMsg, 'in_reply_to_status_id': theId})
+            # we may be called from more than one thread at once.
+            self.AddTweet({'status': replyMsg, 'in_reply_to_status_id': theId})
          eventType = "Reply"
 
       self.Log(eventType, [who])
 
    def Handle_quoted_tweet(self, data):
       '''Like any tweet that quotes us. '''
+      # (imported here so that idle runs don't have to load twython)
+      from twython.exceptions import TwythonError
       tweetId = data['target_object']['id_str']
       if self.debug:
          print "Faving quoted tweet {0}".format(tweetId)
@@ -0,0 +1,366 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   asyncBot.py -- AsyncNanobot, a Nanobot whose hooks can be coroutines, so
+   that it can have lots of API calls in flight at once.
+
+   There's no asyncio in Python 2, so the coroutines here are generators
+   (the same trick that tornado and trollius use). A hook that needs the
+   result of an API call yields it, and is resumed with the result (or the
+   exception) once it's ready; yield a list to wait for several at once:
+
+   class MyBot(AsyncNanobot):
+      def HandleOneMention(self, mention):
+         user = yield self.api.show_user(user_id=mention['user']['id_str'])
+         yield [self.api.create_favorite(id=mention['id_str']),
+            self.api.create_friendship(user_id=user['id_str'])]
+         self.AddTweet({'status': ...})
+
+   `self.api` has the same methods as `self.twitter`, but each call returns
+   a Future right away; the call itself is made on a pool of 'asyncWorkers'
+   I/O threads that share a keep-alive HTTP session (see connections.py).
+   Generators can't return a value in Python 2, so a coroutine that needs
+   to does `raise Return(value)` instead.
+
+   The hooks that can be coroutines are PreRun(), CreateUpdateTweet(),
+   HandleOneMention(), stream event and batch handlers, and PostRun().
+   Up to 'mentionConcurrency' mentions (by default, 'asyncWorkers') are
+   handled at once, each one running until it waits on the API and then
+   letting the others go. Everything else happens on the bot's own thread,
+   so coroutines don't need any locking. A hook that's an ordinary method is
+   just called, so a synchronous bot (e.g. Tockbot) runs the same way as an
+   AsyncNanobot as it does as a Nanobot.
+
+   This only pays off when most of the time of a call is spent waiting for 
+   twitter to answer: building and signing a request is CPU work that holds
+   the GIL, so when the API answers right away (e.g. bench/fakeTwitter.py 
+   with no latency), an AsyncNanobot is no faster than a Nanobot.
+'''
+
+from collections import deque
+from Queue import Queue
+from threading import Lock
+from threading import Thread
+from threading import local
+from types import GeneratorType
+
+import sys
+
+from nanobot import Nanobot
+
+kDefaultWorkers = 32
+
+
+class Return(Exception):
+   ''' raise this to return a value from a coroutine. '''
+   def __init__(self, value=None):
+      super(Return, self).__init__(value)
+      self.value = value
+
+
+class Future(object):
+   '''
+      The result of something that may not have finished yet. Callbacks are
+      always run on the thread of the loop that the future belongs to.
+   '''
+   def __init__(self, loop):
+      self.loop = loop
+      self.lock = Lock()
+      self.done = False
+      self.result = None
+      # (type, value, traceback), as returned by sys.exc_info()
+      self.excInfo = None
+      self.callbacks = []
+
+   def SetResult(self, result):
+      self.Finish(result, None)
+
+   def SetException(self, excInfo):
+      self.Finish(None, excInfo)
+
+   def Finish(self, result, excInfo):
+      with self.lock:
+         self.result = result
+         self.excInfo = excInfo
+         self.done = True
+         callbacks, self.callbacks = self.callbacks, []
+      for callback in callbacks:
+         self.loop.CallSoon(callback, self)
+
+   def AddDoneCallback(self, callback):
+      ''' call `callback(self)` once we're done. '''
+      with self.lock:
+         if not self.done:
+            self.callbacks.append(callback)
+            return
+      self.loop.CallSoon(callback, self)
+
+   def Result(self):
+      ''' our result, or raise our exception (only call this once we're done) '''
+      if self.excInfo:
+         raise self.excInfo[0], self.excInfo[1], self.excInfo[2]
+      return self.result
+
+
+class Task(Future):
+   ''' Runs a generator-based coroutine on a loop. '''
+   def __init__(self, loop, coroutine):
+      super(Task, self).__init__(loop)
+      self.coroutine = coroutine
+      loop.CallSoon(self.Step)
+
+   def Step(self, value=None, excInfo=None):
+      ''' run the coroutine until it yields something for us to wait for. '''
+      try:
+         if excInfo:
+            yielded = self.coroutine.throw(*excInfo)
+         else:
+            yielded = self.coroutine.send(value)
+      except StopIteration:
+         self.SetResult(None)
+      except Return as e:
+         self.SetResult(e.value)
+      except Exception:
+         self.SetException(sys.exc_info())
+      else:
+         self.loop.Spawn(yielded).AddDoneCallback(self.Wakeup)
+
+   def Wakeup(self, future):
+      if future.excInfo:
+         self.Step(None, future.excInfo)
+      else:
+         self.Step(future.result)
+
+
+class IoPool(object):
+   '''
+      The threads that make blocking calls for the loops. (Lighter than a 
+      multiprocessing ThreadPool, which hands each call and its result 
+      through two more threads of its own on the way.)
+   '''
+   def __init__(self, workers):
+      self.calls = Queue()
+      self.threads = []
+      for i in range(workers):
+         thread = Thread(target=self.Work)
+         thread.daemon = True
+         thread.start()
+         self.threads.append(thread)
+
+   def Work(self):
+      while True:
+         call = self.calls.get()
+         if call is None:
+            return
+         call()
+
+   def Submit(self, call):
+      ''' call `call()` on one of our threads. '''
+      self.calls.put(call)
+
+   def Close(self):
+      ''' finish the calls that have been submitted, and stop. '''
+      for thread in self.threads:
+         self.calls.put(None)
+      for thread in self.threads:
+         thread.join()
+
+
+class EventLoop(object):
+   '''
+      Runs the steps of the coroutines on one thread; blocking calls are
+      sent off to `pool` (an IoPool that's shared between loops).
+   '''
+   def __init__(self, pool):
+      self.pool = pool
+      # (function, args) to call next, in order.
+      self.ready = Queue()
+
+   def CallSoon(self, func, *args):
+      ''' safe to call from any thread. '''
+      self.ready.put((func, args))
+
+   def Spawn(self, value):
+      '''
+         Return a Future for `value`: a coroutine is started as a Task, a
+         list or tuple becomes a Future for the list of their results, and
+         anything else is already done.
+      '''
+      if isinstance(value, Future):
+         return value
+      if isinstance(value, GeneratorType):
+         return Task(self, value)
+      if isinstance(value, (list, tuple)):
+         return self.Gather(value)
+      future = Future(self)
+      future.SetResult(value)
+      return future
+
+   def Gather(self, values):
+      ''' a Future for the results of all of `values`, or the first exception. '''
+      gathered = Future(self)
+      futures = [self.Spawn(value) for value in values]
+      if not futures:
+         gathered.SetResult([])
+      # (callbacks all run on our thread, so this doesn't need a lock)
+      remaining = [len(futures)]
+      def OneDone(future):
+         remaining[0] -= 1
+         if gathered.done:
+            return
+         if future.excInfo:
+            gathered.SetException(future.excInfo)
+         elif not remaining[0]:
+            gathered.SetResult([f.result for f in futures])
+      for future in futures:
+         future.AddDoneCallback(OneDone)
+      return gathered
+
+   def RunInPool(self, func, *args, **kwargs):
+      ''' call `func` on the I/O pool, returning a Future for its result. '''
+      future = Future(self)
+      def Call():
+         try:
+            future.SetResult(func(*args, **kwargs))
+         except Exception:
+            future.SetException(sys.exc_info())
+      self.pool.Submit(Call)
+      return future
+
+   def RunUntilComplete(self, value):
+      '''
+         Run the loop until `value` (see Spawn()) is done and return its
+         result. Other coroutines on this loop make progress meanwhile.
+      '''
+      future = self.Spawn(value)
+      while not future.done:
+         func, args = self.ready.get()
+         func(*args)
+      return future.Result()
+
+
+class AsyncApi(object):
+   '''
+      Makes the same calls as the bot's `twitter` object, on the I/O pool,
+      returning a Future for each one.
+   '''
+   def __init__(self, bot):
+      self.bot = bot
+
+   def __getattr__(self, name):
+      method = getattr(self.bot.twitter, name)
+      def Call(*args, **kwargs):
+         return self.bot.GetLoop().RunInPool(method, *args, **kwargs)
+      Call.__name__ = name
+      return Call
+
+
+class AsyncNanobot(Nanobot):
+   '''
+      A Nanobot whose hooks may be coroutines (see the top of asyncBot.py)
+   '''
+   def __init__(self, argDict=None):
+      super(AsyncNanobot, self).__init__(argDict)
+      self.api = AsyncApi(self)
+      # created by GetLoop() the first time that it's needed.
+      self.ioPool = None
+      self.loopLock = Lock()
+      # each thread that runs hooks (e.g. the streamer's dispatch workers)
+      # gets its own loop.
+      self.loops = local()
+
+   def GetLoop(self):
+      ''' return the EventLoop for the current thread. '''
+      loop = getattr(self.loops, "loop", None)
+      if loop is None:
+         with self.loopLock:
+            if self.ioPool is None:
+               self.ioPool = IoPool(
+                  self.settings.GetOrDefault("asyncWorkers", kDefaultWorkers))
+         loop = self.loops.loop = EventLoop(self.ioPool)
+      return loop
+
+   def CloseLoop(self):
+      ''' shut down the I/O pool once there's nothing left for it to do. '''
+      with self.loopLock:
+         pool, self.ioPool = self.ioPool, None
+      if pool:
+         pool.Close()
+      self.loops = local()
+
+   def CallHook(self, hook, *args):
+      return self.GetLoop().RunUntilComplete(hook(*args))
+
+   def CreateClient(self):
+      # make sure that there are enough connections in the pool for all of
+      # our I/O threads.
+      poolSize = self.settings.GetOrDefault("httpPoolSize",
+         self.settings.GetOrDefault("asyncWorkers", kDefaultWorkers))
+      return super(AsyncNanobot, self).CreateClient(poolSize)
+
+   def HandleMentionsSerially(self, mentions):
+      return self.HandleMentionsOnLoop(mentions,
+         self.settings.GetOrDefault("asyncWorkers", kDefaultWorkers))
+
+   def HandleMentionsConcurrently(self, mentions, concurrency):
+      return self.HandleMentionsOnLoop(mentions, concurrency)
+
+   def HandleMentionsOnLoop(self, mentions, concurrency):
+      '''
+         Like HandleMentionsConcurrently(), but the mentions are coroutines
+         on this thread's loop instead of calls on a thread pool: keep up to
+         `concurrency` of them going, yielding each mention (in order) once
+         it and all of the mentions before it have been handled.
+      '''
+      loop = self.GetLoop()
+      pending = deque()
+      try:
+         for mention in mentions:
+            pending.append((mention, loop.Spawn(self.HandleNewMentionAsync(mention))))
+            if len(pending) >= concurrency:
+               mention, task = pending.popleft()
+               loop.RunUntilComplete(task)
+               yield mention
+         while pending:
+            mention, task = pending.popleft()
+            loop.RunUntilComplete(task)
+            yield mention
+      finally:
+         # if one of them failed, let the others finish before we go.
+         for mention, task in pending:
+            try:
+               loop.RunUntilComplete(task)
+            except Exception:
+               pass
+
+   def HandleNewMentionAsync(self, mention):
+      ''' coroutine version of HandleNewMention() '''
+      theId = mention['id_str']
+      if theId not in self.seenIds:
+         yield self.HandleOneMention(mention)
+         self.seenIds.Add(theId)
+         self.metrics.Increment("mentions_handled")
+
+   def Run(self):
+      try:
+         super(AsyncNanobot, self).Run()
+      finally:
+         self.CloseLoop()
@@ -0,0 +1,100 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   connections.py -- keep-alive HTTP sessions that are shared by every API
+   client in the process that uses the same credentials.
+
+   Each Twython object normally gets a requests.Session of its own, so every
+   bot (and every run of a bot, in a process that does more than one) pays
+   for its own TCP and TLS handshakes. Instead, the first client created
+   for a set of credentials hands its session over to `sharedPool`, which
+   gives it a connection pool of the requested size; every client created
+   for those credentials after that uses the same session, and so the
+   connections that are already open.
+
+   `Stats()` reports how many requests were made and how many connections
+   had to be opened for them; the difference is the number of handshakes
+   that we didn't have to make.
+'''
+
+from threading import Lock
+
+from requests.adapters import HTTPAdapter
+
+# the number of different hosts that each session keeps connections to.
+kHostsPerSession = 4
+
+
+class ConnectionPool(object):
+   def __init__(self):
+      self.lock = Lock()
+      # credentials : requests.Session
+      self.sessions = {}
+
+   def Session(self, key, session, poolSize=10):
+      '''
+         Return the shared session for `key` (a tuple of the credentials
+         that `session` was set up with). If there isn't one yet, `session`
+         becomes it, keeping up to `poolSize` connections open to each
+         host. (Later callers' pool sizes are ignored.)
+      '''
+      with self.lock:
+         shared = self.sessions.get(key)
+         if shared is None:
+            adapter = HTTPAdapter(pool_connections=kHostsPerSession,
+               pool_maxsize=poolSize)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            shared = self.sessions[key] = session
+         return shared
+
+   def Stats(self, key=None):
+      '''
+         Return {"requests", "connections", "reused"} counts for the session
+         for `key`, or for all of them.
+      '''
+      with self.lock:
+         if key is None:
+            sessions = self.sessions.values()
+         else:
+            sessions = [self.sessions[key]] if key in self.sessions else []
+      requests = connections = 0
+      for session in sessions:
+         for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for poolKey in pools.keys():
+               pool = pools.get(poolKey)
+               if pool is not None:
+                  requests += pool.num_requests
+                  connections += pool.num_connections
+      return {"requests": requests, "connections": connections,
+         "reused": max(0, requests - connections)}
+
+   def Clear(self):
+      ''' close all of the sessions (and their connections). '''
+      with self.lock:
+         sessions, self.sessions = self.sessions, {}
+      for session in sessions.values():
+         session.close()
+
+
+# the pool that Nanobot.CreateClient() uses.
+sharedPool = ConnectionPool()
@@ -0,0 +1,111 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   contentPool.py -- a small, persistent queue of ready-to-send status dicts.
+
+   Bots whose tweets are expensive to generate can make them ahead of time,
+   so that when it's time to tweet, all we need to do is take the next one
+   out of the pool. The pool is kept in a json file that's replaced
+   atomically each time it changes, and changes are serialized with both a
+   thread lock and an flock() on a lock file, so a background producer
+   thread and an overlapping cron run can't step on each other.
+'''
+
+from contextlib import contextmanager
+from threading import Lock
+
+import fcntl
+import json
+import os
+
+
+class ContentPool(object):
+   def __init__(self, path, capacity=10, lowWater=None):
+      '''
+         path: the json file that the pool is kept in
+         capacity: the most entries we'll keep in the pool
+         lowWater: when there are this many entries or fewer, the pool
+            needs to be refilled (default: half of capacity)
+      '''
+      self.path = path
+      self.capacity = capacity
+      self.lowWater = capacity // 2 if lowWater is None else lowWater
+      self.lock = Lock()
+
+   @contextmanager
+   def Locked(self):
+      with self.lock:
+         with open(self.path + ".lock", "a") as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+               yield
+            finally:
+               fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+   def Read(self):
+      try:
+         with open(self.path, "rt") as f:
+            return json.loads(f.read())
+      except (IOError, ValueError):
+         return []
+
+   def Write(self, entries):
+      tmpPath = self.path + ".tmp"
+      with open(tmpPath, "wt") as f:
+         f.write(json.dumps(entries))
+      os.rename(tmpPath, self.path)
+
+   def Size(self):
+      return len(self.Read())
+
+   def NeedsRefill(self):
+      return self.Size() <= self.lowWater
+
+   def Pop(self):
+      ''' remove and return the oldest entry, or None if the pool is empty. '''
+      with self.Locked():
+         entries = self.Read()
+         if not entries:
+            return None
+         entry = entries.pop(0)
+         self.Write(entries)
+         return entry
+
+   def Push(self, entry):
+      ''' add an entry; returns False (and does nothing) if the pool is full. '''
+      with self.Locked():
+         entries = self.Read()
+         if len(entries) >= self.capacity:
+            return False
+         entries.append(entry)
+         self.Write(entries)
+         return True
+
+   def Fill(self, producer):
+      '''
+         Call `producer` (which returns a status dict, or None if it can't
+         make one) until the pool is full. We don't hold the lock while the
+         producer is working, so the pool can be used in the meantime.
+      '''
+      while self.Size() < self.capacity:
+         entry = producer()
+         if not entry or not self.Push(entry):
+            break
@@ -0,0 +1,255 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   corpus.py -- random access to the lines and stanzas of a set of text
+   (e.g. lyric) files without reading them into memory.
+
+   The first time we see a file (or whenever its size or modification time
+   changes) we scan it once and write an index file next to it
+   (`<file>.idx`) holding the start and end byte offsets of each non-blank
+   line, and of each stanza (a run of non-blank lines separated by blank
+   lines):
+
+   <header><line 0 start><line 0 end>...<stanza 0 start><stanza 0 end>...
+
+   Picking a random line or stanza then means reading 16 bytes from the
+   index and then just that line or stanza from the file. (We read them 
+   rather than mapping the files into memory: a mapped file that someone 
+   truncates while we're running kills the process with SIGBUS.)
+
+   A bot that stays running (e.g. a daemon) calls `Refresh()` on each 
+   tick, so files that are edited, added, or removed are picked up.
+'''
+
+from bisect import bisect_right
+from glob import glob
+from random import randrange
+
+import os
+import struct
+
+kIndexExtension = ".idx"
+kIndexVersion = 1
+# version, source mtime, source size, line count, stanza count
+kIndexHeader = struct.Struct(">IdQQQ")
+kOffsetPair = struct.Struct(">QQ")
+
+# number of offsets that we collect before writing them to the index.
+kChunkSize = 8192
+
+
+class CorpusFile(object):
+   ''' One text file and its index. '''
+   def __init__(self, path):
+      self.path = path
+      self.indexPath = path + kIndexExtension
+      self._text = None
+      self._index = None
+      if not self.LoadIndex():
+         self.BuildIndex()
+         self.LoadIndex()
+
+   def LoadIndex(self):
+      ''' return True if there's an up to date index for our file. '''
+      stat = os.stat(self.path)
+      try:
+         with open(self.indexPath, "rb") as f:
+            header = f.read(kIndexHeader.size)
+         version, mtime, size, lineCount, stanzaCount = \
+            kIndexHeader.unpack(header)
+      except (IOError, struct.error):
+         return False
+      if (version, mtime, size) != (kIndexVersion, stat.st_mtime, stat.st_size):
+         return False
+      self.mtime = mtime
+      self.size = size
+      self.lineCount = lineCount
+      self.stanzaCount = stanzaCount
+      return True
+
+   def BuildIndex(self):
+      '''
+         Scan the file once, writing line offsets to the index as we go
+         (stanza offsets are collected in a temp file and appended at the
+         end), so that building the index of a huge file doesn't need a
+         huge amount of memory.
+      '''
+      stat = os.stat(self.path)
+      tmpPath = self.indexPath + ".tmp"
+      stanzaPath = self.indexPath + ".stanzas"
+      lineCount = 0
+      stanzaCount = 0
+      lines = []
+      stanzas = []
+
+      def Flush(offsets, f):
+         f.write(struct.pack(">{0}Q".format(len(offsets)), *offsets))
+         del offsets[:]
+
+      with open(self.path, "rb") as src, open(tmpPath, "wb") as idx, \
+            open(stanzaPath, "w+b") as stanzaFile:
+         idx.write(kIndexHeader.pack(0, 0, 0, 0, 0))
+         offset = 0
+         stanzaStart = None
+         lastEnd = 0
+         for raw in src:
+            text = raw.rstrip("\r\n")
+            if text.strip():
+               end = offset + len(text)
+               lines.extend((offset, end))
+               lineCount += 1
+               if stanzaStart is None:
+                  stanzaStart = offset
+               lastEnd = end
+            elif stanzaStart is not None:
+               stanzas.extend((stanzaStart, lastEnd))
+               stanzaCount += 1
+               stanzaStart = None
+            offset += len(raw)
+            if len(lines) >= kChunkSize:
+               Flush(lines, idx)
+            if len(stanzas) >= kChunkSize:
+               Flush(stanzas, stanzaFile)
+         if stanzaStart is not None:
+            stanzas.extend((stanzaStart, lastEnd))
+            stanzaCount += 1
+         Flush(lines, idx)
+         Flush(stanzas, stanzaFile)
+
+         stanzaFile.seek(0)
+         while True:
+            chunk = stanzaFile.read(kChunkSize * 8)
+            if not chunk:
+               break
+            idx.write(chunk)
+
+         # now that we know the counts, the header is valid.
+         idx.seek(0)
+         idx.write(kIndexHeader.pack(kIndexVersion, stat.st_mtime, stat.st_size,
+            lineCount, stanzaCount))
+      os.remove(stanzaPath)
+      os.rename(tmpPath, self.indexPath)
+
+   def IsCurrent(self):
+      ''' is our file still the one that we indexed? '''
+      stat = os.stat(self.path)
+      return (stat.st_mtime, stat.st_size) == (self.mtime, self.size)
+
+   def Read(self, f, offset, size):
+      f.seek(offset)
+      return f.read(size)
+
+   def Slice(self, pairIndex):
+      ''' return the text between the offsets stored at `pairIndex`. '''
+      if self._index is None:
+         self._index = open(self.indexPath, "rb")
+         self._text = open(self.path, "rb")
+      start, end = kOffsetPair.unpack(self.Read(self._index,
+         kIndexHeader.size + pairIndex * kOffsetPair.size, kOffsetPair.size))
+      return self.Read(self._text, start, end - start).decode("utf-8")
+
+   def Line(self, i):
+      return self.Slice(i)
+
+   def Stanza(self, i):
+      return self.Slice(self.lineCount + i)
+
+   def Close(self):
+      for f in (self._index, self._text):
+         if f is not None:
+            f.close()
+      self._index = self._text = None
+
+
+class Corpus(object):
+   '''
+      All of the files that match a glob pattern. Random lines and stanzas
+      are chosen evenly from across all of the files.
+   '''
+   def __init__(self, pattern):
+      self.pattern = pattern
+      self.files = []
+      self.Refresh()
+
+   def Refresh(self):
+      '''
+         Pick up any files that have been added, changed (which re-indexes
+         them), or removed since we last looked.
+      '''
+      known = dict((f.path, f) for f in self.files)
+      files = []
+      for path in sorted(glob(self.pattern)):
+         f = known.pop(path, None)
+         try:
+            if f and not f.IsCurrent():
+               f.Close()
+               f = None
+            # (there'd be nothing to choose from an empty file)
+            if f is None and os.path.getsize(path) > 0:
+               f = CorpusFile(path)
+         except (IOError, OSError):
+            # it was removed after we globbed it.
+            f = None
+         if f:
+            files.append(f)
+      for f in known.values():
+         f.Close()
+      self.files = files
+
+   def Choose(self, countOf, exclude=None):
+      '''
+         Pick a file (weighted by the number of things in it) and an index
+         into it. Files whose paths are in `exclude` aren't picked unless
+         there's nothing else to pick from.
+      '''
+      candidates = [f for f in self.files if countOf(f)]
+      if exclude:
+         allowed = [f for f in candidates if f.path not in exclude]
+         candidates = allowed or candidates
+      if not candidates:
+         return None, None
+      totals = []
+      total = 0
+      for f in candidates:
+         total += countOf(f)
+         totals.append(total)
+      pick = randrange(total)
+      fileIndex = bisect_right(totals, pick)
+      chosen = candidates[fileIndex]
+      return chosen, pick - (totals[fileIndex] - countOf(chosen))
+
+   def RandomLine(self, exclude=None):
+      ''' return (path, line), or (None, None) if there aren't any lines. '''
+      f, i = self.Choose(lambda f: f.lineCount, exclude)
+      if f is None:
+         return None, None
+      return f.path, f.Line(i)
+
+   def RandomStanza(self, exclude=None):
+      ''' return (path, stanza), or (None, None) if there aren't any stanzas. '''
+      f, i = self.Choose(lambda f: f.stanzaCount, exclude)
+      if f is None:
+         return None, None
+      return f.path, f.Stanza(i)
+
+   def Close(self):
+      for f in self.files:
+         f.Close()
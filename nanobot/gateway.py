@@ -0,0 +1,273 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   gateway.py -- a rate-limit aware wrapper around a Twython object.
+
+   The gateway looks just like the Twython object it wraps, but before each of
+   the API calls that nanobot makes it checks a token bucket for that
+   endpoint. Buckets refill over the endpoint's rate limit window, and are
+   re-synced from the `x-rate-limit-*` headers whenever twitter sends them.
+
+   Every write call also takes a token from a budget that all of the writes
+   share (twitter limits the writes that an account can make in a day, but
+   doesn't tell us how many are left, so the size of the budget is up to 
+   the bot), and when that's running low, low priority writes (favorites) 
+   are deferred so that what's left of it is kept for status updates. Deferred
+   write calls are saved and retried on a later run by `RetryDeferred()`;
+   read calls that can't be made return None. Only `kMaxDeferred` calls 
+   are kept; a write call that can't be deferred because there are already
+   that many (or that twitter refuses when it's retried) is dropped, and 
+   each dropped call is logged and counted in the 'api_dropped' metric.
+
+   The bucket state and the deferred calls are kept in the bot's settings
+   under the 'rateLimits' key, so a new process starts where the last one
+   left off instead of blindly bursting.
+'''
+
+from threading import Lock
+from threading import local
+from time import time
+
+import copy
+import json
+
+from twython.exceptions import TwythonError
+from twython.exceptions import TwythonRateLimitError
+
+from metrics import NullMetrics
+
+kHighPriority = 0
+kNormalPriority = 1
+kLowPriority = 2
+
+# method name : (endpoint, priority, is a write?, default limit, window in secs)
+kEndpoints = {
+   "update_status"         : ("statuses/update", kHighPriority, True, 300, 3 * 60 * 60),
+   "get_mentions_timeline" : ("statuses/mentions_timeline", kNormalPriority, False, 75, 15 * 60),
+   "create_favorite"       : ("favorites/create", kLowPriority, True, 1000, 24 * 60 * 60),
+}
+
+# the budget that all of the write calls share: writes per window (in secs)
+kWriteBudget = 2400
+kWriteWindow = 24 * 60 * 60
+
+kMaxDeferred = 1000
+
+
+class ApiGateway(object):
+   def __init__(self, client, settings, reserve=0.25, metrics=None, log=None,
+      writeBudget=kWriteBudget):
+      '''
+         client: the Twython object to wrap
+         settings: the bot's JsonSettings object, where our state is saved
+         reserve: fraction of the shared write budget that low priority 
+            calls may not use
+         writeBudget: how many writes we can make in a day between all of
+            the write endpoints (0 or None for no shared budget)
+         metrics: if given, a Metrics object that we report the number, 
+            latency and errors of the calls we make (and defer) to
+         log: if given, a function like Nanobot.Log() that we log any calls
+            that we have to drop with
+      '''
+      self._client = client
+      self._settings = settings
+      self._reserve = reserve
+      self._metrics = metrics or NullMetrics()
+      self._log = log
+      self._writeBudget = writeBudget
+      self._lock = Lock()
+      # each thread makes its calls with its own copy of the client (they 
+      # share its HTTP session), so that the headers of the last call that
+      # it sees are from its own last call.
+      self._clients = local()
+      self._state = settings.GetOrDefault("rateLimits", {})
+      self._state.setdefault("buckets", {})
+      self._state.setdefault("deferred", [])
+
+   def __getattr__(self, name):
+      attr = getattr(self._client, name)
+      if name not in kEndpoints:
+         return attr
+      def Call(**kwargs):
+         return self.CallEndpoint(name, kwargs)
+      return Call
+
+   def Client(self):
+      ''' the copy of our client for the current thread. '''
+      client = getattr(self._clients, "client", None)
+      if client is None:
+         client = self._clients.client = copy.copy(self._client)
+      return client
+
+   def Bucket(self, name, now):
+      ''' return the (refilled) token bucket for the method `name`. '''
+      endpoint, _, _, limit, window = kEndpoints[name]
+      return self.EndpointBucket(endpoint, limit, window, now)
+
+   def EndpointBucket(self, endpoint, limit, window, now):
+      bucket = self._state["buckets"].setdefault(endpoint,
+         {"limit": limit, "tokens": limit, "updated": now})
+      reset = bucket.get("reset")
+      if reset:
+         # twitter told us when the window resets, so we wait for that.
+         if now >= reset:
+            bucket["tokens"] = bucket["limit"]
+            del bucket["reset"]
+      else:
+         elapsed = now - bucket["updated"]
+         bucket["tokens"] = min(bucket["limit"],
+            bucket["tokens"] + elapsed * bucket["limit"] / float(window))
+      bucket["updated"] = now
+      return bucket
+
+   def WriteBucket(self, now):
+      ''' return the (refilled) token bucket for the shared write budget. '''
+      bucket = self.EndpointBucket("writes", self._writeBudget, kWriteWindow, now)
+      if bucket["limit"] != self._writeBudget:
+         # the budget has been changed since we saved the bucket.
+         bucket["tokens"] = max(0, bucket["tokens"] + self._writeBudget - 
+            bucket["limit"])
+         bucket["limit"] = self._writeBudget
+      return bucket
+
+   def Reserve(self, name):
+      ''' 
+         Take a token for a call to `name` (and one from the shared write 
+         budget if it's a write) if its priority allows it. 
+      '''
+      _, priority, isWrite, _, _ = kEndpoints[name]
+      with self._lock:
+         now = time()
+         bucket = self.Bucket(name, now)
+         if bucket["tokens"] < 1:
+            return False
+         if isWrite and self._writeBudget:
+            writes = self.WriteBucket(now)
+            required = 1
+            if priority == kLowPriority:
+               required += writes["limit"] * self._reserve
+            if writes["tokens"] < required:
+               return False
+            writes["tokens"] -= 1
+         bucket["tokens"] -= 1
+         return True
+
+   def Update(self, name, client):
+      ''' re-sync the bucket with any rate limit headers from the last call. '''
+      try:
+         remaining = client.get_lastfunction_header("x-rate-limit-remaining")
+         limit = client.get_lastfunction_header("x-rate-limit-limit")
+         reset = client.get_lastfunction_header("x-rate-limit-reset")
+      except Exception:
+         return
+      if remaining is None or limit is None or reset is None:
+         return
+      with self._lock:
+         bucket = self.Bucket(name, time())
+         bucket["tokens"] = int(remaining)
+         bucket["limit"] = int(limit)
+         bucket["reset"] = int(reset)
+
+   def Defer(self, name, kwargs):
+      _, _, isWrite, _, _ = kEndpoints[name]
+      if isWrite:
+         with self._lock:
+            deferred = self._state["deferred"]
+            full = len(deferred) >= kMaxDeferred
+            if not full:
+               deferred.append([name, kwargs])
+         if full:
+            self.Drop(name, kwargs, "too many deferred calls")
+            return None
+      self._metrics.Increment("api_deferred", endpoint=name)
+      return None
+
+   def Drop(self, name, kwargs, reason):
+      ''' log and count a write call that's never going to be made. '''
+      self._metrics.Increment("api_dropped", endpoint=name)
+      if self._log:
+         self._log("ApiCallDropped", [name, json.dumps(kwargs), reason])
+
+   def CallEndpoint(self, name, kwargs):
+      if not self.Reserve(name):
+         result = self.Defer(name, kwargs)
+      else:
+         client = self.Client()
+         try:
+            self._metrics.Increment("api_calls", endpoint=name)
+            try:
+               with self._metrics.Time("api_latency", endpoint=name):
+                  result = getattr(client, name)(**kwargs)
+            except TwythonError:
+               self._metrics.Increment("api_errors", endpoint=name)
+               raise
+            self.Update(name, client)
+         except TwythonRateLimitError as e:
+            # out of budget; don't try this endpoint again until twitter says so.
+            with self._lock:
+               bucket = self.Bucket(name, time())
+               bucket["tokens"] = 0
+               bucket["reset"] = int(e.retry_after or time() + 15 * 60)
+            result = self.Defer(name, kwargs)
+      self.Save()
+      return result
+
+   def RetryDeferred(self):
+      '''
+         Try again to make any write calls that we deferred earlier, highest
+         priority first. Anything that still can't be made stays deferred, 
+         as does anything that failed for a reason other than twitter 
+         refusing it (or that we didn't get to, if we're interrupted).
+      '''
+      with self._lock:
+         deferred = self._state["deferred"]
+         self._state["deferred"] = []
+      deferred.sort(key=lambda call: kEndpoints[call[0]][1])
+      failed = []
+      try:
+         while deferred:
+            name, kwargs = deferred[0]
+            try:
+               getattr(self, name)(**kwargs)
+            except TwythonError as e:
+               status = e.error_code or 0
+               if not 400 <= status < 500:
+                  failed.append(deferred[0])
+               else:
+                  # e.g. the tweet we were going to favorite has been 
+                  # deleted.
+                  self.Drop(name, kwargs, str(e))
+            except Exception:
+               # (connection errors, timeouts...)
+               failed.append(deferred[0])
+            deferred.pop(0)
+      finally:
+         with self._lock:
+            self._state["deferred"][:0] = failed + deferred
+            dropped = self._state["deferred"][kMaxDeferred:]
+            del self._state["deferred"][kMaxDeferred:]
+         for name, kwargs in dropped:
+            self.Drop(name, kwargs, "too many deferred calls")
+         self.Save()
+
+   def Save(self):
+      # re-assigning the key marks the settings as needing to be written.
+      self._settings.rateLimits = self._state
@@ -0,0 +1,89 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   handlers.py -- the table of which bot methods handle which stream events.
+
+   A method handles an event type if it's named `Handle_<eventType>` (e.g.
+   `Handle_follow`), or if it's decorated with `@Handles`:
+
+   @Handles("favorite", "unfavorite")
+   def OnFave(self, data):
+      ...
+
+   A batch handler gets a list of all of the events of its types that were
+   waiting each time saved stream events are handled, so e.g. 300 follows
+   can be dealt with using a few bulk API calls instead of 300 single ones:
+
+   @HandlesBatch("follow")
+   def FollowBack(self, events):
+      ...
+
+   If an event type has both, the batch handler wins. (Events that are
+   dispatched one at a time as they arrive -- see the 'streamWorkers'
+   setting -- are passed to a batch handler in a list of one.)
+
+   The table is built once for each bot class, when the class is defined, by
+   the `HandlerRegistry` metaclass. It maps event types to method *names*,
+   so derived classes can override handlers in the usual way.
+'''
+
+kHandlerPrefix = "Handle_"
+
+
+def Handles(*eventTypes):
+   ''' decorator: this method handles events of each of `eventTypes` '''
+   def Register(method):
+      method.handlesEvents = getattr(method, "handlesEvents", ()) + eventTypes
+      return method
+   return Register
+
+
+def HandlesBatch(*eventTypes):
+   ''' decorator: this method handles lists of events of `eventTypes` '''
+   def Register(method):
+      method.handlesBatches = getattr(method, "handlesBatches", ()) + eventTypes
+      return method
+   return Register
+
+
+class HandlerRegistry(type):
+   '''
+      Metaclass that gives each class `eventHandlers` and `batchHandlers`
+      dicts of {event type: method name}, including the handlers that it
+      inherits.
+   '''
+   def __init__(cls, name, bases, attrs):
+      super(HandlerRegistry, cls).__init__(name, bases, attrs)
+      eventHandlers = {}
+      batchHandlers = {}
+      # base classes first, so that derived classes can replace handlers.
+      for klass in reversed(cls.__mro__):
+         for attrName, value in vars(klass).items():
+            if not callable(value):
+               continue
+            if attrName.startswith(kHandlerPrefix):
+               eventHandlers[attrName[len(kHandlerPrefix):]] = attrName
+            for eventType in getattr(value, "handlesEvents", ()):
+               eventHandlers[eventType] = attrName
+            for eventType in getattr(value, "handlesBatches", ()):
+               batchHandlers[eventType] = attrName
+      cls.eventHandlers = eventHandlers
+      cls.batchHandlers = batchHandlers
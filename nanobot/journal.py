@@ -0,0 +1,176 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   journal.py -- an append-only journal of streaming API events.
+
+   Instead of writing one small file per event, the streaming process appends
+   each event to the current segment file as a length-prefixed record:
+
+   <4 byte big-endian length><utf-8 encoded json>
+
+   Segment files are named after the offset of their first byte within the
+   journal as a whole (e.g. `00000000000001048576.seg`), and a new segment is
+   started once the current one grows past `segmentSize` bytes.
+
+   The consumer keeps track of the offset just past the last event that it
+   handled; it replays everything after that offset with one sequential read
+   of each segment, and segments that lie entirely before that offset are
+   deleted by `Cleanup()`.
+'''
+
+from glob import glob
+
+import json
+import os
+import struct
+
+kSegmentExtension = ".seg"
+kHeader = struct.Struct(">I")
+
+
+class EventJournal(object):
+   def __init__(self, path, segmentSize=1024 * 1024):
+      self.path = path
+      self.segmentSize = segmentSize
+      self._segment = None
+      self._segmentBase = 0
+      if not os.path.isdir(path):
+         os.makedirs(path)
+
+   def Segments(self):
+      '''
+         Return a list of (baseOffset, filePath) tuples for each of the segment
+         files in the journal, in offset order.
+      '''
+      segments = []
+      for fileName in glob(os.path.join(self.path, "*" + kSegmentExtension)):
+         base, _ = os.path.splitext(os.path.basename(fileName))
+         segments.append((int(base), fileName))
+      return sorted(segments)
+
+   def SegmentPath(self, base):
+      return os.path.join(self.path, "{0:020d}{1}".format(base, kSegmentExtension))
+
+   def Append(self, data):
+      '''
+         Add a single event (a dict) to the end of the journal, starting a new
+         segment file if the current one is full.
+      '''
+      if self._segment is None:
+         segments = self.Segments()
+         if segments:
+            self._segmentBase = segments[-1][0]
+            self.TruncateTornRecord(segments[-1][1])
+         self._segment = open(self.SegmentPath(self._segmentBase), "ab")
+      elif self._segment.tell() >= self.segmentSize:
+         self._segmentBase += self._segment.tell()
+         self._segment.close()
+         self._segment = open(self.SegmentPath(self._segmentBase), "ab")
+
+      payload = json.dumps(data).encode("utf-8")
+      self._segment.write(kHeader.pack(len(payload)) + payload)
+      # the consumer lives in another process, so don't leave it sitting
+      # in our buffer.
+      self._segment.flush()
+
+   def TruncateTornRecord(self, fileName):
+      '''
+         If the last writer crashed in the middle of a record, cut it off, 
+         so that the records we append don't get read as part of it.
+      '''
+      with open(fileName, "rb") as f:
+         buf = f.read()
+      pos = 0
+      while pos + kHeader.size <= len(buf):
+         length, = kHeader.unpack_from(buf, pos)
+         end = pos + kHeader.size + length
+         if end > len(buf):
+            break
+         pos = end
+      if pos < len(buf):
+         with open(fileName, "r+b") as f:
+            f.truncate(pos)
+
+   def Close(self):
+      if self._segment is not None:
+         self._segment.close()
+         self._segment = None
+
+   def Read(self, offset=0, decode=None):
+      '''
+         Generator that yields (nextOffset, data) for each event in the
+         journal that starts at or after `offset`. `nextOffset` is the value
+         to commit once `data` has been handled. A trailing record that the
+         writer hasn't finished writing yet is left for the next time through.
+
+         Each event is decoded from its json text by `decode` if it's given
+         (e.g. records.Record), and by json.loads() if it isn't.
+      '''
+      for base, fileName in self.Segments():
+         start = max(offset - base, 0)
+         if start and start >= os.path.getsize(fileName):
+            continue
+         with open(fileName, "rb") as f:
+            f.seek(start)
+            buf = f.read()
+         pos = 0
+         while pos + kHeader.size <= len(buf):
+            length, = kHeader.unpack_from(buf, pos)
+            end = pos + kHeader.size + length
+            if end > len(buf):
+               # partial write -- we'll pick this up next time.
+               return
+            raw = buf[pos + kHeader.size:end]
+            data = decode(raw) if decode else json.loads(raw.decode("utf-8"))
+            pos = end
+            yield base + start + pos, data
+         if pos < len(buf):
+            return
+
+   def HasEvents(self, offset):
+      ''' Is there anything in the journal past `offset`? '''
+      segments = self.Segments()
+      if not segments:
+         return False
+      base, fileName = segments[-1]
+      return base + os.path.getsize(fileName) > offset
+
+   def Cleanup(self, offset):
+      '''
+         Delete every segment that lies entirely before the committed offset.
+         The most recent segment is always kept, since the streaming process
+         may still be appending to it.
+      '''
+      segments = self.Segments()
+      for base, fileName in segments[:-1]:
+         if base + os.path.getsize(fileName) <= offset:
+            os.remove(fileName)
+
+   def MigrateSpool(self, fileNames):
+      '''
+         Move events from the older one-file-per-event `.stream` spool into
+         the journal, deleting each spool file as we go.
+      '''
+      for fileName in sorted(fileNames, key=os.path.getmtime):
+         with open(fileName, "rt") as f:
+            self.Append(json.loads(f.read().decode("utf-8")))
+         os.remove(fileName)
+      self.Close()
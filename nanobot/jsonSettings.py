@@ -31,10 +31,30 @@
 
    val = settings.GetOrDefault('key', defaultValue)
 
+   Changes are written out atomically (to a temp file that's then renamed
+   over the settings file), so a crash while writing can't corrupt them. 
+   Settings that grow large can instead keep an append-only change log 
+   next to the settings file (see `EnableChangeLog()`), so that each write 
+   only costs as much as the keys that changed.
+
+   Changing a setting and writing the settings out are serialized with a 
+   lock, so one JsonSettings object can be used from more than one thread.
+   Code that reads a setting and then replaces it based on what it read 
+   should hold `Locked()` while it does.
+
+   More than one process can share a settings file (e.g. a bot's streaming
+   process and its cron runs): each one only writes out the keys that it 
+   has changed, on top of what's in the file at the time, so it never puts
+   back its own stale copy of a key that another process has changed since.
 
 '''
 
+from contextlib import contextmanager
+from threading import RLock
+
+import fcntl
 import json
+import os
 
 class SettingsFileError(Exception):
    def __init__(self, msg):
@@ -57,6 +77,13 @@ class JsonSettings(object):
    def __init__(self, settingsFile, defaultDict=None):
       if defaultDict is None:
          defaultDict = {"newFile": "PLEASE EDIT THIS FILE"}
+      self._lock = RLock()
+      self._dirtyKeys = set()
+      self._changeLog = False
+      self._compactEntries = 0
+      self._logEntries = 0
+      # set if the change log has lines that we couldn't read.
+      self._logDamaged = False
       try:
          self._settingsFile = settingsFile
          with open(settingsFile, "rt") as f:
@@ -66,9 +93,54 @@ class JsonSettings(object):
          # can't open the settings file. Warn the user & create a blank file.
          # They'll need to edit that file and re-start this program.
          self._settings = defaultDict.copy()
+         self._dirtyKeys = set(self._settings)
          self._isDirty = True
          self.Write()
          raise SettingsFileError(kSettingsFileErrorMsg.format(settingsFile))
+      self.ReplayChangeLog(self._settings)
+
+   def ChangeLogPath(self):
+      return self._settingsFile + ".log"
+
+   def ReplayChangeLog(self, settings):
+      ''' 
+         If there's a change log, apply each of the changes in it on top of 
+         the `settings` that were just read from the settings file. A line 
+         that we can't read (e.g. one that a crash left partially written, 
+         which the next change may have been appended to) is skipped, and 
+         the next Write() replaces the settings file and the log, so that no
+         later change is appended after the damage.
+      '''
+      self._logEntries = 0
+      self._logDamaged = False
+      try:
+         with open(self.ChangeLogPath(), "rt") as f:
+            for line in f:
+               try:
+                  settings.update(json.loads(line))
+               except ValueError:
+                  self._logDamaged = True
+                  continue
+               self._logEntries += 1
+      except IOError:
+         # no change log, nothing to do.
+         pass
+
+   def EnableChangeLog(self, compactEntries=100):
+      '''
+         From now on, Write() appends just the keys that have changed to the 
+         change log. Once there are `compactEntries` changes in the log, the 
+         next Write() rewrites the whole settings file and starts a new log.
+      '''
+      self._changeLog = True
+      self._compactEntries = compactEntries
+
+   def Locked(self):
+      ''' 
+         with settings.Locked():
+            ...no other thread changes or writes the settings in here.
+      '''
+      return self._lock
 
    def Write(self):
       ''' If our settings have been changed since the last time 
@@ -76,14 +148,87 @@ class JsonSettings(object):
          Otherwise, do nothing. 
       '''
       try:
-         if self._isDirty: 
-            with open(self._settingsFile, "wt") as f:
-               f.write(json.dumps(self._settings, indent=3, 
-                  separators=(',', ': ') ))
-            self._isDirty = False
+         with self._lock:
+            if self._isDirty: 
+               if (self._changeLog and not self._logDamaged and 
+                  self._logEntries < self._compactEntries):
+                  self.AppendChanges()
+               else:
+                  self.WriteAll()
+               self._dirtyKeys = set()
+               self._isDirty = False
       except IOError, e:
          print "Error writing settings file: {0}".format(str(e))
-         raise SettingsFileError()
+         raise SettingsFileError(str(e))
+
+   @contextmanager
+   def FileLocked(self):
+      '''
+         Hold an exclusive lock on the settings file while we change it,
+         yielding the file open for reading (or None if there isn't one). 
+         The lock is on the file itself; since we replace it by renaming a 
+         new one over it, once we have the lock we make sure that it's 
+         still the one that's there.
+      '''
+      while True:
+         try:
+            f = open(self._settingsFile, "rt")
+         except IOError:
+            yield None
+            return
+         fcntl.flock(f, fcntl.LOCK_EX)
+         try:
+            if os.fstat(f.fileno()).st_ino == os.stat(self._settingsFile).st_ino:
+               break
+         except OSError:
+            pass
+         f.close()
+      try:
+         yield f
+      finally:
+         # (closing it releases the lock)
+         f.close()
+
+   def WriteAll(self):
+      ''' 
+         Atomically replace the settings file with the settings that are in
+         it now (and in the change log) plus the keys that we've changed. 
+      '''
+      with self.FileLocked() as current:
+         settings = dict(self._settings)
+         if current:
+            try:
+               settings = json.loads(current.read())
+            except ValueError:
+               # (someone's editing it by hand; ours will have to do)
+               pass
+            self.ReplayChangeLog(settings)
+            for key in self._dirtyKeys:
+               settings[key] = self._settings[key]
+         tmpFile = self._settingsFile + ".tmp"
+         with open(tmpFile, "wt") as f:
+            f.write(json.dumps(settings, indent=3, 
+               separators=(',', ': ') ))
+            f.flush()
+            os.fsync(f.fileno())
+         os.rename(tmpFile, self._settingsFile)
+         # everything in the change log is in the settings file now.
+         if self._logEntries or self._logDamaged:
+            os.remove(self.ChangeLogPath())
+            self._logEntries = 0
+            self._logDamaged = False
+
+   def AppendChanges(self):
+      ''' add a single line containing each of the changed keys to the log. '''
+      changes = {key: self._settings[key] for key in self._dirtyKeys}
+      # (so that we don't append to a log that another process is about to
+      # fold into the settings file and remove)
+      with self.FileLocked():
+         with open(self.ChangeLogPath(), "at") as f:
+            f.write(json.dumps(changes) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+      self._logEntries += 1
 
    def GetOrDefault(self, key, default):
       '''
@@ -91,13 +236,14 @@ class JsonSettings(object):
          If it's not present, create it with the new default value and 
          mark the settings as dirty.
       '''
-      try:
-         return self._settings[key]
-      except KeyError:
-         # set the new value for this key from the default argument, 
-         # setting us as being dirty.
-         setattr(self, key, default)
-         return default
+      with self._lock:
+         try:
+            return self._settings[key]
+         except KeyError:
+            # set the new value for this key from the default argument, 
+            # setting us as being dirty.
+            setattr(self, key, default)
+            return default
 
    def __getitem__(self, key):
       ''' get an item from settings as if this were a dict. 
@@ -117,12 +263,16 @@ class JsonSettings(object):
       # to prevent recursive setattr calls, the key/value pairs
       # that we want to expose via `['key']` or `.key` access
       if not key.startswith('_'):
-         self._settings[key] = val
-         self._isDirty = True
+         with self._lock:
+            self._settings[key] = val
+            self._dirtyKeys.add(key)
+            self._isDirty = True
       else:
          # we need to prevent recursion!
          super(JsonSettings, self).__setattr__(key, val)   
 
    def __setitem__(self, key, val):
-      self._settings[key] = val
-      self._isDirty = True
\ No newline at end of file
+      with self._lock:
+         self._settings[key] = val
+         self._dirtyKeys.add(key)
+         self._isDirty = True
\ No newline at end of file
@@ -0,0 +1,110 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   logger.py -- buffered writer for the bot's tab-separated log files.
+
+   The log file path is passed through strftime() so that (e.g.) a new log
+   file is started every month. Instead of opening and closing that file for
+   every entry, we keep the current file open until the expanded path
+   changes, and collect entries in memory until either `bufferLines` of them
+   are waiting or `flushInterval` seconds have passed since the last flush.
+   If `background` is True, a thread also flushes every `flushInterval`
+   seconds so entries don't sit in the buffer while the bot is idle.
+
+   Anything still buffered is flushed when the process exits.
+'''
+
+from datetime import datetime
+from threading import Lock
+from threading import Thread
+from time import sleep
+from time import time
+
+import atexit
+
+
+class NanobotLogger(object):
+   def __init__(self, pathTemplate, bufferLines=50, flushInterval=5,
+         background=False):
+      self.pathTemplate = pathTemplate
+      self.bufferLines = bufferLines
+      self.flushInterval = flushInterval
+      self.lock = Lock()
+      self.buffer = []
+      self.lastFlush = time()
+      self.file = None
+      self.path = None
+      # we only need to re-expand the path when the clock has moved on.
+      self.pathSecond = None
+      atexit.register(self.Close)
+      if background and flushInterval > 0:
+         flusher = Thread(target=self.FlushPeriodically)
+         flusher.daemon = True
+         flusher.start()
+
+   def Write(self, eventType, dataList):
+      '''
+         Add an entry to the log. Each entry will look like:
+         timestamp\tevent\tdata1\tdata2 <etc>\n
+      '''
+      now = int(time())
+      entry = "{0}\t{1}\t{2}\n".format(now, eventType, "\t".join(dataList))
+      with self.lock:
+         if now != self.pathSecond:
+            path = datetime.fromtimestamp(now).strftime(self.pathTemplate)
+            self.pathSecond = now
+            if path != self.path:
+               # entries for the old period go in the old file.
+               self.FlushBuffer()
+               self.path = path
+         self.buffer.append(entry)
+         if (len(self.buffer) >= self.bufferLines or
+            now - self.lastFlush >= self.flushInterval):
+            self.FlushBuffer()
+
+   def FlushBuffer(self):
+      ''' write out the buffer; the caller must be holding self.lock '''
+      self.lastFlush = time()
+      if not self.buffer:
+         return
+      if self.file is None or self.file.name != self.path:
+         if self.file is not None:
+            self.file.close()
+         self.file = open(self.path, "a+t")
+      self.file.write("".join(self.buffer))
+      self.file.flush()
+      self.buffer = []
+
+   def Flush(self):
+      with self.lock:
+         self.FlushBuffer()
+
+   def FlushPeriodically(self):
+      while True:
+         sleep(self.flushInterval)
+         self.Flush()
+
+   def Close(self):
+      with self.lock:
+         self.FlushBuffer()
+         if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,250 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   markov.py -- an n-gram (Markov chain) text generator.
+
+   Building the chain is a separate step from using it: `CompileModel()`
+   reads source text (each non-blank line is treated as one run of text),
+   and writes a binary model file. Every run of the bot after that just
+   loads the model with a single read and generates from it.
+
+   In the model, each token is represented by an integer, and everything is
+   stored in flat arrays of unsigned 32-bit ints:
+
+   - table: an open-addressing hash table of (state index + 1), 0 == empty.
+   - stateTokens: the `order` token ids that make up each state.
+   - stateStart: where each state's transitions start in the next two
+     arrays (with one extra entry marking the end of the last state).
+   - nextIds: the token that each transition leads to.
+   - weights: cumulative counts for each state's transitions, so picking
+     the next token is a bisect of a random number into that range.
+   - vocabOffsets: where each token's text starts in the vocabulary (a
+     utf-8 string of all of the tokens run together).
+
+   To compile a model from the command line:
+
+   python -m nanobot.markov compile "lyrics/*.txt" markov.model --order 2
+
+   and to try it out:
+
+   python -m nanobot.markov generate markov.model
+'''
+
+from array import array
+from bisect import bisect_right
+from glob import glob
+from random import randrange
+
+import struct
+import sys
+
+kMagic = "NBMK"
+kVersion = 1
+# magic, version, order, vocab size, state count, table size,
+# transition count, vocab byte count
+kHeader = struct.Struct("<4sIIIIIII")
+
+# token ids for the start and end of a run of text.
+kBegin = 0
+kEnd = 1
+
+
+def HashState(state, mask):
+   h = 2166136261
+   for token in state:
+      h = ((h ^ token) * 16777619) & 0xffffffff
+   return h & mask
+
+
+def ToBytes(a):
+   ''' model files are always little-endian. '''
+   if sys.byteorder != "little":
+      a = array(a.typecode, a)
+      a.byteswap()
+   return a.tostring()
+
+
+def FromBytes(data):
+   a = array("I")
+   a.fromstring(data)
+   if sys.byteorder != "little":
+      a.byteswap()
+   return a
+
+
+def CompileModel(lines, outPath, order=2):
+   '''
+      Build a model from an iterable of (unicode) lines of text, and write
+      it to `outPath`.
+   '''
+   vocab = {u"\x02": kBegin, u"\x03": kEnd}
+   transitions = {}
+   for line in lines:
+      tokens = line.split()
+      if not tokens:
+         continue
+      ids = [kBegin] * order
+      for token in tokens:
+         ids.append(vocab.setdefault(token, len(vocab)))
+      ids.append(kEnd)
+      for i in range(len(ids) - order):
+         state = tuple(ids[i:i + order])
+         counts = transitions.setdefault(state, {})
+         nextId = ids[i + order]
+         counts[nextId] = counts.get(nextId, 0) + 1
+
+   states = sorted(transitions)
+   tableSize = 1
+   while tableSize < 2 * len(states):
+      tableSize *= 2
+   mask = tableSize - 1
+
+   table = array("I", [0]) * tableSize
+   stateTokens = array("I")
+   stateStart = array("I")
+   nextIds = array("I")
+   weights = array("I")
+   for index, state in enumerate(states):
+      slot = HashState(state, mask)
+      while table[slot]:
+         slot = (slot + 1) & mask
+      table[slot] = index + 1
+      stateTokens.extend(state)
+      stateStart.append(len(nextIds))
+      total = 0
+      for nextId, count in sorted(transitions[state].items()):
+         total += count
+         nextIds.append(nextId)
+         weights.append(total)
+   stateStart.append(len(nextIds))
+
+   tokens = [None] * len(vocab)
+   for token, tokenId in vocab.items():
+      tokens[tokenId] = token.encode("utf-8")
+   vocabOffsets = array("I", [0])
+   for token in tokens:
+      vocabOffsets.append(vocabOffsets[-1] + len(token))
+   vocabBytes = "".join(tokens)
+
+   with open(outPath, "wb") as f:
+      f.write(kHeader.pack(kMagic, kVersion, order, len(tokens), len(states),
+         tableSize, len(nextIds), len(vocabBytes)))
+      for a in (table, stateTokens, stateStart, nextIds, weights, vocabOffsets):
+         f.write(ToBytes(a))
+      f.write(vocabBytes)
+
+
+class MarkovModel(object):
+   def __init__(self, path):
+      with open(path, "rb") as f:
+         data = f.read()
+      (magic, version, self.order, vocabSize, stateCount, tableSize,
+         transitionCount, vocabByteCount) = kHeader.unpack_from(data)
+      if (magic, version) != (kMagic, kVersion):
+         raise ValueError("{0} isn't a compiled model file".format(path))
+      self.mask = tableSize - 1
+
+      pos = kHeader.size
+      arrays = []
+      for count in (tableSize, stateCount * self.order, stateCount + 1,
+            transitionCount, transitionCount, vocabSize + 1):
+         arrays.append(FromBytes(data[pos:pos + 4 * count]))
+         pos += 4 * count
+      (self.table, self.stateTokens, self.stateStart, self.nextIds,
+         self.weights, self.vocabOffsets) = arrays
+      self.vocab = data[pos:pos + vocabByteCount]
+
+   def FindState(self, state):
+      ''' return the index of `state` (a tuple of token ids), or None '''
+      order = self.order
+      slot = HashState(state, self.mask)
+      while True:
+         entry = self.table[slot]
+         if not entry:
+            return None
+         start = (entry - 1) * order
+         if tuple(self.stateTokens[start:start + order]) == state:
+            return entry - 1
+         slot = (slot + 1) & self.mask
+
+   def Token(self, tokenId):
+      return self.vocab[self.vocabOffsets[tokenId]:
+         self.vocabOffsets[tokenId + 1]].decode("utf-8")
+
+   def GenerateTokens(self):
+      ''' Return a list of token ids for one run of generated text. '''
+      state = (kBegin,) * self.order
+      tokens = []
+      while True:
+         index = self.FindState(state)
+         if index is None:
+            break
+         start = self.stateStart[index]
+         end = self.stateStart[index + 1]
+         pick = randrange(self.weights[end - 1])
+         tokenId = self.nextIds[bisect_right(self.weights, pick, start, end)]
+         if tokenId == kEnd:
+            break
+         tokens.append(tokenId)
+         state = state[1:] + (tokenId,)
+      return tokens
+
+   def Generate(self, maxLength=140, tries=20):
+      '''
+         Return a generated string no longer than `maxLength` characters.
+         We try `tries` times to generate something that fits naturally; if
+         none of them do, the last one is cut off at the last whole token
+         that fits.
+      '''
+      for i in range(tries):
+         text = u" ".join(self.Token(t) for t in self.GenerateTokens())
+         if len(text) <= maxLength:
+            return text
+      return text[:maxLength + 1].rsplit(u" ", 1)[0][:maxLength]
+
+
+def ReadLines(pattern):
+   for path in sorted(glob(pattern)):
+      with open(path, "rb") as f:
+         for line in f:
+            yield line.decode("utf-8")
+
+
+if __name__ == "__main__":
+   import argparse
+   parser = argparse.ArgumentParser()
+   parser.add_argument("command", choices=["compile", "generate"])
+   parser.add_argument("args", nargs="+",
+      help="compile: <source file glob> <model file>; generate: <model file>")
+   parser.add_argument("--order", type=int, default=2,
+      help="number of tokens of context for each state")
+   parser.add_argument("--count", type=int, default=5,
+      help="number of things to generate")
+   args = parser.parse_args()
+   if args.command == "compile":
+      source, model = args.args
+      CompileModel(ReadLines(source), model, args.order)
+   else:
+      model = MarkovModel(args.args[0])
+      for i in range(args.count):
+         print model.Generate().encode("utf-8")
@@ -0,0 +1,329 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   metrics.py -- counters, gauges and timing histograms for a bot, exported
+   to a Prometheus textfile and/or a statsd server.
+
+   Metrics are collected in memory and sent out each time `Flush()` is
+   called (the bot does this whenever it saves its state):
+
+   - Prometheus: the file named by the bot's 'metricsFile' setting (point
+     node_exporter's textfile collector at it) is rewritten atomically. Since
+     a cron-driven bot is a new process every time, counters and histograms
+     from the file that's already there are added to ours, so they keep
+     counting up from run to run the way Prometheus expects them to.
+   - statsd: counters, gauges and each timing are sent to the "host:port"
+     in the 'metricsStatsd' setting as UDP packets.
+
+   Bots that don't use either get a `NullMetrics` object instead, whose
+   methods do nothing.
+
+   Metric names are given without a prefix or units; all histograms are
+   timings in seconds. E.g. `Observe("api_latency", 0.2, endpoint="x")`
+   becomes `nanobot_api_latency_seconds_bucket{bot="mybot",endpoint="x",...}`
+   in Prometheus, and `nanobot.mybot.api_latency.x:200|ms` for statsd.
+'''
+
+from threading import Lock
+from time import time
+
+import fcntl
+import os
+import sys
+
+kPrefix = "nanobot"
+
+# upper bounds (in seconds) of the histogram buckets.
+kBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# the most timings we'll hold on to between flushes for statsd.
+kMaxPendingTimings = 10000
+kMaxPacketSize = 1400
+
+
+def MonotonicClock():
+   '''
+      Return a function that returns seconds from a clock that never goes
+      backwards. Python 2 doesn't have one built in, so we call
+      clock_gettime() ourselves, falling back to time() if we can't.
+   '''
+   try:
+      import ctypes
+
+      class TimeSpec(ctypes.Structure):
+         _fields_ = [("seconds", ctypes.c_long), ("nanoseconds", ctypes.c_long)]
+
+      clockId = 6 if sys.platform == "darwin" else 1
+      clockGetTime = ctypes.CDLL(None).clock_gettime
+      clockGetTime.argtypes = [ctypes.c_int, ctypes.POINTER(TimeSpec)]
+      spec = TimeSpec()
+      specRef = ctypes.byref(spec)
+      if clockGetTime(clockId, specRef) != 0:
+         return time
+   except (ImportError, OSError, AttributeError):
+      return time
+
+   def Monotonic():
+      clockGetTime(clockId, specRef)
+      return spec.seconds + spec.nanoseconds * 1e-9
+   return Monotonic
+
+
+def SampleOrder(sample):
+   ''' sort key that puts histogram buckets in numeric order. '''
+   base, _, bound = sample.partition(',le="')
+   return (base, float(bound.rstrip('"}')) if bound else 0)
+
+
+class Timer(object):
+   ''' context manager that observes the time spent inside it. '''
+   def __init__(self, metrics, name, labels):
+      self.metrics = metrics
+      self.name = name
+      self.labels = labels
+
+   def __enter__(self):
+      self.start = self.metrics.clock()
+      return self
+
+   def __exit__(self, *exc):
+      self.metrics.Observe(self.name, self.metrics.clock() - self.start,
+         **self.labels)
+
+
+class NullTimer(object):
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc):
+      pass
+
+
+class NullMetrics(object):
+   ''' What a bot that isn't exporting metrics uses; everything's a no-op. '''
+   timer = NullTimer()
+
+   def Increment(self, name, amount=1, **labels):
+      pass
+
+   def SetGauge(self, name, value, **labels):
+      pass
+
+   def Observe(self, name, seconds, **labels):
+      pass
+
+   def Time(self, name, **labels):
+      return self.timer
+
+   def Flush(self):
+      pass
+
+
+class Metrics(object):
+   def __init__(self, botName, textFile=None, statsd=None):
+      '''
+         botName: added as the 'bot' label (or to the statsd name) of
+            every metric
+         textFile: path of the Prometheus textfile to write, or None
+         statsd: "host:port" of a statsd server to send to, or None
+      '''
+      self.botName = botName
+      self.textFile = textFile
+      self.statsd = None
+      if statsd:
+         import socket
+         host, _, port = statsd.rpartition(":")
+         self.statsd = (host or "localhost", int(port))
+         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+      self.clock = MonotonicClock()
+      self.lock = Lock()
+      self.Clear()
+      self.gauges = {}
+
+   def Clear(self):
+      ''' forget everything that's been flushed. '''
+      self.counters = {}
+      # key: [count per bucket (the last one is +Inf), sum, count]
+      self.histograms = {}
+      self.timings = []
+
+   ##
+   ## Collecting
+   ##
+
+   def Increment(self, name, amount=1, **labels):
+      key = (name, tuple(sorted(labels.items())))
+      with self.lock:
+         self.counters[key] = self.counters.get(key, 0) + amount
+
+   def SetGauge(self, name, value, **labels):
+      key = (name, tuple(sorted(labels.items())))
+      with self.lock:
+         self.gauges[key] = value
+
+   def Observe(self, name, seconds, **labels):
+      key = (name, tuple(sorted(labels.items())))
+      with self.lock:
+         histogram = self.histograms.get(key)
+         if histogram is None:
+            histogram = self.histograms[key] = [[0] * (len(kBuckets) + 1), 0, 0]
+         bucket = 0
+         while bucket < len(kBuckets) and seconds > kBuckets[bucket]:
+            bucket += 1
+         histogram[0][bucket] += 1
+         histogram[1] += seconds
+         histogram[2] += 1
+         if self.statsd and len(self.timings) < kMaxPendingTimings:
+            self.timings.append((key, seconds))
+
+   def Time(self, name, **labels):
+      ''' e.g. `with metrics.Time("phase", phase="HandleMentions"): ...` '''
+      return Timer(self, name, labels)
+
+   def Flush(self):
+      ''' send everything we've collected since the last flush. '''
+      with self.lock:
+         counters, histograms, timings = self.counters, self.histograms, self.timings
+         gauges = dict(self.gauges)
+         self.Clear()
+      if self.textFile:
+         self.WriteTextFile(counters, gauges, histograms)
+      if self.statsd:
+         self.SendStatsd(counters, gauges, timings)
+
+   ##
+   ## Prometheus
+   ##
+
+   def Labels(self, labels, extra=()):
+      labels = (("bot", self.botName),) + labels + extra
+      return "{" + ",".join('{0}="{1}"'.format(k, str(v).replace('"', '\\"'))
+         for k, v in labels) + "}"
+
+   def Families(self, counters, gauges, histograms):
+      '''
+         Return {family name: [type, {sample: value}]} in the Prometheus
+         exposition format.
+      '''
+      families = {}
+      def Add(family, kind, sample, value):
+         families.setdefault(family, [kind, {}])[1][sample] = value
+
+      for (name, labels), value in counters.items():
+         family = "{0}_{1}_total".format(kPrefix, name)
+         Add(family, "counter", family + self.Labels(labels), value)
+      for (name, labels), value in gauges.items():
+         family = "{0}_{1}".format(kPrefix, name)
+         Add(family, "gauge", family + self.Labels(labels), value)
+      for (name, labels), (buckets, total, count) in histograms.items():
+         family = "{0}_{1}_seconds".format(kPrefix, name)
+         cumulative = 0
+         for bound, bucketCount in zip(kBuckets + ("+Inf",), buckets):
+            cumulative += bucketCount
+            Add(family, "histogram", family + "_bucket" + self.Labels(labels,
+               (("le", bound),)), cumulative)
+         Add(family, "histogram", family + "_sum" + self.Labels(labels), total)
+         Add(family, "histogram", family + "_count" + self.Labels(labels), count)
+      return families
+
+   def ReadTextFile(self):
+      ''' Parse the families in the existing text file. '''
+      families = {}
+      try:
+         with open(self.textFile, "rt") as f:
+            lines = f.read().splitlines()
+      except IOError:
+         return families
+      current = None
+      for line in lines:
+         if line.startswith("# TYPE "):
+            _, _, family, kind = line.split(" ", 3)
+            current = families.setdefault(family, [kind, {}])
+         elif line and not line.startswith("#") and current is not None:
+            sample, _, value = line.rpartition(" ")
+            try:
+               current[1][sample] = float(value)
+            except ValueError:
+               pass
+      return families
+
+   def WriteTextFile(self, counters, gauges, histograms):
+      families = self.Families(counters, gauges, histograms)
+      with open(self.textFile + ".lock", "a") as lockFile:
+         # the streaming process and cron runs of the same bot may both be
+         # writing to this file.
+         fcntl.flock(lockFile, fcntl.LOCK_EX)
+         try:
+            for family, (kind, samples) in self.ReadTextFile().items():
+               merged = families.setdefault(family, [kind, {}])[1]
+               for sample, value in samples.items():
+                  if kind == "gauge":
+                     merged.setdefault(sample, value)
+                  else:
+                     merged[sample] = merged.get(sample, 0) + value
+
+            lines = []
+            for family in sorted(families):
+               kind, samples = families[family]
+               lines.append("# TYPE {0} {1}".format(family, kind))
+               for sample in sorted(samples, key=SampleOrder):
+                  lines.append("{0} {1!r}".format(sample, float(samples[sample])))
+            tmpPath = self.textFile + ".tmp"
+            with open(tmpPath, "wt") as f:
+               f.write("\n".join(lines) + "\n")
+            os.rename(tmpPath, self.textFile)
+         finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+   ##
+   ## statsd
+   ##
+
+   def StatsdName(self, name, labels):
+      parts = [kPrefix, self.botName, name] + [str(v) for k, v in labels]
+      return ".".join(p.replace(".", "_").replace(":", "_") for p in parts)
+
+   def SendStatsd(self, counters, gauges, timings):
+      lines = []
+      for (name, labels), value in counters.items():
+         lines.append("{0}:{1}|c".format(self.StatsdName(name, labels), value))
+      for (name, labels), value in gauges.items():
+         lines.append("{0}:{1}|g".format(self.StatsdName(name, labels), value))
+      for (name, labels), seconds in timings:
+         lines.append("{0}:{1:.3f}|ms".format(self.StatsdName(name, labels),
+            seconds * 1000))
+
+      # pack as many lines into each packet as will fit.
+      packet = ""
+      for line in lines:
+         if packet and len(packet) + len(line) + 1 > kMaxPacketSize:
+            self.Send(packet)
+            packet = ""
+         packet = packet + "\n" + line if packet else line
+      if packet:
+         self.Send(packet)
+
+   def Send(self, packet):
+      try:
+         self.socket.sendto(packet, self.statsd)
+      except IOError:
+         # metrics aren't worth failing a run over.
+         pass
@@ -25,19 +25,41 @@
 from datetime import datetime
 from datetime import date
 from glob import glob
+from collections import deque
 from random import random
+from threading import Lock
+from threading import Thread
+from time import sleep
 from time import time
-from twython import Twython
-from twython import TwythonStreamer
-from twython.exceptions import TwythonError
-from uuid import uuid4
 
+# NOTE that twython (and the modules that use it) are only imported inside
+# the methods that are about to talk to twitter -- most runs of a cron-driven 
+# bot have nothing to do, and we'd like those runs to be as cheap as 
+# possible. Bots that need twython's classes (e.g. TwythonError) should 
+# import them from twython, ideally where they're used.
 
 import json
+import math
 import os.path
+import sched
+import signal
 import sys
 
 from jsonSettings import JsonSettings as Settings
+from contentPool import ContentPool
+from corpus import Corpus
+# (bots can import the handler decorators from here, along with Nanobot)
+from handlers import Handles
+from handlers import HandlesBatch
+from handlers import HandlerRegistry
+from handlers import kHandlerPrefix
+from journal import EventJournal
+from logger import NanobotLogger
+from records import Record
+from metrics import Metrics
+from metrics import NullMetrics
+from seenIds import SeenIdIndex
+from spool import Spool
 
 
 # if we're started without a config file, we create a default/empty 
@@ -62,59 +84,77 @@ setting as is appropriate.
 
 kStreamFileExtension = ".stream"
 
+# tweets that fail to send are retried after 'tweetRetryDelay' seconds,
+# doubling each time up to this.
+kMaxRetryDelay = 60 * 60
 
-class NanobotStreamer(TwythonStreamer):
+# allowance (in seconds) for cron not starting us at exactly the same second
+# each time when deciding whether something is due yet.
+kScheduleSlack = 5
 
-   def SetOutputPath(self, path):
-      self.path = path
+# the shortest time (in seconds) that a daemon waits between updates, even 
+# if the next one is already due.
+kMinDaemonDelay = 1
 
-   def on_success(self, data):
-      ''' Called when we detect an event through the streaming API. 
-         The base class version looks for quoted tweets and for each one it 
-         finds, we write out a text file that contains the ID of the tweet 
-         that mentions us.
-         
-         The other (cron-job) version of your bot will look for any files with the 
-         correct extension (identified by `kStreamFileExtension`) in its 
-         HandleQuotes() method and favorite^H^H^H^H like those tweets.
-
-         See https://dev.twitter.com/streaming/userstreams
-      '''
-      # for now, all we're interested in handling are events. 
-      if 'event' in data:
-         # Dump the data into a JSON file for the other cron-process to 
-         # handle the next time it wakes up.
-         fileName = os.path.join(self.path, "{0}{1}".format(
-            uuid4().hex, kStreamFileExtension))
-         with open(fileName, "wt") as f:
-            f.write(json.dumps(data).encode("utf-8"))
-         
-
-   def on_error(self, status_code, data):
-      print "ERROR: {0}".format(status_code)
-      self.disconnect()
-
-         
- 
+# what a streaming process profiles if 'profilePhases' isn't set.
+kStreamProfilePhases = ["HandleOneStreamEvent", "SendTweets"]
 
 
 class Nanobot(object):
    '''
       A tiny little twitterbot framework in Python.
    '''
+   # builds the table of stream event handlers for each bot class.
+   __metaclass__ = HandlerRegistry
 
    def __init__(self, argDict=None):
-      if not argDict:
-         argDict = { 'debug' : False, "force": False, 
-                     'stream': False, 'botPath' : "."}
+      defaultArgs = { 'debug' : False, "force": False, 
+                      'stream': False, 'daemon': False, 'profile': False,
+                      'botPath' : "."}
       # update this object's internal dict with the dict of args that was passed
       # in so we can access those values as attributes.   
-      self.__dict__.update(argDict)
+      self.__dict__.update(defaultArgs)
+      if argDict:
+         self.__dict__.update(argDict)
 
       # we build a list of dicts containing status (and whatever other args 
       # we may need to pass to the update_status function as we exit, most 
       # probably 'in_reply-to_status_id' when we're replying to someone.)
+      # Use AddTweet() to add to this list from code that may be running
+      # on more than one thread at once (e.g. HandleOneMention)
       self.tweets = []
+      self.tweetLock = Lock()
+      # how many tweets have been passed to AddTweet()
+      self.tweetsAdded = 0
+
+      # see GetOutbox()
+      self.outbox = None
+
+      # created the first time that we Log() something.
+      self.logger = None
+
+      # created the first time that we need some text from it.
+      self.corpus = None
+      self.markovModel = None
+
+      # see GetContentPool()
+      self.contentPool = None
+      self.poolFiller = None
+
+      # if we've already asked IsReadyForUpdate() before connecting, this 
+      # is what it told us.
+      self.updateDue = None
+
+      # replaced in LoadSettings() if the bot is set up to export metrics.
+      self.metrics = NullMetrics()
+
+      # see StartProfiling()
+      self.profiler = None
+      self.profiledPhases = []
+
+      # the key of the shared HTTP session that our API client uses (see 
+      # CreateClient())
+      self.connectionKey = None
 
 
 
@@ -137,37 +177,103 @@ class Nanobot(object):
          too closely together or too far apart, and this can be overridden 
          if self.force is True.
 
+         Instead of rolling the dice every time we're run, the time of our 
+         next update is decided when we make an update (see 
+         ScheduleNextUpdate()) and saved in the 'nextUpdate' setting, so 
+         all we need to do here is look at the clock.
+
          Derived classes are free to create their own version of this method.
       '''
-      doUpdate = self.force
+      if self.force:
+         return True
+      nextUpdate = self.settings.nextUpdate
+      if nextUpdate is None:
+         nextUpdate = self.ScheduleNextUpdate()
+      return time() >= nextUpdate
+
+   def ScheduleNextUpdate(self):
+      '''
+         Decide when our next update should happen, save it in the 
+         'nextUpdate' setting and return it. 
+
+         The old logic was to roll the dice every time we were run (every 
+         'updateInterval' seconds, by default once a minute), tweeting if 
+         random() < 'tweetProbability' and it had been more than 
+         'minimumSpacing' seconds since the last tweet, or regardless if it 
+         had been more than 'maximumSpacing' seconds. Here we draw the 
+         number of runs until the first successful roll from the matching 
+         (geometric) distribution once instead.
+
+         (If you change any of those settings and want them to take effect
+         right away, delete 'nextUpdate' from the settings file.)
+      '''
       last = self.settings.lastUpdate or 0
-      now = int(time())
-      lastTweetAge = now - last
-
       # default to creating a tweet at *least* every 4 hours.
       maxSpace = self.settings.GetOrDefault("maximumSpacing", 4 * 60 * 60)
+      # ...and at *most* once an hour.
+      minSpace = self.settings.GetOrDefault("minimumSpacing", 60 * 60)
+      interval = self.settings.GetOrDefault("updateInterval", 60)
+      probability = self.settings.tweetProbability or 0
+
+      nextUpdate = last + maxSpace
+      if probability >= 1:
+         nextUpdate = min(nextUpdate, last + minSpace + interval)
+      elif probability > 0:
+         rolls = math.ceil(math.log(1.0 - random()) / math.log(1.0 - probability))
+         nextUpdate = min(nextUpdate, last + minSpace + max(1, rolls) * interval)
+
+      self.settings.nextUpdate = int(nextUpdate)
+      return self.settings.nextUpdate
+
+   def UsesUpdateSchedule(self):
+      ''' 
+         True if this bot uses the default IsReadyForUpdate(), so nothing 
+         will happen before the time in the 'nextUpdate' setting.
+      '''
+      return (type(self).IsReadyForUpdate.__func__ is 
+         Nanobot.IsReadyForUpdate.__func__)
 
-      if lastTweetAge > maxSpace:
-         # been too long since the last tweet. Make a new one for our fans!
-         doUpdate = True
-
-      elif random() < self.settings.tweetProbability:
-         # Make sure that we're not tweeting too frequently. Default is to enforce 
-         # a 1-hour gap between tweets (configurable using the 'minimumSpacing' key
-         # in the config file, providing a number of minutes we must remain silent.)
-         requiredSpace = self.settings.GetOrDefault("minimumSpacing",  60*60)
-
-         if lastTweetAge > requiredSpace:
-            # Our last tweet was a while ago, let's make another one.
-            doUpdate = True
-
-      return doUpdate
+   def CanCheckUpdateEarly(self):
+      '''
+         Can IsReadyForUpdate() be called before we've connected to twitter
+         or called PreRun(), to find out whether this run has anything to 
+         do? True for the default version. If you override 
+         IsReadyForUpdate() and yours only needs the settings (or the clock),
+         override this to return True too, so that idle runs can exit early.
+      '''
+      return self.UsesUpdateSchedule()
 
 
 
    def CreateUpdateTweet(self):
-      ''' Override this method in your derived bot class. '''
-      pass
+      ''' Override this method in your derived bot class. 
+
+         ...or instead, override GenerateTweet(). The base version of this 
+         method takes a tweet from the content pool if there is one, and 
+         otherwise calls GenerateTweet().
+      '''
+      msg = None
+      pool = self.GetContentPool()
+      if pool:
+         msg = pool.Pop()
+      if msg is None:
+         msg = self.GenerateTweet()
+      if msg:
+         self.AddTweet(msg)
+
+   def GenerateTweet(self):
+      ''' 
+         Override this in your derived bot class to return a dict of 
+         arguments for update_status() (e.g. {'status': "Hello!"}), or None 
+         if you don't have anything to say. 
+
+         If the 'contentPoolSize' setting is non-zero, this is called ahead 
+         of time on a background thread to keep a pool of that many tweets 
+         ready to go, so expensive generation doesn't hold up a run. If 
+         yours changes a setting based on its current value (like 
+         ChooseLyric() does), do that inside `with self.settings.Locked():`.
+      '''
+      return None
 
    def HandleOneMention(self, mention):
       ''' should be overridden by derived classes. Base version 
@@ -203,6 +309,14 @@ class Nanobot(object):
    ## Methods That Your Bot Probably Won't Want To Override
    ## 
 
+   def CallHook(self, hook, *args):
+      '''
+         Call one of the methods that derived classes override (PreRun(), 
+         HandleOneMention(), a stream event handler...) and return what it 
+         returns. AsyncNanobot replaces this so those can be coroutines.
+      '''
+      return hook(*args)
+
    def GetPath(self, path):
       '''
          Put all the relative path calculations in one place. If we're given a path
@@ -225,30 +339,307 @@ class Nanobot(object):
          that's stored in the settings file is passed through datetime.strftime()
          so we can expand any format codes found there against the current date/time
          and create e.g. a monthly log file.
+
+         Log entries are buffered, and written out once there are 
+         'logBufferLines' of them waiting, once 'logFlushInterval' seconds 
+         have passed, when our state is saved, or when the process exits. If
+         the 'logFlushInBackground' setting is true, a thread also flushes 
+         the buffer every 'logFlushInterval' seconds.
+      '''
+      if self.logger is None:
+         # if there's no explicit log file path/name, we create one
+         # that's the current year & month.
+         fileName = self.settings.logFilePath
+         if not fileName:
+            fileName = "%Y-%m.txt"
+            self.settings.logFilePath = fileName
+         self.logger = NanobotLogger(self.GetPath(fileName), 
+            self.settings.GetOrDefault("logBufferLines", 50),
+            self.settings.GetOrDefault("logFlushInterval", 5),
+            self.settings.GetOrDefault("logFlushInBackground", False))
+      if eventType == "ERROR":
+         self.metrics.Increment("errors")
+      self.logger.Write(eventType, dataList)
+
+   def AddTweet(self, msg):
+      ''' 
+         Add a dict of arguments for update_status() to the list of tweets 
+         that we'll send. Safe to call from any thread.
+
+         If the bot uses an outbox (see GetOutbox()), the tweet goes straight
+         into it, so it will be sent even if this run crashes before it's 
+         done.
+      '''
+      outbox = self.GetOutbox()
+      if outbox:
+         outbox.Add(msg, self.settings.GetOrDefault("tweetPacing", 0))
+      else:
+         with self.tweetLock:
+            self.tweets.append(msg)
+      with self.tweetLock:
+         self.tweetsAdded += 1
+
+   def GetOutbox(self):
+      '''
+         Return the Outbox that our tweets are queued in before they're sent,
+         or None if we're not using one. The outbox is opt-in: set 
+         'useOutbox' to true to use one (it's never used in debug mode, 
+         where we only print our tweets). It keeps its files 
+         (`<botName>.outbox`, plus `.lock` and `.send` files next to it) in
+         botPath; a streaming process uses its own outbox file, like its own
+         seen id index.
+
+         Settings used with the outbox:
+         - 'tweetPacing': minimum seconds between tweets; a burst of replies
+           is spread out over that many seconds each, across runs if need be.
+         - 'sendWorkers': how many tweets can be sent at once (default 1). 
+           With more than one, tweets may not be posted in the order they
+           were added.
+         - 'tweetMaxAttempts': how many times we try to send a tweet before
+           giving up on it.
+         - 'tweetRetryDelay': seconds before the first retry; each one after 
+           that waits twice as long.
+      '''
+      if self.debug or not self.settings.GetOrDefault("useOutbox", False):
+         return None
+      if self.outbox is None:
+         with self.tweetLock:
+            if self.outbox is None:
+               # (imported here; outbox.py pulls in uuid, and through it 
+               # ctypes, which most runs never need)
+               from outbox import Outbox
+               self.outbox = Outbox(self.GetOutboxPath())
+      return self.outbox
+
+   def GetOutboxPath(self):
+      outboxFile = "{}-stream.outbox" if self.stream else "{}.outbox"
+      return self.GetPath(outboxFile.format(self.botName))
+
+   def GetCorpus(self):
+      '''
+         Return a Corpus containing all of the files that match the 
+         'lyricFilePath' setting (relative to botPath unless it's absolute).
+         Each file is indexed the first time we see it (and again whenever it
+         changes), so choosing random text from even a huge corpus is cheap.
+         Tick() refreshes the corpus, so a bot that stays running picks up 
+         changes to the files.
+      '''
+      if self.corpus is None:
+         self.corpus = Corpus(self.GetPath(self.settings.lyricFilePath or "*.lyric"))
+      return self.corpus
+
+   def ChooseLyric(self, stanza=False):
+      '''
+         Return a random line (or, if `stanza` is True, a random stanza) from
+         the corpus, or None if the corpus is empty. We avoid any file that 
+         we've chosen from in the last 'minimumDaySpacing' days (unless 
+         that's all of them); the time that each file was last used is kept
+         in the 'recentLyricFiles' setting.
       '''
       now = int(time())
-      today = datetime.fromtimestamp(now)
-      # if there's no explicit log file path/name, we create one
-      # that's the current year & month.
-      fileName = self.settings.logFilePath
-      if not fileName:
-         fileName = "%Y-%m.txt"
-         self.settings.logFilePath = fileName
-      path = self.GetPath(fileName)
-      path = today.strftime(path)
-      with open(path, "a+t") as f:
-         f.write("{0}\t{1}\t".format(now, eventType))
-         f.write("\t".join(dataList))
-         f.write("\n")
+      spacing = (self.settings.minimumDaySpacing or 0) * 24 * 60 * 60
+      # (GenerateTweet() may be running on the content pool's thread)
+      with self.settings.Locked():
+         corpus = self.GetCorpus()
+         choose = corpus.RandomStanza if stanza else corpus.RandomLine
+         recent = dict((path, when) for path, when in 
+            (self.settings.recentLyricFiles or {}).items() if now - when < spacing)
+         path, text = choose(set(recent))
+         if path:
+            recent[path] = now
+         self.settings.recentLyricFiles = recent
+      return text
+
+   def GetMarkovModel(self):
+      '''
+         Return the compiled MarkovModel from the file named in the 
+         'markovModelPath' setting. Build that file ahead of time with 
+         `python -m nanobot.markov compile`; then your CreateUpdateTweet() 
+         can just do something like:
+
+         self.AddTweet({'status': self.GetMarkovModel().Generate(140)})
+      '''
+      if self.markovModel is None:
+         from markov import MarkovModel
+         path = self.settings.GetOrDefault("markovModelPath", "markov.model")
+         self.markovModel = MarkovModel(self.GetPath(path))
+      return self.markovModel
+
+   def GetContentPool(self):
+      '''
+         Return our ContentPool, or None if the 'contentPoolSize' setting 
+         is zero (the default). The pool is refilled once it's down to 
+         'contentPoolLowWater' entries (default: half of its size). 
+      '''
+      size = self.settings.contentPoolSize
+      if not size:
+         return None
+      if self.contentPool is None:
+         self.contentPool = ContentPool(self.GetPath("{}.pool".format(self.botName)),
+            size, self.settings.contentPoolLowWater)
+      return self.contentPool
+
+   def RefillContentPool(self):
+      '''
+         If the content pool is running low, start a background thread to 
+         fill it by calling GenerateTweet().
+      '''
+      pool = self.GetContentPool()
+      if not pool or (self.poolFiller and self.poolFiller.is_alive()):
+         return
+      if pool.NeedsRefill():
+         def Fill():
+            try:
+               pool.Fill(self.GenerateTweet)
+            except Exception as e:
+               self.Log("ERROR", [str(e)])
+         self.poolFiller = Thread(target=Fill)
+         self.poolFiller.daemon = True
+         self.poolFiller.start()
+
+   def WaitForContentPool(self):
+      ''' Wait until any background pool refill has finished. '''
+      if self.poolFiller:
+         self.poolFiller.join()
+
+   def StartProfiling(self):
+      '''
+         Decide whether to profile this run, and if so, start. Runs are
+         profiled if we were started with `--profile`, and otherwise a 
+         random 'profileRate' fraction of them are (default 0, so that it 
+         can be left on in production at e.g. 0.01). A process that stays 
+         running treats each Tick() (for a daemon) or each stretch between 
+         saving its state (for a streaming process) as a run.
+
+         If 'profilePhases' is a list of method names (e.g. 
+         ["CreateUpdateTweet", "Handle_follow"]) only calls to those 
+         methods are profiled; otherwise it's the whole run -- or, in a 
+         streaming process, whose work is done on several threads, the 
+         methods in `kStreamProfilePhases`.
+
+         Profiles go into the 'profilePath' directory (default "profiles"), 
+         which is kept under 'profileMaxBytes' (default 20MB) by deleting 
+         the oldest ones. See profiler.py.
+      '''
+      rate = 1 if self.profile else self.settings.GetOrDefault("profileRate", 0)
+      if not rate or random() >= rate:
+         return
+      from profiler import RunProfiler
+      self.profiler = RunProfiler(
+         self.GetPath(self.settings.GetOrDefault("profilePath", "profiles")),
+         self.botName,
+         self.settings.GetOrDefault("profileMaxBytes", 20 * 1024 * 1024))
+      phases = self.settings.profilePhases
+      if not phases and self.stream:
+         phases = kStreamProfilePhases
+      if phases:
+         for name in phases:
+            method = getattr(self, name, None)
+            if method is None:
+               self.Log("ProfileError", ["no such method", name])
+            else:
+               setattr(self, name, self.profiler.Wrap(method))
+               self.profiledPhases.append(name)
+      else:
+         self.profiler.Start()
+
+   def StopProfiling(self):
+      ''' write out the profile for this run, if there is one. '''
+      if self.profiler:
+         # (back to the methods of our class)
+         for name in self.profiledPhases:
+            delattr(self, name)
+         self.profiledPhases = []
+         self.profiler.Stop()
+         self.profiler = None
 
    def SendTweets(self):
-      ''' send each of the status updates that are collected in self.tweets 
+      ''' 
+         Send each of the status updates that are collected in self.tweets,
+         or (if we use an outbox) every tweet in the outbox that's due to go 
+         out now, on up to 'sendWorkers' threads at once.
       '''
-      for msg in self.tweets:
-         if self.debug:
-            print "TWEET: {0}".format(msg['status'].encode("UTF-8"))
-         else:
-            self.twitter.update_status(**msg)
+      # grab the current list and start a new one before sending, so we 
+      # don't lose or resend anything appended while we're working.
+      with self.tweetLock:
+         tweets = self.tweets
+         self.tweets = []
+      outbox = self.GetOutbox()
+      if not outbox:
+         for msg in tweets:
+            if self.debug:
+               print "TWEET: {0}".format(msg['status'].encode("UTF-8"))
+            elif self.twitter.update_status(**msg) is not None:
+               # (the ApiGateway returns None if it had to put this one off)
+               self.metrics.Increment("tweets_sent")
+         return
+
+      # (anything that was added to self.tweets directly)
+      pacing = self.settings.GetOrDefault("tweetPacing", 0)
+      for msg in tweets:
+         outbox.Add(msg, pacing)
+      # (only one process sends at a time, and Due() doesn't hand out the 
+      # entries that another of our threads is already sending)
+      with outbox.Sending():
+         due = outbox.Due()
+         try:
+            workers = min(self.settings.GetOrDefault("sendWorkers", 1), len(due))
+            if workers > 1:
+               from multiprocessing.pool import ThreadPool
+               pool = ThreadPool(workers)
+               try:
+                  pool.map(self.SendFromOutbox, due)
+               finally:
+                  pool.close()
+                  pool.join()
+            else:
+               for entry in due:
+                  self.SendFromOutbox(entry)
+         finally:
+            # anything that we didn't get to can go out next time.
+            outbox.Release([entryId for entryId, entry in due])
+         outbox.Compact()
+
+   def SendFromOutbox(self, entry):
+      '''
+         Try to send one (id, entry) from the outbox, and record what 
+         happened. A failure never stops the other tweets from going out; 
+         it's retried later, unless twitter told us that it won't ever 
+         accept it (e.g. a duplicate status).
+      '''
+      from twython.exceptions import TwythonError
+      entryId, entry = entry
+      outbox = self.GetOutbox()
+      try:
+         result = self.twitter.update_status(**entry["msg"])
+      except TwythonError as e:
+         error = e
+         status = e.error_code or 0
+         if 400 <= status < 500 and status != 429:
+            outbox.MarkDropped(entryId, str(e))
+            self.Log("TweetDropped", [str(e), entry["msg"].get("status", "")])
+            return
+      except Exception as e:
+         # (connection errors, timeouts...)
+         error = e
+      else:
+         # if the ApiGateway put it off (and returned None), the call is 
+         # in its list of deferred calls now, so it's not ours to retry.
+         outbox.MarkSent(entryId)
+         if result is not None:
+            self.metrics.Increment("tweets_sent")
+         return
+
+      attempts = entry["attempts"] + 1
+      if attempts >= self.settings.GetOrDefault("tweetMaxAttempts", 5):
+         outbox.MarkDropped(entryId, str(error))
+         self.Log("TweetDropped", [str(error), entry["msg"].get("status", "")])
+         return
+      delay = min(kMaxRetryDelay, 
+         self.settings.GetOrDefault("tweetRetryDelay", 30) * 2 ** (attempts - 1))
+      outbox.MarkRetry(entryId, attempts, time() + delay, str(error))
+      self.metrics.Increment("tweets_retried")
+      self.Log("TweetRetry", [str(error), "attempt {0}".format(attempts)])
 
 
    def CreateUpdate(self):
@@ -256,25 +647,178 @@ class Nanobot(object):
          Called everytime the bot is Run(). 
 
          Checks to see if the bot thinks that it's ready to generate new output, 
-         and if so, calls CreateUpdateTweet to generate it.
+         and if so, calls CreateUpdateTweet to generate it. The update only
+         counts (and the next one is scheduled) if a tweet was queued; if 
+         not, we try again in 'updateInterval' seconds.
 
       '''
 
-      if self.force or self.IsReadyForUpdate():
-         self.CreateUpdateTweet()
+      updateDue = self.updateDue
+      self.updateDue = None
+      if self.force or updateDue or (updateDue is None and self.IsReadyForUpdate()):
+         before = (self.tweetsAdded, len(self.tweets))
+         self.CallHook(self.CreateUpdateTweet)
+         if (self.tweetsAdded, len(self.tweets)) != before:
+            self.settings.lastUpdate = int(time())
+            self.ScheduleNextUpdate()
+         else:
+            self.settings.nextUpdate = int(time() + 
+               self.settings.GetOrDefault("updateInterval", 60))
 
 
    def HandleMentions(self):
       '''
          Get all the tweets that mention us since the last time we ran and 
-         process each one.
+         process each one, oldest first. The 'lastMentionId' setting is 
+         updated as each mention is handled and written out after every page
+         of mentions, so if we crash part of the way through a big backlog
+         the next run picks up where we left off.
+
+         If the 'mentionConcurrency' setting is greater than 1, that many 
+         mentions are handled at once on a pool of threads (so your 
+         HandleOneMention() needs to be thread-safe -- use AddTweet() instead
+         of appending to self.tweets). 'lastMentionId' only ever moves past
+         mentions that have been handled along with every mention before 
+         them, so a failure never causes us to skip a mention.
+      '''
+      self.settings.lastMentionCheck = int(time())
+      pageSize = self.settings.GetOrDefault("mentionPageSize", 200)
+      concurrency = self.settings.GetOrDefault("mentionConcurrency", 1)
+      mentions = self.IterMentions(pageSize)
+      if concurrency > 1:
+         mentions = self.HandleMentionsConcurrently(mentions, concurrency)
+      else:
+         mentions = self.HandleMentionsSerially(mentions)
+
+      for count, mention in enumerate(mentions, 1):
+         self.settings.lastMentionId = mention['id_str']
+         if 0 == count % pageSize:
+            self.SaveState()
+
+   def HandleNewMention(self, mention):
+      ''' 
+         Pass the mention to HandleOneMention() unless we've already handled
+         it (e.g. in a run that crashed before it could save its settings)
       '''
-      mentions = self.twitter.get_mentions_timeline(since_id=self.settings.lastMentionId)
-      if mentions:
-         # Remember the most recent tweet id, which will be the one at index zero.
-         self.settings.lastMentionId = mentions[0]['id_str']
+      theId = mention['id_str']
+      if theId not in self.seenIds:
+         self.CallHook(self.HandleOneMention, mention)
+         self.seenIds.Add(theId)
+         self.metrics.Increment("mentions_handled")
+
+   def HandleMentionsSerially(self, mentions):
+      ''' Handle each mention, then yield it so it can be checkpointed. '''
+      for mention in mentions:
+         self.HandleNewMention(mention)
+         yield mention
+
+   def HandleMentionsConcurrently(self, mentions, concurrency):
+      ''' 
+         Keep up to 2 * `concurrency` mentions in flight on a thread pool, 
+         yielding each one (in the order we got them) once it and all the 
+         mentions before it have been handled. If a handler raises, its 
+         exception is re-raised here after the in-flight mentions finish.
+      '''
+      from multiprocessing.pool import ThreadPool
+      pool = ThreadPool(concurrency)
+      pending = deque()
+      try:
          for mention in mentions:
-            self.HandleOneMention(mention)
+            pending.append((mention, pool.apply_async(self.HandleNewMention, (mention,))))
+            if len(pending) >= 2 * concurrency:
+               mention, result = pending.popleft()
+               result.get()
+               yield mention
+         while pending:
+            mention, result = pending.popleft()
+            result.get()
+            yield mention
+      finally:
+         pool.close()
+         pool.join()
+
+   def IterMentions(self, pageSize=200):
+      '''
+         Generator that yields every mention newer than 'lastMentionId', 
+         oldest first.
+
+         The API returns mentions newest first, one page at a time, so we
+         page backwards (using max_id) until we get an empty page (a short 
+         page doesn't mean that there aren't any more), and then yield the 
+         pages in the other order. Only the last page that we fetched (the
+         oldest one) is kept in memory; the others are written to a 
+         temporary file as we go and read back one at a time, so a huge 
+         backlog of mentions doesn't have to fit in memory.
+
+         If one of the calls can't be made (the ApiGateway put it off), we 
+         don't know where the mentions since 'lastMentionId' start, so we 
+         yield nothing, leaving them all for the next run.
+      '''
+      sinceId = self.settings.lastMentionId
+      page = None
+      # file offsets of the pages that we've written to `spill`, newest first
+      spilled = []
+      spill = None
+      maxId = None
+      try:
+         while True:
+            nextPage = self.GetMentionsPage(sinceId, maxId, pageSize)
+            if nextPage is None:
+               self.Log("MentionsDeferred", ["after {0} pages".format(
+                  len(spilled) + (1 if page else 0))])
+               return
+            if not nextPage:
+               break
+            if page:
+               if spill is None:
+                  # (imported here, since most runs only get one page)
+                  import tempfile
+                  spill = tempfile.TemporaryFile()
+               spilled.append(spill.tell())
+               spill.write(json.dumps(page) + "\n")
+            page = nextPage
+            maxId = int(page[-1]['id_str']) - 1
+            if sinceId and maxId <= int(sinceId):
+               break
+
+         if page:
+            for mention in reversed(page):
+               yield mention
+         for offset in reversed(spilled):
+            spill.seek(offset)
+            page = json.loads(spill.readline())
+            for mention in reversed(page):
+               yield mention
+      finally:
+         if spill:
+            spill.close()
+
+   def GetMentionsPage(self, sinceId, maxId, pageSize):
+      '''
+         Return a single page of mentions between sinceId (exclusive) and 
+         maxId (inclusive), or None if the call couldn't be made.
+      '''
+      args = {'count': pageSize}
+      if sinceId:
+         args['since_id'] = sinceId
+      if maxId is not None:
+         args['max_id'] = maxId
+      # the ApiGateway returns None if we're out of budget for this endpoint.
+      return self.twitter.get_mentions_timeline(**args)
+
+   def MakeRecord(self, raw):
+      '''
+         Decode the json text of a saved stream event. If the 'slimRecords'
+         setting is true, it's a compact Record (see records.py) that only 
+         keeps the fields that handlers usually look at, instead of a dict 
+         of everything; a backlog of stream events for a batch handler takes
+         a fraction of the memory that way. (Events that the streaming 
+         process hands straight to its dispatch workers, and mentions, are 
+         always plain dicts.)
+      '''
+      if self.settings.GetOrDefault("slimRecords", False):
+         return Record(raw)
+      return json.loads(raw.decode("utf-8"))
 
 
    def HandleStreamEvents(self):
@@ -292,21 +836,170 @@ class Nanobot(object):
          unfollow, list_created, list_destroyed, list_updated,
          list_member_added, list_member_removed, list_user_subscribed,
          list_user_unsubscribed, quoted_tweet, user_update. 
+
+         Events are read from the per-file spool unless the 'streamBackend'
+         setting is "journal", in which case they're replayed from the 
+         EventJournal, starting at the offset in the 'journalOffset' setting.
+
+         Events for types that have a batch handler (see handlers.py) are 
+         collected and handed over together at the end; their spool files 
+         (and the journal offset) aren't committed until that's done.
+
+         Spool files are claimed before they're handled (see spool.py), so
+         overlapping runs never handle the same event twice, and a run can
+         drain the spool on 'spoolWorkers' threads at once, each claiming
+         'spoolClaimSize' files at a time.
       '''
-      events = glob(self.GetPath("*{0}".format(kStreamFileExtension)))
-      for fileName in events:
-         with open(fileName, "rt") as f:
-            data = json.loads(f.read().decode("utf-8"))
-            eventType = data["event"]
-            handlerName = "Handle_{0}".format(eventType)
-            handler = getattr(self, handlerName, None)
-            if handler:
-               handler(data)
-            else:
-               # log that we got something we didn't know how to handle.
-               self.Log("UnknownStreamEvent", [eventType])
-         # remove the file so we don't process it again!
-         os.remove(self.GetPath(fileName))
+      batches = {}
+      if self.settings.streamBackend == "journal":
+         journal = self.GetJournal()
+         # only throw away segments that we know we've committed.
+         offset = self.settings.journalOffset or 0
+         journal.Cleanup(offset)
+         for offset, data in journal.Read(offset, self.MakeRecord):
+            self.HandleOneStreamEvent(data, batches)
+            if not batches:
+               self.settings.journalOffset = offset
+
+      # handle anything in the per-file spool (in journal mode, this is 
+      # whatever was left by a streamer that hasn't been restarted yet)
+      workers = self.settings.GetOrDefault("spoolWorkers", 1)
+      spools = [self.GetSpool(worker) for worker in range(workers)]
+      spools[0].RecoverStale()
+      try:
+         if workers > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(workers)
+            try:
+               drained = pool.map(self.DrainSpool, spools)
+            finally:
+               pool.close()
+               pool.join()
+         else:
+            drained = [self.DrainSpool(spools[0])]
+
+         for spoolBatches in drained:
+            for eventType, batch in spoolBatches.items():
+               batches.setdefault(eventType, []).extend(batch)
+         if batches:
+            self.HandleBatches(batches)
+            if self.settings.streamBackend == "journal":
+               self.settings.journalOffset = offset
+            for spool in spools:
+               for fileName in spool.Claimed():
+                  spool.Done(fileName)
+      finally:
+         # (if a handler failed, whatever we hadn't finished with goes back 
+         # into the spool)
+         for spool in spools:
+            spool.Close()
+
+   def DrainSpool(self, spool):
+      '''
+         Claim and handle spool files until there aren't any left, returning
+         a dict of the events that were batched (see HandleStreamEvents()). 
+         The files for batched events are left claimed.
+      '''
+      batches = {}
+      claimSize = self.settings.GetOrDefault("spoolClaimSize", 100)
+      while True:
+         claimed = spool.Claim(claimSize)
+         if not claimed:
+            return batches
+         for fileName in claimed:
+            with open(fileName, "rt") as f:
+               data = self.MakeRecord(f.read())
+            if self.HandleOneStreamEvent(data, batches):
+               # remove the file so we don't process it again!
+               spool.Done(fileName)
+
+   def HandleOneStreamEvent(self, data, batches=None):
+      '''
+         Pass the event to the method that handles its type (see 
+         handlers.py), or if there's a batch handler for its type and we've 
+         been given a `batches` dict of {eventType: [(key, event), ...]}, add
+         it to that instead. Returns False if the event was batched.
+      '''
+      eventType = data["event"]
+      key = self.StreamEventKey(data)
+      if key in self.seenIds:
+         return True
+      batchHandler = self.batchHandlers.get(eventType)
+      if batchHandler and batches is not None:
+         batches.setdefault(eventType, []).append((key, data))
+         return False
+
+      handlerName = self.eventHandlers.get(eventType)
+      if batchHandler:
+         self.CallHook(getattr(self, batchHandler), [data])
+      elif handlerName:
+         self.CallHook(getattr(self, handlerName), data)
+      else:
+         # maybe a handler that was added after the class was defined.
+         handler = getattr(self, kHandlerPrefix + eventType, None)
+         if handler:
+            self.CallHook(handler, data)
+         else:
+            # log that we got something we didn't know how to handle.
+            self.Log("UnknownStreamEvent", [eventType])
+      self.seenIds.Add(key)
+      self.metrics.Increment("events_handled", event=eventType)
+      return True
+
+   def HandleBatches(self, batches):
+      '''
+         Call the batch handler for each type of event in `batches` (as
+         filled in by HandleOneStreamEvent()) with its list of events.
+      '''
+      for eventType, batch in batches.items():
+         # the same event may be in the spool more than once.
+         keys = set()
+         events = []
+         for key, data in batch:
+            if key not in keys:
+               keys.add(key)
+               events.append(data)
+         self.CallHook(getattr(self, self.batchHandlers[eventType]), events)
+         for key in keys:
+            self.seenIds.Add(key)
+         self.metrics.Increment("events_handled", len(events), event=eventType)
+
+   def StreamEventKey(self, data):
+      '''
+         Events don't have an id of their own, so we identify them (for the
+         seen id index) by their type, who did what to whom, and when.
+      '''
+      def IdOf(obj):
+         return (obj or {}).get('id_str', "")
+      return "{0}:{1}:{2}:{3}:{4}".format(data["event"], IdOf(data.get('source')),
+         IdOf(data.get('target')), IdOf(data.get('target_object')), 
+         data.get('created_at', ""))
+
+   def HasPendingStreamEvents(self):
+      ''' Are there any saved stream events waiting to be handled? '''
+      if self.settings.streamBackend == "journal":
+         if self.GetJournal().HasEvents(self.settings.journalOffset or 0):
+            return True
+      # (including any that were claimed by a run that crashed)
+      self.GetSpool().RecoverStale()
+      return bool(self.GetSpoolFiles())
+
+   def GetSpoolFiles(self):
+      return glob(self.GetPath("*{0}".format(kStreamFileExtension)))
+
+   def GetSpool(self, worker=0):
+      '''
+         Return a Spool that consumer number `worker` in this process can 
+         claim spool files with. Claims that haven't been touched for 
+         'spoolClaimTimeout' seconds are assumed to have been abandoned.
+      '''
+      return Spool(self.botPath, kStreamFileExtension, worker,
+         self.settings.GetOrDefault("spoolClaimTimeout", 10 * 60))
+
+   def GetJournal(self):
+      path = self.GetPath(self.settings.GetOrDefault("journalPath", "journal"))
+      segmentSize = self.settings.GetOrDefault("journalSegmentSize", 1024 * 1024)
+      return EventJournal(path, segmentSize)
 
 
 
@@ -319,66 +1012,374 @@ class Nanobot(object):
       defaultSettings.update(self.GetDefaultConfigOptions())
       self.settings = Settings(self.GetPath("{}.json".format(self.botName)), 
          defaultSettings)
+      if self.settings.settingsChangeLog:
+         # bots that keep a lot of state in their settings can choose to 
+         # only write out what's changed each time.
+         self.settings.EnableChangeLog(
+            self.settings.GetOrDefault("settingsCompactEntries", 100))
+
+      # the ids of mentions/events that we've already handled. A streaming
+      # process keeps its own index so the two processes don't overwrite
+      # each other's.
+      seenFile = "{}-stream.seen" if self.stream else "{}.seen"
+      self.seenIds = SeenIdIndex(self.GetPath(seenFile.format(self.botName)),
+         capacity=self.settings.GetOrDefault("seenIdCapacity", 20000),
+         maxAge=self.settings.GetOrDefault("seenIdMaxAge", 30 * 24 * 60 * 60))
+
+      # timings and counts of what we do can be exported to a Prometheus
+      # textfile ('metricsFile') and/or a statsd server ('metricsStatsd',
+      # as "host:port"). See metrics.py.
+      textFile = self.settings.metricsFile
+      statsd = self.settings.metricsStatsd
+      if textFile or statsd:
+         self.metrics = Metrics(self.botName, 
+            self.GetPath(textFile) if textFile else None, statsd)
+
+   def SaveState(self):
+      '''
+         Write out our settings (if they've changed), the seen id index, 
+         any log entries that are waiting to be written, and our metrics.
+      '''
+      with self.metrics.Time("phase", phase="SaveState"):
+         self.seenIds.Save()
+         self.settings.Write()
+         if self.logger:
+            self.logger.Flush()
+      if self.connectionKey:
+         from connections import sharedPool
+         for name, value in sharedPool.Stats(self.connectionKey).items():
+            self.metrics.SetGauge("http_" + name, value)
+      self.metrics.Flush()
+
+   def Connect(self):
+      '''
+         Create the object that's going to communicate with the twitter API --
+         either a Twython object or (in streaming mode) a NanobotStreamer, 
+         which is also available as `self.streamer`.
+      '''
+      appKey = self.settings.appKey
+      appSecret = self.settings.appSecret
+      accessToken = self.settings.accessToken
+      accessTokenSecret = self.settings.accessTokenSecret
+      if self.stream:
+         from streamer import NanobotStreamer
+         # if we don't hear anything (twitter sends a keep-alive every 30 
+         # seconds) for 'streamStallTimeout' seconds, the streamer reconnects.
+         self.streamer = NanobotStreamer(appKey, appSecret, accessToken, 
+            accessTokenSecret, 
+            timeout=self.settings.GetOrDefault("streamStallTimeout", 90))
+         self.streamer.SetOutputPath(self.botPath)
+         if self.settings.streamBackend == "journal":
+            # we're the only process that writes to the journal, so this is
+            # where any events left in the old per-file spool get moved over.
+            journal = self.GetJournal()
+            spool = self.GetSpool()
+            spool.RecoverStale()
+            journal.MigrateSpool(spool.Claim())
+            spool.Close()
+            self.streamer.SetJournal(journal)
+
+         # if the 'streamWorkers' setting is non-zero, events are handled 
+         # in this process as soon as they arrive, and the handlers need 
+         # a regular (non-streaming) client to talk to the API with.
+         workerCount = self.settings.GetOrDefault("streamWorkers", 0)
+         if workerCount:
+            self.twitter = self.CreateApiGateway(self.CreateClient())
+            self.streamer.StartDispatch(self, workerCount, 
+               self.settings.GetOrDefault("streamQueueSize", 100))
+         else:
+            self.twitter = self.streamer
+      else:
+         self.twitter = self.CreateApiGateway(self.CreateClient())
+
+   def CreateClient(self, poolSize=None):
+      '''
+         Create the (non-streaming) Twython object that we use for REST API
+         calls. If there's an 'apiUrl' value in the settings (e.g.
+         "http://localhost:8080/%s") we talk to that server instead of 
+         twitter -- the benchmarks in bench/ use this to run a bot against a 
+         local stand-in.
+
+         Unless 'shareConnections' is false, every client in this process 
+         with the same credentials uses the same keep-alive HTTP session 
+         (see connections.py), with up to `poolSize` (by default, 
+         'httpPoolSize') connections. Each
+         request times out after 'httpConnectTimeout' seconds without a 
+         connection or 'httpReadTimeout' seconds without a response.
+      '''
+      from twython import Twython
+      timeout = (self.settings.GetOrDefault("httpConnectTimeout", 10),
+         self.settings.GetOrDefault("httpReadTimeout", 60))
+      client = Twython(self.settings.appKey, self.settings.appSecret, 
+         self.settings.accessToken, self.settings.accessTokenSecret,
+         client_args={"timeout": timeout})
+      apiUrl = self.settings.apiUrl
+      if apiUrl:
+         client.api_url = apiUrl
+      if self.settings.GetOrDefault("shareConnections", True):
+         from connections import sharedPool
+         self.connectionKey = (self.settings.appKey, self.settings.appSecret,
+            self.settings.accessToken, self.settings.accessTokenSecret)
+         if poolSize is None:
+            poolSize = self.settings.GetOrDefault("httpPoolSize", 10)
+         client.client = sharedPool.Session(self.connectionKey, client.client,
+            poolSize)
+      return client
+
+   def CreateApiGateway(self, client):
+      '''
+         Wrap the Twython object in an ApiGateway that keeps track of our 
+         rate limits. All of the write calls share a budget of 'writeBudget'
+         calls a day (default 2400, twitter's limit; 0 turns it off), and 
+         low priority calls (favorites) are deferred once less than the 
+         fraction of it given by the 'rateLimitReserve' setting is left. 
+         Calls that have to be dropped are logged as "ApiCallDropped".
+      '''
+      from gateway import ApiGateway
+      from gateway import kWriteBudget
+      reserve = self.settings.GetOrDefault("rateLimitReserve", 0.25)
+      return ApiGateway(client, self.settings, reserve, self.metrics, self.Log,
+         self.settings.GetOrDefault("writeBudget", kWriteBudget))
+
+   def Tick(self, phases=None):
+      '''
+         Do one pass of bot stuff:
+         - retry any API calls that were deferred by the ApiGateway
+         - pick up any changes to the lyric files
+         - execute each of the phases (by default: maybe create a tweet,
+           handle any mentions, handle any saved streaming API events)
+         - send tweets out
+         - start refilling the content pool if it's running low
+         - write out any changes to the settings.
+      '''
+      if phases is None:
+         phases = (self.CreateUpdate, self.HandleMentions, self.HandleStreamEvents)
+      # retry any API calls that we had to put off last time because we 
+      # were running low on our rate limits.
+      with self.metrics.Time("phase", phase="RetryDeferred"):
+         self.twitter.RetryDeferred()
+      if self.corpus:
+         # (the content pool may be choosing lyrics on its own thread)
+         with self.settings.Locked():
+            self.corpus.Refresh()
+      for phase in phases:
+         with self.metrics.Time("phase", phase=phase.__name__):
+            phase()
+      with self.metrics.Time("phase", phase="SendTweets"):
+         self.SendTweets()
+
+      # now that anything we had to say is out the door, make sure that 
+      # we've got more to say next time.
+      self.RefillContentPool()
+
+      # if anything we did changed the settings, make sure those changes 
+      # get written out.
+      self.settings.lastExecuted = str(datetime.now())
+      self.SaveState()
+
+   def RunDaemon(self):
+      '''
+         Instead of being launched by cron once per tick, stay alive and 
+         drive the same phases from an in-process scheduler. Settings and the 
+         API client are only loaded/created once. 
+
+         The intervals (in seconds) are controlled by the settings keys 
+         'updateInterval' (how often we check IsReadyForUpdate()) and 
+         'mentionInterval' (how often we look for mentions and saved stream
+         events). Both default to 60 seconds, matching a once-a-minute cron job.
+      '''
+      updateInterval = self.settings.GetOrDefault("updateInterval", 60)
+      mentionInterval = self.settings.GetOrDefault("mentionInterval", 60)
+      scheduler = sched.scheduler(time, sleep)
+
+      def Schedule(interval, phases, nextTime=None):
+         def Fire():
+            self.StartProfiling()
+            try:
+               self.Tick(phases)
+            except KeyboardInterrupt:
+               raise
+            except Exception as e:
+               # one bad tick shouldn't kill the daemon.
+               print str(e)
+               self.Log("ERROR", [str(e)])
+            finally:
+               self.StopProfiling()
+            # --force only applies to the first update we make.
+            self.force = False
+            delay = interval
+            if nextTime:
+               delay = max(kMinDaemonDelay, nextTime() - time())
+            scheduler.enter(delay, 0, Fire, ())
+         scheduler.enter(0, 0, Fire, ())
+
+      # if the bot uses the default update schedule, we know exactly when 
+      # the next update is due and can sleep until then.
+      nextUpdate = None
+      if self.UsesUpdateSchedule():
+         nextUpdate = lambda: self.settings.nextUpdate or 0
+      Schedule(updateInterval, (self.CreateUpdate,), nextUpdate)
+      Schedule(mentionInterval, (self.HandleMentions, self.HandleStreamEvents))
+
+      if self.debug:
+         print "Running as daemon (update every {0}s, mentions every {1}s)".format(
+            updateInterval, mentionInterval)
+      try:
+         scheduler.run()
+      except KeyboardInterrupt:
+         # make sure that anything we've changed gets saved before we exit.
+         self.SaveState()
+
+   def HandleTermination(self):
+      '''
+         A streaming or daemon process is usually stopped with SIGTERM 
+         rather than Ctrl-C; treat it the same way, so that we stop cleanly
+         and save our state on the way out.
+      '''
+      def Terminate(signum, frame):
+         raise KeyboardInterrupt("SIGTERM")
+      try:
+         signal.signal(signal.SIGTERM, Terminate)
+      except ValueError:
+         # we're not on the main thread (e.g. we're being hosted by 
+         # something else), so it's not ours to handle.
+         pass
+
+   def IsMentionCheckDue(self):
+      ''' 
+         Has it been at least 'mentionInterval' seconds since we last 
+         looked for mentions?
+      '''
+      interval = self.settings.GetOrDefault("mentionInterval", 60)
+      last = self.settings.lastMentionCheck or 0
+      return time() - last + kScheduleSlack >= interval
+
+   def HasWorkToDo(self):
+      '''
+         Called on a normal (cron) run right after our settings are loaded,
+         before we import twython or connect to anything. If we're not going
+         to tweet, it's not time to look for mentions, and there are no 
+         saved stream events, tweets in the outbox or deferred API calls 
+         waiting, we can exit right away (without calling PreRun() or 
+         PostRun()). 
+
+         IsReadyForUpdate() is only called this early if 
+         CanCheckUpdateEarly() says that's safe; otherwise every run goes
+         all the way through. Bots that need every run to go all the way through can turn this 
+         off by setting 'skipIdleRuns' to false.
+      '''
+      if self.force or not self.settings.GetOrDefault("skipIdleRuns", True):
+         return True
+      if not self.CanCheckUpdateEarly():
+         return True
+      # remember this so we don't roll the dice twice in one run.
+      self.updateDue = self.IsReadyForUpdate()
+      return (self.updateDue or self.IsMentionCheckDue() or 
+         self.HasPendingStreamEvents() or self.HasTweetsDue() or
+         bool((self.settings.rateLimits or {}).get("deferred")))
+
+   def HasTweetsDue(self):
+      ''' Are there tweets in the outbox that can be sent now? '''
+      # (don't create an outbox just to find out that it's empty)
+      if not os.path.exists(self.GetOutboxPath()):
+         return False
+      outbox = self.GetOutbox()
+      return bool(outbox and outbox.HasDue())
+
+   def Start(self):
+      '''
+         Get ready to run: load settings, connect to twitter and let the 
+         derived bot class get set up. Anything that hosts a bot and calls 
+         Tick() itself (e.g. the multi-bot supervisor) calls this once first.
+      '''
+      self.LoadSettings()
+
+      # create the Twython object that's going to communicate with the
+      # twitter API.
+      self.Connect()
+
+      # give the derived bot class a chance to do whatever it needs
+      # to do before we actually execute. 
+      self.CallHook(self.PreRun)
 
    def Run(self):
       '''
          All the high-level logic of the bot is driven from here:
          - load settings
+         - (if there's nothing to do, exit now)
          - connect to twitter
          - (let your derived bot class get set up)
          - either:
             - wait for events from the streaming API
+            - stay alive as a daemon, doing bot stuff on a schedule
             - do bot stuff:
                - maybe create one or more tweets
                - handle any mentions
                - handle any streaming API events that were saved
                - send tweets out
          - (let your derived bot class clean up)
+
+         If metrics are turned on, the time taken by each of these phases
+         is recorded (see metrics.py)
       '''
+      # we don't know whether we need a (monotonic) metrics clock until 
+      # the settings are loaded, so this one is timed with the wall clock.
+      loadStart = time()
       self.LoadSettings()
+      self.metrics.Observe("phase", time() - loadStart, phase="LoadSettings")
+      if not (self.stream or self.daemon or self.HasWorkToDo()):
+         # nothing for us to do this time (except maybe get some tweets 
+         # ready for later)
+         self.metrics.Increment("runs", kind="idle")
+         self.RefillContentPool()
+         self.WaitForContentPool()
+         self.SaveState()
+         return
+
+      self.metrics.Increment("runs", kind="active")
+      # (a daemon or a streaming process profiles each of its ticks instead;
+      # see StartProfiling())
+      if not (self.stream or self.daemon):
+         self.StartProfiling()
+      try:
+         with self.metrics.Time("phase", phase="Connect"):
+            self.Connect()
+
+         # give the derived bot class a chance to do whatever it needs
+         # to do before we actually execute. 
+         with self.metrics.Time("phase", phase="PreRun"):
+            self.CallHook(self.PreRun)
+         if self.stream:
+            if self.debug:
+               print "About to stream from user account."
+            self.HandleTermination()
+            try:
+               # This will sit forever waiting for events on our user account
+               # to stream down (reconnecting as needed). Those events will 
+               # be handled for us by the BotStreamer object that we created 
+               # above
+               self.streamer.StreamForever(self)
+            except KeyboardInterrupt:
+               # disconnect cleanly from the server.
+               self.streamer.Stop()
+            finally:
+               self.streamer.StopDispatch()
+               self.SaveState()
+         elif self.daemon:
+            self.HandleTermination()
+            self.RunDaemon()
+         else:
+            self.Tick()
 
+         # ...and let the derived bot class clean up as it needs to.
+         with self.metrics.Time("phase", phase="PostRun"):
+            self.CallHook(self.PostRun)
 
-      # create the Twython object that's going to communicate with the
-      # twitter API.
-      appKey = self.settings.appKey
-      appSecret = self.settings.appSecret
-      accessToken = self.settings.accessToken
-      accessTokenSecret = self.settings.accessTokenSecret
-      if self.stream:
-         self.twitter = NanobotStreamer(appKey, appSecret, accessToken, accessTokenSecret)
-         self.twitter.SetOutputPath(self.botPath)
-      else:
-         self.twitter = Twython(appKey, appSecret, accessToken, accessTokenSecret)
-
-
-      # give the derived bot class a chance to do whatever it needs
-      # to do before we actually execute. 
-      self.PreRun()
-      if self.stream:
-         if self.debug:
-            print "About to stream from user account."
-         try:
-            # The call to user() will sit forever waiting for events on 
-            # our user account to stream down. Those events will be handled 
-            # for us by the BotStreamer object that we created above
-            self.twitter.user()
-         except KeyboardInterrupt:
-            # disconnect cleanly from the server.
-            self.twitter.disconnect()
-      else:
-         self.CreateUpdate()
-         self.HandleMentions()
-         self.HandleStreamEvents()
-         self.SendTweets()
-
-         # if anything we did changed the settings, make sure those changes 
-         # get written out.
-         self.settings.lastExecuted = str(datetime.now())
-         self.settings.Write()
-
-      # ...and let the derived bot class clean up as it needs to.
-      self.PostRun()
-
+         # don't exit while we're in the middle of filling the content pool.
+         self.WaitForContentPool()
+      finally:
+         self.StopProfiling()
+      self.metrics.Flush()
 
 
    @classmethod
@@ -394,6 +1395,7 @@ class Nanobot(object):
       except Exception as e:
          print str(e)
          bot.Log("ERROR", [str(e)])
+         bot.metrics.Flush()
 
 
 def GetBotArguments(argAdder=None):
@@ -417,6 +1419,12 @@ def GetBotArguments(argAdder=None):
       help="force operation now instead of waiting for randomness")
    parser.add_argument("--stream", action="store_true", 
       help="run in streaming mode")
+   parser.add_argument("--daemon", action="store_true", 
+      help="stay running, doing bot stuff on an internal schedule instead of "
+      "being launched by cron")
+   parser.add_argument("--profile", action="store_true",
+      help="profile this run (see the 'profile*' settings for where the "
+      "results go)")
 
    if argAdder:
       argAdder(parser)
@@ -0,0 +1,266 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   outbox.py -- a durable queue of tweets waiting to be sent.
+
+   The outbox is an append-only file with one json record per line. Each
+   record is a change to the state of one entry:
+
+   {"op": "add", "id": ..., "msg": {...update_status() args...}, "notBefore": t}
+   {"op": "retry", "id": ..., "attempts": n, "notBefore": t, "error": ...}
+   {"op": "sent", "id": ...}
+   {"op": "dropped", "id": ..., "error": ...}
+
+   Replaying the file gives the state of every entry, so a tweet that's been
+   added survives a crash until it's either been sent or given up on. Once
+   most of the records in the file are for entries that are finished with,
+   the file is rewritten with just the entries that are still pending (or
+   removed, if there aren't any).
+
+   The file is shared by every process that runs the bot (overlapping cron
+   runs, a streaming process...), so changes to it are made holding an
+   flock() on a lock file, and a process re-reads the file if somebody else
+   has changed it since it last looked. Entries that Due() has handed out
+   are in flight until they're marked sent, retried or dropped, and aren't
+   handed out again in the meantime; Sending() keeps more than one process
+   from sending at once.
+'''
+
+from contextlib import contextmanager
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+import fcntl
+import json
+import os
+
+# we rewrite the file once it has this many more records than pending entries.
+kCompactSlack = 100
+
+
+class Outbox(object):
+   def __init__(self, path):
+      self.path = path
+      self.lock = Lock()
+      # the ids that Due() has handed out and that haven't been marked yet.
+      self.inFlight = set()
+      self.file = None
+      self.Reset()
+      with self.Locked():
+         pass
+
+   def Reset(self):
+      ''' forget what we've read from the file. '''
+      # id : {"msg", "notBefore", "attempts"}, in the order they were added.
+      self.pending = {}
+      self.order = []
+      self.records = 0
+      self.lastScheduled = 0
+      if self.file is not None:
+         self.file.close()
+         self.file = None
+      # (inode, size) of the file as of the last time we read or wrote it.
+      self.fileState = None
+
+   def FileState(self):
+      try:
+         info = os.stat(self.path)
+      except OSError:
+         return None
+      return (info.st_ino, info.st_size)
+
+   @contextmanager
+   def Locked(self):
+      '''
+         Hold our thread lock and the lock on the file, having caught up
+         with any changes that other processes made to the file.
+      '''
+      with self.lock:
+         with open(self.path + ".lock", "a") as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+               if self.FileState() != self.fileState:
+                  self.Reset()
+                  self.Load()
+               yield
+            finally:
+               fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+   @contextmanager
+   def Sending(self):
+      ''' keep any other process from sending from the outbox until we're done. '''
+      with open(self.path + ".send", "a") as lockFile:
+         fcntl.flock(lockFile, fcntl.LOCK_EX)
+         try:
+            yield
+         finally:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+   def Load(self):
+      ''' replay the file; call with the lock held. '''
+      try:
+         with open(self.path, "rt") as f:
+            text = f.read()
+      except IOError:
+         return
+      end = text.rfind("\n") + 1
+      if end < len(text):
+         # we crashed in the middle of writing the last record; cut it off,
+         # or the next record would be appended to the same line and lost.
+         with open(self.path, "r+b") as f:
+            f.truncate(end)
+         text = text[:end]
+      for line in text.split("\n"):
+         try:
+            record = json.loads(line)
+         except ValueError:
+            # a blank line (or some other garbage)
+            continue
+         self.records += 1
+         self.Apply(record)
+      self.fileState = self.FileState()
+
+   def Apply(self, record):
+      op = record["op"]
+      entryId = record["id"]
+      if op == "add":
+         self.pending[entryId] = {"msg": record["msg"],
+            "notBefore": record["notBefore"], "attempts": 0}
+         self.order.append(entryId)
+         self.lastScheduled = max(self.lastScheduled, record["notBefore"])
+      elif entryId in self.pending:
+         if op == "retry":
+            self.pending[entryId]["attempts"] = record["attempts"]
+            self.pending[entryId]["notBefore"] = record["notBefore"]
+         else:
+            del self.pending[entryId]
+
+   def Write(self, record):
+      ''' apply a record and append it to the file; call with the lock held. '''
+      self.Apply(record)
+      if self.file is None:
+         self.file = open(self.path, "at")
+      self.file.write(json.dumps(record) + "\n")
+      # it's not safe in the outbox until it's out of our buffer.
+      self.file.flush()
+      self.records += 1
+      self.fileState = self.FileState()
+
+   def Add(self, msg, pacing=0):
+      '''
+         Queue a dict of update_status() arguments. If `pacing` is given,
+         it's not sent until at least that many seconds after the last entry
+         that was queued.
+      '''
+      with self.Locked():
+         notBefore = time()
+         if pacing:
+            notBefore = max(notBefore, self.lastScheduled + pacing)
+         self.Write({"op": "add", "id": uuid4().hex, "msg": msg,
+            "notBefore": notBefore})
+
+   def DueIds(self, now):
+      ''' call with the lock held. '''
+      self.order = [i for i in self.order if i in self.pending]
+      return [i for i in self.order if i not in self.inFlight and
+         self.pending[i]["notBefore"] <= now]
+
+   def Due(self, now=None):
+      '''
+         Return [(id, entry)] for the entries that can be sent now, oldest
+         first. They're in flight until they're passed to MarkSent(),
+         MarkRetry() or MarkDropped() (or Release()), so another call won't
+         return them again.
+      '''
+      now = time() if now is None else now
+      with self.Locked():
+         due = self.DueIds(now)
+         self.inFlight.update(due)
+         return [(i, self.pending[i]) for i in due]
+
+   def HasDue(self, now=None):
+      now = time() if now is None else now
+      with self.Locked():
+         return bool(self.DueIds(now))
+
+   def Release(self, entryIds):
+      ''' put entries that we didn't get to back in the outbox. '''
+      with self.lock:
+         self.inFlight.difference_update(entryIds)
+
+   def MarkSent(self, entryId):
+      with self.Locked():
+         self.inFlight.discard(entryId)
+         self.Write({"op": "sent", "id": entryId})
+
+   def MarkRetry(self, entryId, attempts, notBefore, error):
+      with self.Locked():
+         self.inFlight.discard(entryId)
+         self.Write({"op": "retry", "id": entryId, "attempts": attempts,
+            "notBefore": notBefore, "error": error})
+
+   def MarkDropped(self, entryId, error):
+      with self.Locked():
+         self.inFlight.discard(entryId)
+         self.Write({"op": "dropped", "id": entryId, "error": error})
+
+   def Compact(self, force=False):
+      '''
+         Rewrite the file with only the pending entries if it's mostly
+         records that we no longer need.
+      '''
+      with self.Locked():
+         if (not force and self.pending and 
+            self.records <= len(self.pending) + kCompactSlack):
+            return
+         if self.file is not None:
+            self.file.close()
+            self.file = None
+         if not self.pending:
+            if os.path.exists(self.path):
+               os.remove(self.path)
+            self.records = 0
+            self.fileState = None
+            return
+         tmpPath = self.path + ".tmp"
+         with open(tmpPath, "wt") as f:
+            for entryId in self.order:
+               entry = self.pending.get(entryId)
+               if entry is None:
+                  continue
+               f.write(json.dumps({"op": "add", "id": entryId,
+                  "msg": entry["msg"], "notBefore": entry["notBefore"]}) + "\n")
+               if entry["attempts"]:
+                  f.write(json.dumps({"op": "retry", "id": entryId,
+                     "attempts": entry["attempts"],
+                     "notBefore": entry["notBefore"], "error": None}) + "\n")
+         os.rename(tmpPath, self.path)
+         self.fileState = self.FileState()
+         self.order = [i for i in self.order if i in self.pending]
+         self.records = len(self.pending) + sum(1 for i in self.order
+            if self.pending[i]["attempts"])
+
+   def Close(self):
+      with self.lock:
+         if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,239 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   profiler.py -- cProfile a bot run (or just some of its methods) and keep
+   the results within a fixed amount of disk space.
+
+   Each profiled run writes two files into the profile directory:
+
+   - <botName>-<date>-<time>-<pid>.prof: the cProfile stats, for use with
+     pstats, snakeviz, etc.
+   - <botName>-<date>-<time>-<pid>.collapsed: the same data as "collapsed
+     stacks" (`a;b;c <microseconds>` per line) that flamegraph.pl or
+     speedscope can draw.
+
+   cProfile only records which function called which, not whole stacks, so
+   the collapsed stacks are reconstructed by walking down from the top level
+   functions and splitting each function's time between its callers in
+   proportion to how much of it each one was responsible for. That's exact
+   for functions that are only called from one place, and a good estimate
+   for the rest.
+
+   After each run, the oldest files for this bot are deleted until the
+   directory fits into `maxBytes`.
+
+   A wrapped method that's a coroutine (see asyncBot.py) is profiled a step 
+   at a time while it runs, leaving out the time it spends waiting.
+'''
+
+from datetime import datetime
+from functools import wraps
+from glob import glob
+from threading import Lock
+from threading import local
+from types import GeneratorType
+
+import cProfile
+import os
+import pstats
+import re
+import sys
+
+# paths that account for less than this fraction of the total time are
+# left out of the collapsed stacks.
+kMinFraction = 0.0001
+kMaxDepth = 100
+
+# switching the profiler off is the last thing that it sees.
+kProfilerDisable = "<method 'disable' of '_lsprof.Profiler' objects>"
+
+
+class RunProfiler(object):
+   def __init__(self, path, botName, maxBytes=20 * 1024 * 1024):
+      '''
+         path: directory to write profiles into
+         botName: used to name (and find) the files
+         maxBytes: the most space that this bot's profiles may use
+      '''
+      self.path = path
+      self.botName = botName
+      self.maxBytes = maxBytes
+      self.lock = Lock()
+      # each thread that we profile on needs its own cProfile.Profile
+      self.profilers = []
+      self.local = local()
+
+   def Profiler(self):
+      ''' return the profiler for the current thread. '''
+      profiler = getattr(self.local, "profiler", None)
+      if profiler is None:
+         profiler = self.local.profiler = cProfile.Profile()
+         self.local.depth = 0
+         with self.lock:
+            self.profilers.append(profiler)
+      return profiler
+
+   def Start(self):
+      ''' profile everything on this thread until Stop() is called. '''
+      self.Profiler().enable()
+      self.local.depth = 1
+
+   def Enter(self):
+      profiler = self.Profiler()
+      # don't let a nested call to another profiled method switch the
+      # profiler off on its way out.
+      if self.local.depth == 0:
+         profiler.enable()
+      self.local.depth += 1
+
+   def Exit(self):
+      self.local.depth -= 1
+      if self.local.depth == 0:
+         self.local.profiler.disable()
+
+   def Wrap(self, method):
+      ''' return a version of `method` that's profiled each time it's called. '''
+      @wraps(method)
+      def Profiled(*args, **kwargs):
+         self.Enter()
+         try:
+            result = method(*args, **kwargs)
+         finally:
+            self.Exit()
+         if isinstance(result, GeneratorType):
+            # (calling a coroutine only creates it)
+            return self.ProfileCoroutine(result)
+         return result
+      return Profiled
+
+   def ProfileCoroutine(self, coroutine):
+      ''' drive `coroutine`, profiling each step that it takes. '''
+      value = excInfo = None
+      while True:
+         self.Enter()
+         try:
+            if excInfo:
+               yielded = coroutine.throw(*excInfo)
+            else:
+               yielded = coroutine.send(value)
+         finally:
+            self.Exit()
+         value = excInfo = None
+         try:
+            value = yield yielded
+         except GeneratorExit:
+            coroutine.close()
+            raise
+         except Exception:
+            excInfo = sys.exc_info()
+
+   def Stop(self):
+      '''
+         Stop profiling, write out whatever we collected, and remove old
+         profiles if we're over our disk budget.
+      '''
+      if getattr(self.local, "depth", 0):
+         self.local.profiler.disable()
+         self.local.depth = 0
+      with self.lock:
+         profilers, self.profilers = self.profilers, []
+      stats = None
+      for profiler in profilers:
+         profiler.create_stats()
+         if not profiler.stats:
+            continue
+         if stats is None:
+            stats = pstats.Stats(profiler)
+         else:
+            stats.add(profiler)
+      if stats is None:
+         return
+
+      if not os.path.isdir(self.path):
+         os.makedirs(self.path)
+      base = os.path.join(self.path, "{0}-{1}-{2}".format(self.botName,
+         datetime.now().strftime("%Y%m%d-%H%M%S"), os.getpid()))
+      stats.dump_stats(base + ".prof")
+      self.WriteCollapsed(stats.stats, base + ".collapsed")
+      self.Prune()
+
+   def WriteCollapsed(self, stats, fileName):
+      '''
+         Write the (reconstructed) collapsed stacks for a pstats dict of
+         {function: (primitive calls, calls, own time, total time, callers)}
+      '''
+      callees = {}
+      for func, (_, _, _, _, callers) in stats.items():
+         for caller, edge in callers.items():
+            callees.setdefault(caller, {})[func] = edge
+      roots = [func for func, value in stats.items() 
+         if not value[4] and func[2] != kProfilerDisable]
+      total = sum(stats[func][3] for func in roots)
+      minTime = total * kMinFraction
+      stacks = {}
+
+      def Label(func):
+         fileName, line, name = func
+         if fileName == "~":
+            # a built-in; the name says it all.
+            return name
+         return "{0} ({1}:{2})".format(name, os.path.basename(fileName), line)
+
+      def Walk(func, stack, onStack, share):
+         ''' `share` is the fraction of `func`'s time that this stack accounts for '''
+         ownTime = stats[func][2]
+         stack = stack + [Label(func)]
+         onStack = onStack | set([func])
+         key = ";".join(stack)
+         stacks[key] = stacks.get(key, 0) + ownTime * share
+         if len(stack) >= kMaxDepth:
+            return
+         for callee, edge in callees.get(func, {}).items():
+            # (recursive calls are already counted in the outer call)
+            calleeTotal = stats[callee][3]
+            edgeTime = edge[3] * share
+            if callee in onStack or calleeTotal <= 0 or edgeTime < minTime:
+               continue
+            Walk(callee, stack, onStack, min(1.0, edgeTime / calleeTotal))
+
+      for func in roots:
+         Walk(func, [], frozenset(), 1.0)
+      with open(fileName, "wt") as f:
+         for stack in sorted(stacks):
+            micros = int(round(stacks[stack] * 1000000))
+            if micros:
+               f.write("{0} {1}\n".format(stack, micros))
+
+   def Prune(self):
+      ''' delete this bot's oldest profiles until they fit in maxBytes. '''
+      # (other bots' names may start with ours, e.g. 'tock' and 'tock-extra')
+      ours = re.compile(re.escape(self.botName) + 
+         r"-\d{8}-\d{6}-\d+\.(prof|collapsed)$")
+      files = [f for f in glob(os.path.join(self.path, self.botName + "-*"))
+         if ours.match(os.path.basename(f))]
+      files = sorted((os.path.getmtime(f), os.path.getsize(f), f) for f in files)
+      used = sum(size for _, size, _ in files)
+      # never delete the pair that we just wrote.
+      for _, size, fileName in files[:-2]:
+         if used <= self.maxBytes:
+            break
+         os.remove(fileName)
+         used -= size
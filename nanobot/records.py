@@ -0,0 +1,281 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   records.py -- a compact, read-mostly stand-in for the dict of a mention or
+   a stream event.
+
+   A tweet or event decoded from json is a tree of dicts and unicode strings
+   (the user, entities, a quoted status...) that takes up several times the
+   space of its json text, and most handlers only look at a few fields of
+   it. A Record keeps the json text plus just the fields in `kFields`. The
+   text is decoded once when the Record is made, to pick those out, and 
+   the rest of the tree is thrown away right after; it's only decoded 
+   again if a handler asks for something else. (So a Record costs as much
+   time to make as a dict does, but holding on to one -- e.g. in a batch
+   of events -- takes a fraction of the memory.)
+
+   Records are dicts (`r['user']['screen_name']`, `r.get('target_object')`,
+   `'event' in r`, `r.items()`, `r.copy()`, `json.dumps(r)`...); a nested
+   object like `r['user']` comes back as a RecordObject, which is one too. 
+   Anything but reading one of the kept fields decodes the whole record for
+   good. The one catch is that in Python 2, `dict(r)`, `{}.update(r)` and 
+   `f(**r)` look straight at a dict's own storage, which only holds a 
+   placeholder until the record has been decoded -- use `r.copy()` (or 
+   `ToDict()`) for those.
+'''
+
+import json
+
+# the fields that a Record keeps. (key,) entries for objects just remember
+# whether the object is there.
+kFields = (
+   ("id",), ("id_str",), ("text",), ("event",), ("created_at",),
+   ("in_reply_to_status_id_str",),
+   ("user",), ("user", "id_str"), ("user", "screen_name"),
+   ("source",), ("source", "id_str"), ("source", "screen_name"),
+   ("target",), ("target", "id_str"), ("target", "screen_name"),
+   ("target_object",), ("target_object", "id_str"),
+)
+kFieldIndex = dict((path, index) for index, path in enumerate(kFields))
+
+
+class Marker(object):
+   def __init__(self, name):
+      self.name = name
+
+   def __repr__(self):
+      return self.name
+
+# a field that isn't in the record at all.
+kMissing = Marker("kMissing")
+# a field whose value is an object (see RecordObject).
+kObject = Marker("kObject")
+# the only key in the storage of an undecoded Record (or a RecordObject). 
+# Some of Python's C code (e.g. json.dumps()) takes a dict that's empty at
+# that level to be empty, without asking our methods.
+kUndecoded = Marker("kUndecoded")
+
+
+class SlimDict(dict):
+   '''
+      What Records and RecordObjects have in common: apart from reading the
+      fields that a Record kept, everything works on the whole decoded 
+      object, which Whole() returns. `record` is the Record that a 
+      RecordObject is part of, and `key` is where it is in that Record; a 
+      Record has neither.
+   '''
+   __slots__ = ("record", "key")
+
+   def Whole(self):
+      '''
+         Decode the Record that this is (or is part of) for good, and 
+         return the whole of this object.
+      '''
+      if self.record is None:
+         return self.Decode()
+      return dict.__getitem__(self.record.Decode(), self.key)
+
+   def ToDict(self):
+      return self.Whole()
+
+   def get(self, key, default=None):
+      try:
+         return self[key]
+      except KeyError:
+         return default
+
+   def has_key(self, key):
+      return key in self
+
+   def __setitem__(self, key, value):
+      dict.__setitem__(self.Whole(), key, value)
+
+   def __delitem__(self, key):
+      dict.__delitem__(self.Whole(), key)
+
+   def __iter__(self):
+      return dict.__iter__(self.Whole())
+
+   def __len__(self):
+      return dict.__len__(self.Whole())
+
+   def keys(self):
+      return dict.keys(self.Whole())
+
+   def values(self):
+      return dict.values(self.Whole())
+
+   def items(self):
+      return dict.items(self.Whole())
+
+   def iterkeys(self):
+      return dict.iterkeys(self.Whole())
+
+   def itervalues(self):
+      return dict.itervalues(self.Whole())
+
+   def iteritems(self):
+      return dict.iteritems(self.Whole())
+
+   def viewkeys(self):
+      return dict.viewkeys(self.Whole())
+
+   def viewvalues(self):
+      return dict.viewvalues(self.Whole())
+
+   def viewitems(self):
+      return dict.viewitems(self.Whole())
+
+   def copy(self):
+      ''' a plain dict (but a shallow copy, like dict.copy()) '''
+      return dict.copy(self.Whole())
+
+   def update(self, *args, **kwargs):
+      dict.update(self.Whole(), *args, **kwargs)
+
+   def pop(self, key, *default):
+      return dict.pop(self.Whole(), key, *default)
+
+   def popitem(self):
+      return dict.popitem(self.Whole())
+
+   def setdefault(self, key, default=None):
+      return dict.setdefault(self.Whole(), key, default)
+
+   def clear(self):
+      dict.clear(self.Whole())
+
+   def __eq__(self, other):
+      if isinstance(other, SlimDict):
+         other = other.Whole()
+      return dict.__eq__(self.Whole(), other)
+
+   def __ne__(self, other):
+      return not self == other
+
+   __hash__ = None
+
+   def __reduce__(self):
+      # (copied and pickled as plain dicts)
+      return (dict, (self.copy(),))
+
+
+class Record(SlimDict):
+   __slots__ = ("raw", "fields", "decoded")
+
+   def __init__(self, raw):
+      '''
+         raw: the json text of the object
+      '''
+      self.record = self.key = None
+      self.raw = raw
+      self.decoded = False
+      dict.__setitem__(self, kUndecoded, True)
+      data = json.loads(raw)
+      fields = []
+      for path in kFields:
+         value = data.get(path[0], kMissing)
+         if len(path) == 2:
+            value = value.get(path[1], kMissing) if isinstance(value, dict) else kMissing
+         elif isinstance(value, dict) and value:
+            value = kObject
+         fields.append(value)
+      self.fields = tuple(fields)
+
+   def Decode(self):
+      ''' decode the whole object into ourselves, and return ourselves. '''
+      if not self.decoded:
+         dict.clear(self)
+         dict.update(self, json.loads(self.raw))
+         self.decoded = True
+         self.raw = self.fields = None
+      return self
+
+   def Field(self, path):
+      '''
+         Return the value that we kept for `path`, or kMissing if it's not
+         there; raises LookupError if we didn't keep it.
+      '''
+      index = kFieldIndex.get(path)
+      if index is None or self.decoded:
+         raise LookupError(path)
+      return self.fields[index]
+
+   def __getitem__(self, key):
+      try:
+         value = self.Field((key,))
+      except LookupError:
+         return dict.__getitem__(self.Decode(), key)
+      if value is kMissing:
+         raise KeyError(key)
+      if value is kObject:
+         return RecordObject(self, key)
+      return value
+
+   def __contains__(self, key):
+      try:
+         return self.Field((key,)) is not kMissing
+      except LookupError:
+         return dict.__contains__(self.Decode(), key)
+
+   def __nonzero__(self):
+      # (without this, `record or {}` would decode the whole thing to find
+      # out whether it was empty)
+      if self.decoded:
+         return dict.__len__(self) > 0
+      return self.raw != "{}"
+
+   def __repr__(self):
+      if self.decoded:
+         return "Record({0})".format(dict.__repr__(self)[:100])
+      return "Record({0})".format(self.raw[:100])
+
+
+class RecordObject(SlimDict):
+   ''' one of the objects inside a Record, e.g. `record['user']` '''
+   __slots__ = ()
+
+   def __init__(self, record, key):
+      self.record = record
+      self.key = key
+      dict.__setitem__(self, kUndecoded, True)
+
+   def __getitem__(self, key):
+      try:
+         value = self.record.Field((self.key, key))
+      except LookupError:
+         return self.Whole()[key]
+      if value is kMissing:
+         raise KeyError(key)
+      return value
+
+   def __contains__(self, key):
+      try:
+         return self.record.Field((self.key, key)) is not kMissing
+      except LookupError:
+         return key in self.Whole()
+
+   def __nonzero__(self):
+      # empty objects are kept as {}, not as RecordObjects.
+      return True
+
+   def __repr__(self):
+      return "RecordObject({0!r})".format(self.key)
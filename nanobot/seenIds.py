@@ -0,0 +1,152 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   seenIds.py -- a fixed-size, on-disk record of the mentions and events that
+   a bot has already handled, so that they aren't handled twice if we crash
+   before saving our settings.
+
+   Keys are checked against:
+   - an exact window of the most recently added keys
+   - the highest numeric key (tweet ids) that we've seen; tweet ids grow over
+     time, so anything newer than that can't have been seen yet.
+   - a rolling pair of Bloom filters. When the current filter has had
+     `capacity` keys added to it, or is older than half of `maxAge` seconds,
+     it becomes the previous filter and the old previous filter is thrown
+     away, so the index never grows and old keys age out.
+
+   A Bloom filter can (rarely) claim that it has seen a key that it hasn't;
+   the false positive rate per filter is set by `errorRate`.
+'''
+
+from collections import deque
+from hashlib import md5
+from threading import Lock
+from time import time
+
+import math
+import os
+import struct
+
+kVersion = 1
+kHeader = struct.Struct(">IIIIdQI")
+
+
+class SeenIdIndex(object):
+   def __init__(self, path, capacity=20000, errorRate=0.0001,
+         maxAge=30 * 24 * 60 * 60, windowSize=1000):
+      self.path = path
+      self.capacity = capacity
+      self.maxAge = maxAge
+      self.windowSize = windowSize
+      self.bitCount = int(math.ceil(-capacity * math.log(errorRate) / math.log(2) ** 2))
+      self.hashCount = max(1, int(round(self.bitCount * math.log(2) / capacity)))
+      self.lock = Lock()
+      self.Clear()
+      self.Load()
+
+   def Clear(self):
+      byteCount = (self.bitCount + 7) // 8
+      self.current = bytearray(byteCount)
+      self.previous = bytearray(byteCount)
+      self.count = 0
+      self.created = time()
+      self.highest = 0
+      self.window = deque()
+      self.windowSet = set()
+      self.dirty = False
+
+   def Load(self):
+      try:
+         with open(self.path, "rb") as f:
+            data = f.read()
+      except IOError:
+         return
+      version, bitCount, hashCount, count, created, highest, windowSize = \
+         kHeader.unpack_from(data)
+      if (version, bitCount, hashCount) != (kVersion, self.bitCount, self.hashCount):
+         # the index was built with different parameters; start over.
+         return
+      byteCount = len(self.current)
+      pos = kHeader.size
+      self.current = bytearray(data[pos:pos + byteCount])
+      self.previous = bytearray(data[pos + byteCount:pos + 2 * byteCount])
+      self.count = count
+      self.created = created
+      self.highest = highest
+      keys = data[pos + 2 * byteCount:].split("\n") if windowSize else []
+      for key in keys:
+         self.AddToWindow(key)
+
+   def Save(self):
+      ''' write the index out via a temp file, so a crash can't corrupt it. '''
+      with self.lock:
+         if not self.dirty:
+            return
+         header = kHeader.pack(kVersion, self.bitCount, self.hashCount,
+            self.count, self.created, self.highest, len(self.window))
+         tmpPath = self.path + ".tmp"
+         with open(tmpPath, "wb") as f:
+            f.write(header)
+            f.write(self.current)
+            f.write(self.previous)
+            f.write("\n".join(self.window))
+         os.rename(tmpPath, self.path)
+         self.dirty = False
+
+   def Positions(self, key):
+      digest = md5(key).digest()
+      h1, h2 = struct.unpack(">QQ", digest)
+      return [(h1 + i * h2) % self.bitCount for i in xrange(self.hashCount)]
+
+   def AddToWindow(self, key):
+      self.window.append(key)
+      self.windowSet.add(key)
+      if len(self.window) > self.windowSize:
+         self.windowSet.discard(self.window.popleft())
+
+   def Add(self, key):
+      key = str(key)
+      with self.lock:
+         if self.count >= self.capacity or time() - self.created > self.maxAge / 2:
+            self.previous = self.current
+            self.current = bytearray(len(self.previous))
+            self.count = 0
+            self.created = time()
+         for pos in self.Positions(key):
+            self.current[pos >> 3] |= 1 << (pos & 7)
+         self.count += 1
+         self.dirty = True
+         self.AddToWindow(key)
+         if key.isdigit():
+            self.highest = max(self.highest, int(key))
+
+   def __contains__(self, key):
+      key = str(key)
+      with self.lock:
+         if key in self.windowSet:
+            return True
+         if key.isdigit() and int(key) > self.highest:
+            return False
+         positions = self.Positions(key)
+         for bits in (self.current, self.previous):
+            if all(bits[pos >> 3] & (1 << (pos & 7)) for pos in positions):
+               return True
+      return False
@@ -0,0 +1,184 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   spool.py -- lets more than one consumer (overlapping cron runs, or threads
+   in one run) take saved stream events out of the per-file spool without
+   handling any of them twice.
+
+   A consumer claims a spool file by renaming it into a claim directory of
+   its own (claims/<host>-<pid>-<worker>/). rename() is atomic, so exactly
+   one consumer gets each file; the others find that it's gone and move on
+   to the next one. Once an event has been handled, its claimed file is
+   deleted.
+
+   A consumer that crashes leaves its claims behind. Consumers touch their
+   claim directory as they work, and a claim directory that hasn't been
+   touched for `staleAfter` seconds -- or that belongs to a process on this
+   host that isn't running any more -- has its files put back into the
+   spool by the next consumer that comes along.
+'''
+
+from glob import glob
+from random import shuffle
+from time import time
+
+import errno
+import os
+import socket
+
+kClaimDir = "claims"
+
+
+def IsRunning(pid):
+   ''' is there a process with this id (on this host)? '''
+   try:
+      os.kill(pid, 0)
+   except OSError as e:
+      return e.errno != errno.ESRCH
+   return True
+
+
+class Spool(object):
+   def __init__(self, path, extension, worker=0, staleAfter=600):
+      '''
+         path: the directory that the spool files are written into
+         extension: the spool files' extension (e.g. ".stream")
+         worker: tells apart the consumers in one process
+         staleAfter: seconds after which another consumer's claims are
+            considered abandoned
+      '''
+      self.path = path
+      self.extension = extension
+      self.staleAfter = staleAfter
+      self.host = socket.gethostname()
+      self.pid = os.getpid()
+      self.claimPath = os.path.join(path, kClaimDir, "{0}-{1}-{2}".format(
+         self.host, self.pid, worker))
+      self.listing = []
+      self.lastTouched = 0
+
+   def Files(self):
+      ''' the files that nobody has claimed yet. '''
+      return glob(os.path.join(self.path, "*" + self.extension))
+
+   def Claim(self, count=None):
+      '''
+         Claim up to `count` (default: all) of the unclaimed files, returning
+         their new paths.
+      '''
+      self.Touch()
+      claimed = []
+      listed = False
+      while count is None or len(claimed) < count:
+         if not self.listing:
+            if listed:
+               break
+            # (in a different order from every other consumer, so that we
+            # don't all fight over the same files)
+            self.listing = self.Files()
+            shuffle(self.listing)
+            listed = True
+            if not self.listing:
+               break
+         fileName = self.listing.pop()
+         claimedName = os.path.join(self.claimPath, os.path.basename(fileName))
+         try:
+            os.rename(fileName, claimedName)
+         except OSError as e:
+            if e.errno != errno.ENOENT:
+               raise
+            # somebody else got it first.
+            continue
+         claimed.append(claimedName)
+      return claimed
+
+   def Done(self, claimedName):
+      ''' we've handled this claimed file, so it can go. '''
+      os.remove(claimedName)
+      if time() - self.lastTouched > self.staleAfter / 4.0:
+         self.Touch()
+
+   def Claimed(self):
+      ''' the files that we've claimed and not finished with yet. '''
+      return glob(os.path.join(self.claimPath, "*" + self.extension))
+
+   def Release(self, claimedNames=None):
+      ''' put `claimedNames` (default: all of our claims) back in the spool. '''
+      if claimedNames is None:
+         claimedNames = self.Claimed()
+      for claimedName in claimedNames:
+         try:
+            os.rename(claimedName, os.path.join(self.path,
+               os.path.basename(claimedName)))
+         except OSError as e:
+            if e.errno != errno.ENOENT:
+               raise
+
+   def Close(self):
+      ''' release anything we still have, and remove our claim directory. '''
+      self.Release()
+      try:
+         os.rmdir(self.claimPath)
+      except OSError:
+         pass
+
+   def Touch(self):
+      ''' show the other consumers that we're still working. '''
+      try:
+         os.utime(self.claimPath, None)
+      except OSError as e:
+         if e.errno != errno.ENOENT:
+            raise
+         try:
+            os.makedirs(self.claimPath)
+         except OSError as e:
+            if e.errno != errno.EEXIST:
+               raise
+      self.lastTouched = time()
+
+   def IsStale(self, claimPath, now):
+      host, pid, _ = os.path.basename(claimPath).rsplit("-", 2)
+      if host == self.host and int(pid) != self.pid and not IsRunning(int(pid)):
+         return True
+      try:
+         return now - os.path.getmtime(claimPath) > self.staleAfter
+      except OSError:
+         # it's just been removed by its owner.
+         return False
+
+   def RecoverStale(self):
+      '''
+         Put the files claimed by consumers that seem to have died back into
+         the spool, and return how many there were.
+      '''
+      now = time()
+      recovered = 0
+      for claimPath in glob(os.path.join(self.path, kClaimDir, "*-*-*")):
+         if claimPath == self.claimPath or not self.IsStale(claimPath, now):
+            continue
+         claimedNames = glob(os.path.join(claimPath, "*" + self.extension))
+         self.Release(claimedNames)
+         recovered += len(claimedNames)
+         try:
+            os.rmdir(claimPath)
+         except OSError:
+            pass
+      return recovered
@@ -0,0 +1,384 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   streamer.py -- the object that sits waiting for events from the twitter
+   streaming API when a bot is run with `--stream`.
+
+   This lives in its own module so that bots that never stream (and most
+   runs of the ones that do) don't need to import it.
+
+   `StreamForever()` keeps the stream connected: when the connection drops,
+   twitter sends an error, or nothing (not even a keep-alive newline) has 
+   arrived for the stall timeout given to the constructor, we reconnect 
+   after a backoff that doubles with each failure in a row (with jitter, so
+   that a lot of bots don't all reconnect at once), following twitter's
+   guidelines at https://dev.twitter.com/streaming/overview/connecting
+
+   While we're streaming, a background thread saves the bot's state every 
+   'streamSaveInterval' seconds or 'streamSaveEvents' events (whichever 
+   comes first), writing out the profile of what happened since the last 
+   time if there is one (see Nanobot.StartProfiling()), and -- if events 
+   are being handled in this process -- is the one thread that sends the 
+   tweets that the handlers queue up.
+'''
+
+from Queue import Full
+from Queue import Queue
+from calendar import timegm
+from random import uniform
+from threading import Event
+from threading import Thread
+from time import sleep
+from time import strptime
+from time import time
+from requests.exceptions import ConnectionError
+from requests.packages.urllib3.exceptions import ReadTimeoutError
+from twython import TwythonStreamer
+from uuid import uuid4
+
+import json
+import os.path
+
+from nanobot import kStreamFileExtension
+
+
+# (first delay, longest delay) in seconds for each kind of failure:
+kBackoff = {
+   # the connection dropped or stalled; back off gently.
+   "network"   : (0.25, 16),
+   # twitter sent an HTTP error.
+   "http"      : (5, 320),
+   # we're reconnecting too often (420) or are rate limited (429).
+   "rateLimit" : (60, 960),
+}
+
+# a connection that stays up this long (in seconds) is considered healthy,
+# and the next failure starts the backoff over.
+kHealthyConnection = 60
+
+# how often (in seconds) we report our stats while we're streaming.
+kStatsInterval = 60
+
+# how often (in seconds) the background thread looks for tweets in the 
+# outbox that have come due (e.g. retries) when nobody has woken it up.
+kSendInterval = 10
+
+kTwitterTimeFormat = "%a %b %d %H:%M:%S +0000 %Y"
+
+
+class StreamStalled(Exception):
+   pass
+
+
+class StreamHttpError(Exception):
+   def __init__(self, statusCode):
+      Exception.__init__(self, "HTTP error {0}".format(statusCode))
+      self.statusCode = statusCode
+
+
+class NanobotStreamer(TwythonStreamer):
+   def __init__(self, *args, **kwargs):
+      TwythonStreamer.__init__(self, *args, **kwargs)
+      self.path = "."
+      self.journal = None
+      self.queue = None
+      self.bot = None
+      self.running = False
+      self.stats = {
+         # when the current connection was made (None if we're not connected)
+         "connectedSince": None,
+         # total seconds connected, not counting the current connection
+         "uptime": 0,
+         "reconnects": 0,
+         "stalls": 0,
+         "errors": 0,
+         "lastError": None,
+         "events": 0,
+         # seconds between an event happening and our getting it
+         "lastEventLag": None,
+         "maxEventLag": None,
+      }
+      self.lastReport = time()
+      # see StartBackground()
+      self.background = None
+      self.wake = Event()
+      self.stopping = False
+      self.tweetsWaiting = False
+      self.eventsSinceSave = 0
+      self.saveEvents = None
+
+   def SetOutputPath(self, path):
+      self.path = path
+
+   def SetJournal(self, journal):
+      ''' If we're given an EventJournal, events are appended to it instead
+         of being written out one per file.
+      '''
+      self.journal = journal
+
+   def StartDispatch(self, bot, workerCount, queueSize):
+      ''' Instead of waiting for the next cron run to pick events up from
+         disk, push them onto a bounded queue that `workerCount` threads
+         pull from, handing each event to the bot right away. If the queue 
+         is full, events go to disk as usual.
+      '''
+      self.queue = Queue(queueSize)
+      for i in range(workerCount):
+         worker = Thread(target=self.DispatchEvents, args=(bot,))
+         worker.daemon = True
+         worker.start()
+
+   def DispatchEvents(self, bot):
+      ''' Body of each of the dispatch worker threads. '''
+      while True:
+         data = self.queue.get()
+         try:
+            bot.HandleOneStreamEvent(data)
+            # there's no end-of-run for tweets to wait for in streaming mode;
+            # the background thread sends them.
+            self.tweetsWaiting = True
+            self.wake.set()
+         except Exception as e:
+            bot.Log("ERROR", [str(e)])
+         finally:
+            self.queue.task_done()
+
+   def StopDispatch(self):
+      ''' 
+         Wait for any events that are in the queue to be handled, and for 
+         the background thread to send what they tweeted and finish.
+      '''
+      if self.queue is not None:
+         self.queue.join()
+      if self.background is not None:
+         self.stopping = True
+         self.wake.set()
+         self.background.join()
+         self.background = None
+
+   def StartBackground(self, bot):
+      ''' start the background thread (see the top of this file) '''
+      self.saveEvents = bot.settings.GetOrDefault("streamSaveEvents", 100)
+      self.stopping = False
+      bot.StartProfiling()
+      self.background = Thread(target=self.Background, args=(bot,
+         bot.settings.GetOrDefault("streamSaveInterval", 60)))
+      self.background.daemon = True
+      self.background.start()
+
+   def Background(self, bot, saveInterval):
+      ''' Body of the background thread. '''
+      lastSend = lastSave = time()
+      while True:
+         self.wake.wait(min(kSendInterval, saveInterval))
+         self.wake.clear()
+         stopping = self.stopping
+         now = time()
+         try:
+            if self.queue is not None and (self.tweetsWaiting or stopping or 
+               now - lastSend >= kSendInterval):
+               self.tweetsWaiting = False
+               lastSend = now
+               bot.SendTweets()
+            # (whoever stopped us saves the state one last time)
+            if not stopping and (now - lastSave >= saveInterval or 
+               self.eventsSinceSave >= self.saveEvents):
+               self.eventsSinceSave = 0
+               lastSave = now
+               # the handlers may be changing the settings while we write 
+               # them out; if that trips us up, we'll try again next time.
+               bot.SaveState()
+               bot.StopProfiling()
+               bot.StartProfiling()
+         except Exception as e:
+            bot.Log("ERROR", [str(e)])
+         if stopping:
+            break
+
+   def StreamForever(self, bot, connect=None):
+      '''
+         Stream until Stop() is called (or we get a KeyboardInterrupt),
+         reconnecting whenever the connection fails. `connect` is what opens
+         the stream -- by default the user stream, or the URL in the bot's
+         'streamUrl' setting if there is one (e.g. a local stand-in API).
+         Reconnects, stalls and our stats are logged and sent to the bot's 
+         metrics.
+      '''
+      self.bot = bot
+      if self.background is None:
+         self.StartBackground(bot)
+      if connect is None:
+         url = bot.settings.streamUrl
+         if url:
+            connect = lambda: self._request(url, params={})
+         else:
+            connect = self.user
+      maxBackoff = bot.settings.streamMaxBackoff
+      self.running = True
+      failures = 0
+      while self.running:
+         start = time()
+         self.stats["connectedSince"] = start
+         bot.metrics.SetGauge("stream_connected", 1)
+         try:
+            connect()
+            # the server hung up on us (or we were stopped)
+            kind, reason = "network", "closed"
+         except StreamStalled:
+            self.stats["stalls"] += 1
+            kind, reason = "network", "stalled"
+         except ConnectionError as e:
+            # the connection dropped, or stalled while we were reading it.
+            if e.args and isinstance(e.args[0], ReadTimeoutError):
+               self.stats["stalls"] += 1
+               kind, reason = "network", "stalled"
+            else:
+               kind, reason = "network", "dropped"
+            self.stats["lastError"] = str(e)
+         except StreamHttpError as e:
+            kind, reason = ("rateLimit" if e.statusCode in (420, 429) else "http",
+               str(e.statusCode))
+         except Exception as e:
+            # anything else (e.g. we couldn't write an event to disk); 
+            # treat it like an HTTP error so we don't spin.
+            kind, reason = "http", type(e).__name__
+            self.stats["errors"] += 1
+            self.stats["lastError"] = str(e)
+         finally:
+            self.stats["uptime"] += time() - start
+            self.stats["connectedSince"] = None
+            bot.metrics.SetGauge("stream_connected", 0)
+
+         if not self.running:
+            break
+         if time() - start >= kHealthyConnection:
+            failures = 0
+         first, longest = kBackoff[kind]
+         if maxBackoff is not None:
+            longest = min(longest, maxBackoff)
+         delay = min(longest, first * 2 ** failures)
+         # "equal jitter" -- somewhere between half and all of the delay.
+         delay = uniform(delay / 2.0, delay)
+         failures += 1
+         self.stats["reconnects"] += 1
+         bot.metrics.Increment("stream_reconnects", reason=kind)
+         bot.Log("StreamReconnect", [reason, "{0:.2f}".format(delay)])
+         self.ReportStats()
+         sleep(delay)
+
+   def Stop(self):
+      ''' make StreamForever() return once the current connection ends. '''
+      self.running = False
+      self.disconnect()
+
+   def Uptime(self):
+      ''' total seconds that we've been connected. '''
+      since = self.stats["connectedSince"]
+      return self.stats["uptime"] + (time() - since if since else 0)
+
+   def ReportStats(self):
+      ''' log our stats and send them to the bot's metrics. '''
+      self.lastReport = time()
+      if self.bot is None:
+         return
+      stats = self.stats
+      self.bot.Log("StreamStats", ["{0}={1}".format(key, stats[key]) for key in
+         ("reconnects", "stalls", "errors", "events", "lastEventLag", 
+          "maxEventLag")] + ["uptime={0:.0f}".format(self.Uptime())])
+      self.bot.metrics.SetGauge("stream_uptime_seconds", self.Uptime())
+      self.bot.metrics.Flush()
+
+   def TrackEvent(self, data):
+      ''' update our stats for an event that we just got. '''
+      now = time()
+      self.stats["events"] += 1
+      self.eventsSinceSave += 1
+      if self.saveEvents and self.eventsSinceSave >= self.saveEvents:
+         self.wake.set()
+      try:
+         lag = max(0, now - timegm(strptime(data["created_at"], 
+            kTwitterTimeFormat)))
+      except (KeyError, TypeError, ValueError):
+         lag = None
+      if lag is not None:
+         self.stats["lastEventLag"] = lag
+         self.stats["maxEventLag"] = max(lag, self.stats["maxEventLag"])
+         if self.bot:
+            self.bot.metrics.Observe("stream_event_lag", lag)
+      if now - self.lastReport >= kStatsInterval:
+         self.ReportStats()
+
+   def on_success(self, data):
+      ''' Called when we detect an event through the streaming API. 
+         The base class version looks for quoted tweets and for each one it 
+         finds, we write out a text file that contains the ID of the tweet 
+         that mentions us.
+         
+         The other (cron-job) version of your bot will look for any files with the 
+         correct extension (identified by `kStreamFileExtension`) in its 
+         HandleQuotes() method and favorite^H^H^H^H like those tweets.
+
+         See https://dev.twitter.com/streaming/userstreams
+      '''
+      # for now, all we're interested in handling are events. 
+      if 'event' in data:
+         self.TrackEvent(data)
+         if self.queue is not None:
+            try:
+               self.queue.put_nowait(data)
+               return
+            except Full:
+               # the handlers can't keep up; save this one for later.
+               pass
+         if self.journal:
+            self.journal.Append(data)
+            return
+         # Dump the data into a JSON file for the other cron-process to 
+         # handle the next time it wakes up.
+         fileName = os.path.join(self.path, "{0}{1}".format(
+            uuid4().hex, kStreamFileExtension))
+         # (written under another name first, so that nobody can claim it 
+         # before it's all there)
+         with open(fileName + ".tmp", "wt") as f:
+            f.write(json.dumps(data).encode("utf-8"))
+         os.rename(fileName + ".tmp", fileName)
+         
+
+   def on_error(self, status_code, data):
+      '''
+         Twython calls this for an HTTP error, or (with a 200 status) when
+         something in the stream isn't valid json. We drop the connection
+         for the first, and StreamForever() will reconnect.
+      '''
+      self.stats["errors"] += 1
+      self.stats["lastError"] = "{0}: {1}".format(status_code, data)
+      if self.bot:
+         self.bot.Log("StreamError", [str(status_code), str(data)[:200]])
+      if status_code != 200:
+         raise StreamHttpError(status_code)
+
+   def on_timeout(self):
+      ''' 
+         Twython calls this when connecting times out, and then tries again
+         right away; we'd rather back off first. (Stalls once we're connected
+         show up as a requests ConnectionError instead)
+      '''
+      raise StreamStalled()
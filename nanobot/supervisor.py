@@ -0,0 +1,235 @@
+#! /usr/bin/env/python
+
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   supervisor.py -- host many Nanobot-derived bots in a single process,
+   running their ticks on a shared pool of worker threads.
+
+   The bots to run are listed in a json manifest file that looks like:
+
+   {
+      "poolSize": 4,
+      "tickInterval": 60,
+      "reportInterval": 3600,
+      "bots": [
+         {
+            "class": "tockbot.Tockbot",
+            "botPath": "/home/bots/tockbot",
+            "botName": "tockbot",
+            "args": {"debug": false}
+         },
+         ...
+      ]
+   }
+
+   Each bot's module is loaded from its `botPath` (which is also added to 
+   sys.path, for anything that it imports), so bots can stay as the same 
+   scripts that cron used to launch. Each one is loaded under a module name 
+   of its own, so two bots whose scripts have the same name in different 
+   directories each get their own class. `botName`
+   defaults to the module name, just like `GetBotArguments()` would do, and
+   anything in `args` is added to the argDict that's passed to the bot class.
+
+   Run it with:
+
+   python -m nanobot.supervisor /path/to/manifest.json
+'''
+
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+from time import sleep
+from time import time
+
+import hashlib
+import imp
+import importlib
+import json
+import os.path
+import sys
+
+
+class SupervisedBot(object):
+   '''
+      Book-keeping for one of the bots that the supervisor is hosting.
+   '''
+   def __init__(self, name, bot):
+      self.name = name
+      self.bot = bot
+      self.busy = False
+      self.ticks = 0
+      self.errors = 0
+      self.lastLatency = 0.0
+      self.totalLatency = 0.0
+      self.maxLatency = 0.0
+
+   def AddTiming(self, elapsed):
+      self.ticks += 1
+      self.lastLatency = elapsed
+      self.totalLatency += elapsed
+      self.maxLatency = max(self.maxLatency, elapsed)
+
+   def MeanLatency(self):
+      if not self.ticks:
+         return 0.0
+      return self.totalLatency / self.ticks
+
+
+class Supervisor(object):
+   '''
+      Creates each of the bots listed in a manifest and runs their ticks
+      on a shared thread pool. A bot that raises an exception has it logged
+      to its own log file; the other bots keep running.
+   '''
+   def __init__(self, manifest, debug=False):
+      self.poolSize = manifest.get("poolSize", 4)
+      self.tickInterval = manifest.get("tickInterval", 60)
+      self.reportInterval = manifest.get("reportInterval", 60 * 60)
+      self.debug = debug
+      self.lock = Lock()
+      self.bots = []
+      for entry in manifest.get("bots", []):
+         try:
+            self.bots.append(self.CreateBot(entry))
+         except Exception as e:
+            # a bot that can't even be created doesn't stop the others.
+            print "ERROR creating bot {0}: {1}".format(entry.get("class"), str(e))
+
+   @classmethod
+   def FromFile(cls, manifestPath, debug=False):
+      with open(manifestPath, "rt") as f:
+         manifest = json.loads(f.read())
+      return cls(manifest, debug)
+
+   def CreateBot(self, entry):
+      '''
+         Import the class named in this manifest entry and create an instance
+         of it using the same argDict contract that `CreateAndRun()` uses.
+      '''
+      moduleName, className = entry["class"].rsplit(".", 1)
+      botPath = os.path.abspath(entry.get("botPath", "."))
+      if botPath not in sys.path:
+         sys.path.append(botPath)
+      botClass = getattr(self.LoadModule(moduleName, botPath), className)
+
+      argDict = {'debug': self.debug, 'force': False, 'stream': False,
+         'daemon': False, 'botPath': botPath,
+         'botName': entry.get("botName", moduleName.split(".")[-1])}
+      argDict.update(entry.get("args", {}))
+
+      bot = botClass(argDict)
+      bot.Start()
+      return SupervisedBot(argDict['botName'], bot)
+
+   def LoadModule(self, moduleName, botPath):
+      '''
+         Load the bot's module from its source file in `botPath`, under a 
+         name that's unique to that file. (A module that isn't there, e.g. 
+         one that's been installed as part of a package, is imported as 
+         usual.)
+      '''
+      sourcePath = os.path.join(botPath, *moduleName.split(".")) + ".py"
+      if not os.path.exists(sourcePath):
+         return importlib.import_module(moduleName)
+      uniqueName = "supervised_{0}_{1}".format(moduleName.replace(".", "_"),
+         hashlib.md5(sourcePath).hexdigest()[:12])
+      module = sys.modules.get(uniqueName)
+      if module is None:
+         module = imp.load_source(uniqueName, sourcePath)
+      return module
+
+   def TickBot(self, supervised):
+      ''' Executed on a pool thread. '''
+      start = time()
+      try:
+         supervised.bot.Tick()
+      except Exception as e:
+         supervised.errors += 1
+         try:
+            supervised.bot.Log("ERROR", [str(e)])
+         except Exception:
+            print "ERROR in {0}: {1}".format(supervised.name, str(e))
+      finally:
+         with self.lock:
+            supervised.AddTiming(time() - start)
+            supervised.busy = False
+
+   def Report(self):
+      '''
+         Return a list of strings, one per bot, with its tick count, error
+         count, and last/mean/max tick latency in milliseconds.
+      '''
+      lines = []
+      with self.lock:
+         for s in self.bots:
+            lines.append("{0}\tticks={1}\terrors={2}\tlast={3:.1f}ms\t"
+               "mean={4:.1f}ms\tmax={5:.1f}ms".format(s.name, s.ticks, s.errors,
+               s.lastLatency * 1000, s.MeanLatency() * 1000, s.maxLatency * 1000))
+      return lines
+
+   def Run(self):
+      '''
+         Submit a tick for every bot once per `tickInterval` seconds. If a
+         bot's previous tick is still running, we skip it this time instead
+         of letting its ticks pile up in the pool.
+      '''
+      pool = ThreadPool(self.poolSize)
+      lastReport = time()
+      try:
+         while True:
+            start = time()
+            for supervised in self.bots:
+               with self.lock:
+                  if supervised.busy:
+                     continue
+                  supervised.busy = True
+               pool.apply_async(self.TickBot, (supervised,))
+
+            if self.debug or start - lastReport >= self.reportInterval:
+               print "{0}\n{1}".format(datetime.now(), "\n".join(self.Report()))
+               lastReport = start
+            sleep(max(0, self.tickInterval - (time() - start)))
+      except KeyboardInterrupt:
+         pass
+      finally:
+         pool.close()
+         pool.join()
+         for supervised in self.bots:
+            try:
+               supervised.bot.SaveState()
+               supervised.bot.CallHook(supervised.bot.PostRun)
+            except Exception as e:
+               print "ERROR stopping {0}: {1}".format(supervised.name, str(e))
+
+
+def GetSupervisorArguments():
+   import argparse
+   parser = argparse.ArgumentParser()
+   parser.add_argument("manifest", help="path to the json bot manifest file")
+   parser.add_argument("--debug", action='store_true',
+      help="print to stdout instead of tweeting")
+   return vars(parser.parse_args())
+
+
+if __name__ == "__main__":
+   args = GetSupervisorArguments()
+   Supervisor.FromFile(args['manifest'], args['debug']).Run()
@@ -0,0 +1,207 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   test_gateway.py -- which calls the ApiGateway makes, defers and drops, and
+   how it accounts for them.
+
+   python -m unittest discover tests
+'''
+
+from collections import defaultdict
+from time import time
+
+import json
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+   ".."))
+
+from twython.exceptions import TwythonError
+from twython.exceptions import TwythonRateLimitError
+
+from nanobot import gateway
+from nanobot.gateway import ApiGateway
+from nanobot.jsonSettings import JsonSettings
+from nanobot.metrics import NullMetrics
+
+
+class FakeClient(object):
+   '''
+      Stands in for a Twython object: records the calls that are made, and
+      raises whatever is in `errors` (by tweet id) instead of making them.
+   '''
+   def __init__(self):
+      self.calls = []
+      self.errors = {}
+      self.headers = {}
+
+   def Call(self, name, kwargs):
+      error = self.errors.get(kwargs.get("id"))
+      if error:
+         raise error
+      self.calls.append((name, kwargs))
+      return {"name": name}
+
+   def update_status(self, **kwargs):
+      return self.Call("update_status", kwargs)
+
+   def create_favorite(self, **kwargs):
+      return self.Call("create_favorite", kwargs)
+
+   def get_mentions_timeline(self, **kwargs):
+      return self.Call("get_mentions_timeline", kwargs)
+
+   def get_lastfunction_header(self, header):
+      return self.headers.get(header)
+
+
+class CountingMetrics(NullMetrics):
+   def __init__(self):
+      self.counts = defaultdict(int)
+
+   def Increment(self, name, amount=1, **labels):
+      self.counts[(name, labels.get("endpoint"))] += amount
+
+
+class GatewayTest(unittest.TestCase):
+   def setUp(self):
+      self.path = tempfile.mkdtemp()
+      self.settingsFile = os.path.join(self.path, "bot.json")
+      with open(self.settingsFile, "wt") as f:
+         f.write(json.dumps({}))
+      self.settings = JsonSettings(self.settingsFile)
+      self.client = FakeClient()
+      self.logged = []
+      self.maxDeferred = gateway.kMaxDeferred
+
+   def tearDown(self):
+      gateway.kMaxDeferred = self.maxDeferred
+      shutil.rmtree(self.path)
+
+   def Gateway(self, writeBudget):
+      self.metrics = CountingMetrics()
+      return ApiGateway(self.client, self.settings, 0.5, self.metrics,
+         self.Log, writeBudget)
+
+   def Log(self, eventType, dataList):
+      self.logged.append((eventType, dataList))
+
+   def Made(self, name):
+      return [kwargs["id"] for callName, kwargs in self.client.calls
+         if callName == name]
+
+   def Deferred(self):
+      return [(name, kwargs["id"]) for name, kwargs in
+         self.settings.rateLimits["deferred"]]
+
+   def testWriteBudgetKeepsReserveForStatuses(self):
+      api = self.Gateway(writeBudget=10)
+      for i in range(8):
+         api.create_favorite(id=i)
+      # favorites stop once half of the budget (the reserve) is left...
+      self.assertEqual(range(5), self.Made("create_favorite"))
+      for i in range(8):
+         api.update_status(status="hi", id=100 + i)
+      # ...which is kept for status updates.
+      self.assertEqual(range(100, 105), self.Made("update_status"))
+      self.assertEqual(3, self.metrics.counts[("api_deferred", "create_favorite")])
+      self.assertEqual(3, self.metrics.counts[("api_deferred", "update_status")])
+      self.assertEqual(6, len(self.Deferred()))
+      self.assertEqual([], self.logged)
+
+   def testNoWriteBudget(self):
+      api = self.Gateway(writeBudget=0)
+      for i in range(50):
+         api.create_favorite(id=i)
+      self.assertEqual(range(50), self.Made("create_favorite"))
+      self.assertEqual([], self.Deferred())
+
+   def testReadsAreNotDeferred(self):
+      api = self.Gateway(writeBudget=0)
+      # twitter says that there are no calls left in this window.
+      self.client.headers = {"x-rate-limit-remaining": "0",
+         "x-rate-limit-limit": "75", "x-rate-limit-reset": str(int(time()) + 60)}
+      self.assertNotEqual(None, api.get_mentions_timeline(id=1))
+      self.assertEqual(None, api.get_mentions_timeline(id=2))
+      self.assertEqual([1], self.Made("get_mentions_timeline"))
+      self.assertEqual([], self.Deferred())
+      self.assertEqual(1,
+         self.metrics.counts[("api_deferred", "get_mentions_timeline")])
+
+   def testRateLimitErrorDefers(self):
+      api = self.Gateway(writeBudget=0)
+      self.client.errors[1] = TwythonRateLimitError("slow down", 429,
+         retry_after=int(time()) + 60)
+      self.assertEqual(None, api.update_status(status="hi", id=1))
+      self.assertEqual([("update_status", 1)], self.Deferred())
+      # ...and nothing more is sent to that endpoint until it resets.
+      del self.client.errors[1]
+      api.update_status(status="hi", id=2)
+      self.assertEqual([], self.Made("update_status"))
+      self.assertEqual(1, self.metrics.counts[("api_errors", "update_status")])
+
+   def testTooManyDeferredAreDropped(self):
+      gateway.kMaxDeferred = 3
+      api = self.Gateway(writeBudget=1)
+      for i in range(6):
+         api.update_status(status="hi", id=i)
+      self.assertEqual([0], self.Made("update_status"))
+      self.assertEqual([1, 2, 3], [theId for name, theId in self.Deferred()])
+      self.assertEqual(3, self.metrics.counts[("api_deferred", "update_status")])
+      self.assertEqual(2, self.metrics.counts[("api_dropped", "update_status")])
+      self.assertEqual(["ApiCallDropped"] * 2,
+         [eventType for eventType, data in self.logged])
+      name, kwargs, reason = self.logged[0][1]
+      self.assertEqual("update_status", name)
+      self.assertEqual(4, json.loads(kwargs)["id"])
+      self.assertEqual("too many deferred calls", reason)
+
+   def testRetryDeferred(self):
+      api = self.Gateway(writeBudget=1)
+      api.update_status(status="hi", id=0)
+      for i in range(1, 4):
+         api.create_favorite(id=i)
+      api.update_status(status="hi", id=4)
+      self.assertEqual(4, len(self.Deferred()))
+      self.settings.Write()
+
+      # a later run, with a bigger budget: a favorite of a tweet that's
+      # gone is dropped, one that fails for some other reason stays
+      # deferred, and status updates go first.
+      self.settings = JsonSettings(self.settingsFile)
+      self.client = FakeClient()
+      self.client.errors[1] = TwythonError("not found", 404)
+      self.client.errors[2] = TwythonError("over capacity", 503)
+      api = self.Gateway(writeBudget=100)
+      api.RetryDeferred()
+      self.assertEqual([("update_status", 4), ("create_favorite", 3)],
+         [(name, kwargs["id"]) for name, kwargs in self.client.calls])
+      self.assertEqual([("create_favorite", 2)], self.Deferred())
+      self.assertEqual(1, self.metrics.counts[("api_dropped", "create_favorite")])
+      self.assertEqual("ApiCallDropped", self.logged[0][0])
+
+
+if __name__ == "__main__":
+   unittest.main()
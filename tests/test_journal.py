@@ -0,0 +1,110 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   test_journal.py -- reading and appending to the stream event journal
+   after a writer stopped part of the way through a record.
+
+   python -m unittest discover tests
+'''
+
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+   ".."))
+
+from nanobot.journal import EventJournal
+from nanobot.journal import kHeader
+
+
+class TornRecordTest(unittest.TestCase):
+   def setUp(self):
+      self.path = tempfile.mkdtemp()
+      self.journal = EventJournal(self.path, segmentSize=1024)
+
+   def tearDown(self):
+      self.journal.Close()
+      shutil.rmtree(self.path)
+
+   def Tear(self, keep):
+      '''
+         Append the first `keep` bytes of a record to the last segment, as
+         a writer that crashed part of the way through would have.
+      '''
+      self.journal.Close()
+      payload = '{"id": "torn"}'
+      record = kHeader.pack(len(payload)) + payload
+      base, fileName = self.journal.Segments()[-1]
+      with open(fileName, "ab") as f:
+         f.write(record[:keep])
+      return os.path.getsize(fileName)
+
+   def testReadStopsAtPartialRecord(self):
+      for i in range(3):
+         self.journal.Append({"id": i})
+      self.journal.Close()
+      end = os.path.getsize(self.journal.Segments()[-1][1])
+      # a header with no payload yet, and a payload that's cut short.
+      for keep in (kHeader.size, kHeader.size + 3):
+         self.Tear(keep)
+         events = list(self.journal.Read())
+         self.assertEqual([0, 1, 2], [data["id"] for offset, data in events])
+         self.assertEqual(end, events[-1][0])
+         # ...and nothing past the last whole record.
+         self.assertEqual([], list(self.journal.Read(end)))
+         self.journal.TruncateTornRecord(self.journal.Segments()[-1][1])
+
+   def testAppendAfterTornRecord(self):
+      self.journal.Append({"id": 0})
+      self.Tear(kHeader.size + 3)
+      # a new writer cuts the torn record off before it appends.
+      journal = EventJournal(self.path, segmentSize=1024)
+      journal.Append({"id": 1})
+      journal.Close()
+      self.assertEqual([0, 1], [data["id"] for offset, data in journal.Read()])
+
+   def testTruncateTornHeader(self):
+      self.journal.Append({"id": 0})
+      self.journal.Close()
+      fileName = self.journal.Segments()[-1][1]
+      whole = os.path.getsize(fileName)
+      self.Tear(2)
+      self.journal.TruncateTornRecord(fileName)
+      self.assertEqual(whole, os.path.getsize(fileName))
+
+   def testReadAcrossSegments(self):
+      for i in range(100):
+         self.journal.Append({"id": i, "pad": "x" * 50})
+      self.journal.Close()
+      self.assertTrue(len(self.journal.Segments()) > 1)
+      events = list(self.journal.Read())
+      self.assertEqual(range(100), [data["id"] for offset, data in events])
+      # picking up from a committed offset skips what was already handled.
+      offset = events[49][0]
+      self.assertEqual(range(50, 100),
+         [data["id"] for o, data in self.journal.Read(offset)])
+
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,133 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   test_jsonSettings.py -- the settings change log.
+
+   python -m unittest discover tests
+'''
+
+import json
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+   ".."))
+
+from nanobot.jsonSettings import JsonSettings
+
+
+class ChangeLogTest(unittest.TestCase):
+   def setUp(self):
+      self.path = tempfile.mkdtemp()
+      self.settingsFile = os.path.join(self.path, "bot.json")
+      with open(self.settingsFile, "wt") as f:
+         f.write(json.dumps({"a": 1}))
+
+   def tearDown(self):
+      shutil.rmtree(self.path)
+
+   def Load(self):
+      settings = JsonSettings(self.settingsFile)
+      settings.EnableChangeLog()
+      return settings
+
+   def WriteLog(self, text):
+      with open(self.settingsFile + ".log", "wt") as f:
+         f.write(text)
+
+   def testReplay(self):
+      settings = self.Load()
+      settings.a = 2
+      settings.Write()
+      settings.b = "x"
+      settings.Write()
+      self.assertTrue(os.path.exists(settings.ChangeLogPath()))
+      settings = self.Load()
+      self.assertEqual(2, settings.a)
+      self.assertEqual("x", settings.b)
+
+   def testTornLine(self):
+      # a crash in the middle of writing {"a": 3}, and two more changes
+      # written after it.
+      self.WriteLog('{"a": 2}\n{"a": 3{"b": "important"}\n{"c": "also"}\n')
+      settings = self.Load()
+      self.assertEqual(2, settings.a)
+      self.assertEqual("also", settings.c)
+      settings.d = "later"
+      settings.Write()
+      settings = self.Load()
+      self.assertEqual("also", settings.c)
+      self.assertEqual("later", settings.d)
+
+   def testTornLastLine(self):
+      self.WriteLog('{"a": 2}\n{"a": 3')
+      settings = self.Load()
+      self.assertEqual(2, settings.a)
+      settings.b = "important"
+      settings.Write()
+      settings.c = "also"
+      settings.Write()
+      settings = self.Load()
+      self.assertEqual(2, settings.a)
+      self.assertEqual("important", settings.b)
+      self.assertEqual("also", settings.c)
+
+
+class SharedFileTest(unittest.TestCase):
+   ''' two processes (e.g. a bot's cron runs and its stream) '''
+   def setUp(self):
+      self.path = tempfile.mkdtemp()
+      self.settingsFile = os.path.join(self.path, "bot.json")
+      with open(self.settingsFile, "wt") as f:
+         f.write(json.dumps({"lastMentionId": 100}))
+
+   def tearDown(self):
+      shutil.rmtree(self.path)
+
+   def Check(self, stream, cron):
+      cron.lastMentionId = 500
+      cron.journalOffset = 4096
+      cron.Write()
+      stream.rateLimits = {"buckets": {}}
+      stream.Write()
+      settings = JsonSettings(self.settingsFile)
+      self.assertEqual(500, settings.lastMentionId)
+      self.assertEqual(4096, settings.journalOffset)
+      self.assertEqual({"buckets": {}}, settings.rateLimits)
+
+   def testKeepOtherChanges(self):
+      stream = JsonSettings(self.settingsFile)
+      self.Check(stream, JsonSettings(self.settingsFile))
+
+   def testKeepOtherChangesInLog(self):
+      stream = JsonSettings(self.settingsFile)
+      cron = JsonSettings(self.settingsFile)
+      cron.EnableChangeLog()
+      # (the stream process folds the cron process's log in)
+      self.Check(stream, cron)
+      self.assertFalse(os.path.exists(cron.ChangeLogPath()))
+
+
+if __name__ == "__main__":
+   unittest.main()
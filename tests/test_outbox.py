@@ -0,0 +1,146 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   test_outbox.py -- handing out tweets to send from the outbox, sharing it
+   between processes, and picking up after a crash.
+
+   (Two Outbox objects on the same file stand in for two processes.)
+
+   python -m unittest discover tests
+'''
+
+from time import time
+
+import json
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+   ".."))
+
+from nanobot.outbox import Outbox
+
+
+class OutboxTest(unittest.TestCase):
+   def setUp(self):
+      self.path = tempfile.mkdtemp()
+      self.outboxPath = os.path.join(self.path, "bot.outbox")
+
+   def tearDown(self):
+      shutil.rmtree(self.path)
+
+   def Statuses(self, due):
+      return [entry["msg"]["status"] for entryId, entry in due]
+
+   def testDueClaimsEntries(self):
+      outbox = Outbox(self.outboxPath)
+      for status in ("a", "b", "c"):
+         outbox.Add({"status": status})
+      due = outbox.Due()
+      self.assertEqual(["a", "b", "c"], self.Statuses(due))
+      # they're in flight, so they aren't handed out twice...
+      self.assertEqual([], outbox.Due())
+      self.assertFalse(outbox.HasDue())
+      # ...until they're released or marked.
+      outbox.Release([due[1][0]])
+      outbox.MarkSent(due[0][0])
+      self.assertEqual(["b"], self.Statuses(outbox.Due()))
+
+   def testPacing(self):
+      outbox = Outbox(self.outboxPath)
+      for status in ("a", "b", "c"):
+         outbox.Add({"status": status}, pacing=60)
+      now = time()
+      self.assertEqual(["a"], self.Statuses(outbox.Due(now)))
+      self.assertEqual(["b"], self.Statuses(outbox.Due(now + 60)))
+      self.assertEqual(["c"], self.Statuses(outbox.Due(now + 120)))
+
+   def testRetryAndDrop(self):
+      outbox = Outbox(self.outboxPath)
+      outbox.Add({"status": "a"})
+      outbox.Add({"status": "b"})
+      (idA, entryA), (idB, entryB) = outbox.Due()
+      now = time()
+      outbox.MarkRetry(idA, 1, now + 30, "503")
+      outbox.MarkDropped(idB, "duplicate")
+      self.assertEqual([], outbox.Due(now))
+      self.assertEqual(["a"], self.Statuses(outbox.Due(now + 30)))
+      # ...and the same is true after a rewrite of the file.
+      outbox.Compact(force=True)
+      reloaded = Outbox(self.outboxPath)
+      due = reloaded.Due(now + 30)
+      self.assertEqual(["a"], self.Statuses(due))
+      self.assertEqual(1, due[0][1]["attempts"])
+
+   def testCompactRemovesEmptyOutbox(self):
+      outbox = Outbox(self.outboxPath)
+      outbox.Add({"status": "a"})
+      for entryId, entry in outbox.Due():
+         outbox.MarkSent(entryId)
+      outbox.Compact()
+      self.assertFalse(os.path.exists(self.outboxPath))
+
+   def testSharedBetweenProcesses(self):
+      one = Outbox(self.outboxPath)
+      two = Outbox(self.outboxPath)
+      one.Add({"status": "a"})
+      due = two.Due()
+      self.assertEqual(["a"], self.Statuses(due))
+      two.MarkSent(due[0][0])
+      self.assertFalse(one.HasDue())
+      # a rewrite by one of them is picked up by the other.
+      two.Add({"status": "b"})
+      two.Compact(force=True)
+      one.Add({"status": "c"})
+      self.assertEqual(["b", "c"], self.Statuses(Outbox(self.outboxPath).Due()))
+
+   def testClaimsDontOutliveProcess(self):
+      outbox = Outbox(self.outboxPath)
+      outbox.Add({"status": "a"})
+      with outbox.Sending():
+         self.assertEqual(["a"], self.Statuses(outbox.Due()))
+      # the process that claimed it died without marking it; the lock files
+      # are still there, but the next process can send it.
+      self.assertTrue(os.path.exists(self.outboxPath + ".lock"))
+      self.assertTrue(os.path.exists(self.outboxPath + ".send"))
+      nextRun = Outbox(self.outboxPath)
+      with nextRun.Sending():
+         self.assertEqual(["a"], self.Statuses(nextRun.Due()))
+
+   def testTornRecord(self):
+      outbox = Outbox(self.outboxPath)
+      outbox.Add({"status": "a"})
+      outbox.Close()
+      with open(self.outboxPath, "at") as f:
+         f.write(json.dumps({"op": "add", "id": "torn",
+            "msg": {"status": "b"}, "notBefore": 0})[:20])
+      reloaded = Outbox(self.outboxPath)
+      # the partial record is cut off, so what's appended next isn't lost.
+      reloaded.Add({"status": "c"})
+      reloaded.Close()
+      self.assertEqual(["a", "c"], self.Statuses(Outbox(self.outboxPath).Due()))
+
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,111 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   test_seenIds.py -- the seen id index: how often it's wrong, and what it
+   remembers across runs.
+
+   python -m unittest discover tests
+'''
+
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+   ".."))
+
+from nanobot.seenIds import SeenIdIndex
+
+
+class SeenIdTest(unittest.TestCase):
+   def setUp(self):
+      self.path = tempfile.mkdtemp()
+      self.indexPath = os.path.join(self.path, "bot.seen")
+
+   def tearDown(self):
+      shutil.rmtree(self.path)
+
+   def testFalsePositiveRate(self):
+      # (no window, and keys that aren't numbers, so that only the Bloom
+      # filters answer)
+      seen = SeenIdIndex(self.indexPath, capacity=2000, errorRate=0.01,
+         windowSize=0)
+      for i in range(2000):
+         seen.Add("seen-{0}".format(i))
+      for i in range(2000):
+         self.assertTrue("seen-{0}".format(i) in seen)
+      falsePositives = sum(1 for i in range(20000)
+         if "unseen-{0}".format(i) in seen)
+      # a full filter should be close to its error rate; allow twice that.
+      self.assertTrue(falsePositives < 20000 * 0.01 * 2, falsePositives)
+
+   def testNewerThanHighest(self):
+      seen = SeenIdIndex(self.indexPath, windowSize=0)
+      seen.Add("1000")
+      self.assertTrue("1000" in seen)
+      self.assertTrue(1000 in seen)
+      self.assertFalse("1001" in seen)
+
+   def testOldKeysAgeOut(self):
+      seen = SeenIdIndex(self.indexPath, capacity=10, windowSize=5)
+      for i in range(30):
+         seen.Add("key-{0}".format(i))
+      # the last 20 are in the current and previous filters...
+      for i in range(10, 30):
+         self.assertTrue("key-{0}".format(i) in seen)
+      # ...and the filter that held the first 10 is gone.
+      self.assertFalse(any("key-{0}".format(i) in seen for i in range(10)))
+
+   def testPersistence(self):
+      seen = SeenIdIndex(self.indexPath, windowSize=3)
+      for key in ("a", "b", "c", "d", "123"):
+         seen.Add(key)
+      seen.Save()
+      loaded = SeenIdIndex(self.indexPath, windowSize=3)
+      for key in ("a", "b", "c", "d", "123"):
+         self.assertTrue(key in loaded)
+      self.assertEqual(["c", "d", "123"], list(loaded.window))
+      self.assertEqual(123, loaded.highest)
+      self.assertEqual(seen.count, loaded.count)
+      self.assertFalse("124" in loaded)
+
+   def testSaveOnlyWhenChanged(self):
+      seen = SeenIdIndex(self.indexPath)
+      seen.Save()
+      self.assertFalse(os.path.exists(self.indexPath))
+      seen.Add("a")
+      seen.Save()
+      self.assertTrue(os.path.exists(self.indexPath))
+
+   def testDifferentParametersStartOver(self):
+      seen = SeenIdIndex(self.indexPath, capacity=100)
+      seen.Add("a")
+      seen.Save()
+      # the saved filters don't fit an index of a different size.
+      other = SeenIdIndex(self.indexPath, capacity=200, windowSize=0)
+      self.assertFalse("a" in other)
+      self.assertEqual(0, other.count)
+
+
+if __name__ == "__main__":
+   unittest.main()
@@ -0,0 +1,129 @@
+# Copyright (c) 2016 Brett g Porter
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+'''
+   test_spool.py -- claiming spool files, and getting back the ones that a
+   consumer that died had claimed.
+
+   python -m unittest discover tests
+'''
+
+from time import time
+
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+   ".."))
+
+from nanobot.spool import Spool
+from nanobot.spool import kClaimDir
+
+kExtension = ".stream"
+
+
+class SpoolTest(unittest.TestCase):
+   def setUp(self):
+      self.path = tempfile.mkdtemp()
+      for i in range(50):
+         self.WriteFile(self.path, i)
+
+   def tearDown(self):
+      shutil.rmtree(self.path)
+
+   def WriteFile(self, path, i):
+      with open(os.path.join(path, "{0:04d}{1}".format(i, kExtension)), "wt") as f:
+         f.write("{}")
+
+   def Names(self, paths):
+      return set(os.path.basename(p) for p in paths)
+
+   def ClaimDir(self, name):
+      ''' a claim directory for some other consumer, holding one file. '''
+      claimPath = os.path.join(self.path, kClaimDir, name)
+      os.makedirs(claimPath)
+      self.WriteFile(claimPath, 99)
+      return claimPath
+
+   def testEachFileClaimedOnce(self):
+      one = Spool(self.path, kExtension, worker=0)
+      two = Spool(self.path, kExtension, worker=1)
+      claimedOne = []
+      claimedTwo = []
+      while True:
+         batchOne = one.Claim(5)
+         batchTwo = two.Claim(5)
+         if not (batchOne or batchTwo):
+            break
+         claimedOne.extend(batchOne)
+         claimedTwo.extend(batchTwo)
+      self.assertEqual(50, len(claimedOne) + len(claimedTwo))
+      self.assertEqual(set(), self.Names(claimedOne) & self.Names(claimedTwo))
+      self.assertEqual([], one.Files())
+      self.assertEqual(self.Names(claimedOne), self.Names(one.Claimed()))
+
+   def testDoneAndRelease(self):
+      spool = Spool(self.path, kExtension)
+      claimed = spool.Claim(10)
+      for claimedName in claimed[:4]:
+         spool.Done(claimedName)
+      spool.Release(claimed[4:6])
+      self.assertEqual(42, len(spool.Files()))
+      # closing puts back whatever we still had.
+      spool.Close()
+      self.assertEqual(46, len(spool.Files()))
+      self.assertFalse(os.path.exists(spool.claimPath))
+
+   def testRecoverDeadProcess(self):
+      spool = Spool(self.path, kExtension)
+      # (a process that has exited, so its pid isn't running)
+      child = subprocess.Popen(["true"])
+      child.wait()
+      claimPath = self.ClaimDir("{0}-{1}-0".format(spool.host, child.pid))
+      self.assertEqual(1, spool.RecoverStale())
+      self.assertTrue("0099" + kExtension in self.Names(spool.Files()))
+      self.assertFalse(os.path.exists(claimPath))
+
+   def testRecoverByAge(self):
+      spool = Spool(self.path, kExtension, staleAfter=600)
+      # (on other hosts, so all we can go by is how long they've been idle)
+      old = self.ClaimDir("elsewhere-1-0")
+      then = time() - 601
+      os.utime(old, (then, then))
+      fresh = self.ClaimDir("elsewhere-2-0")
+      self.assertEqual(1, spool.RecoverStale())
+      self.assertFalse(os.path.exists(old))
+      self.assertEqual(["0099" + kExtension], os.listdir(fresh))
+
+   def testLiveClaimsKept(self):
+      spool = Spool(self.path, kExtension, worker=0, staleAfter=600)
+      other = Spool(self.path, kExtension, worker=1, staleAfter=600)
+      claimed = other.Claim(5)
+      # (our own process is running, and it touched its claims just now)
+      self.assertEqual(0, spool.RecoverStale())
+      self.assertEqual(self.Names(claimed), self.Names(other.Claimed()))
+
+
+if __name__ == "__main__":
+   unittest.main()